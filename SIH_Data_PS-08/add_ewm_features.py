@@ -1,8 +1,17 @@
 from __future__ import annotations
 
+import argparse
+import json
+import math
 from pathlib import Path
 
-import pandas as pd
+import feature_kernel
+import ingestion
+import instrumentation
+import storage
+from lazy_imports import lazy_module
+
+pd = lazy_module("pandas")
 
 BASE_DIR = Path(__file__).resolve().parent
 FEATURE_ENGINEERING_DIR = BASE_DIR / "feature_engineering_data"
@@ -25,61 +34,199 @@ VARIABLE_PATTERNS = [
     ("satclockerror", "clock"),
 ]
 EWM_SPANS = [12, 24, 48]
+# Sidecar next to the output holding the recursion state after its last row
+EWM_STATE_SUFFIX = ".ewm_state.json"
 
 
 def add_ewm_features(df: pd.DataFrame) -> tuple[pd.DataFrame, list[str]]:
     """Add exponential weighted moving features."""
-    df = df.copy()
-    created_columns: list[str] = []
-
-    for pattern, short_name in VARIABLE_PATTERNS:
-        matching_cols = [col for col in df.columns if pattern in col]
-        if not matching_cols:
-            print(f"Warning: No column matching '{pattern}' found. Skipping...")
-            continue
-
-        col = matching_cols[0]
-        series = df[col]
-
+    resolved = feature_kernel.resolve_error_columns(df.columns, VARIABLE_PATTERNS)
+    columns = [col for col, _ in resolved]
+    short_names = [short_name for _, short_name in resolved]
+
+    created_columns = feature_kernel.ewm_columns(short_names, EWM_SPANS)
+    block = feature_kernel.feature_block(len(df), created_columns)
+    feature_kernel.fill_ewm(feature_kernel.error_matrix(df, columns), EWM_SPANS, block)
+
+    return feature_kernel.join_block(df, block, created_columns), created_columns
+
+
+def _initial_ewm_state() -> dict[str, float]:
+    return {"mean": math.nan, "cov": 0.0, "sum_wt": 1.0, "sum_wt2": 1.0, "old_wt": 1.0, "nobs": 0}
+
+
+def _ewm_step(state: dict[str, float], value: float, span: int) -> tuple[float, float]:
+    """Advance the ``ewm(span=span, adjust=False)`` mean/std recursion by one sample.
+
+    The arithmetic follows pandas' ewm/ewmcov kernels operation for operation, so
+    resuming from a saved state reproduces ``Series.ewm`` on the full history bit
+    for bit. Returns the mean and std for this sample.
+    """
+    alpha = 1.0 / (1.0 + (span - 1) / 2.0)
+    old_wt_factor = 1.0 - alpha
+    new_wt = alpha
+
+    is_observation = value == value
+    state["nobs"] += int(is_observation)
+    mean = state["mean"]
+    if mean == mean:
+        state["sum_wt"] *= old_wt_factor
+        state["sum_wt2"] *= old_wt_factor * old_wt_factor
+        state["old_wt"] *= old_wt_factor
+        if is_observation:
+            old_wt = state["old_wt"]
+            old_mean = mean
+            if mean != value:
+                mean = ((old_wt * old_mean) + (new_wt * value)) / (old_wt + new_wt)
+            state["cov"] = (
+                (old_wt * (state["cov"] + ((old_mean - mean) * (old_mean - mean))))
+                + (new_wt * ((value - mean) * (value - mean)))
+            ) / (old_wt + new_wt)
+            state["sum_wt"] += new_wt
+            state["sum_wt2"] += new_wt * new_wt
+            old_wt += new_wt
+            state["sum_wt"] /= old_wt
+            state["sum_wt2"] /= old_wt * old_wt
+            state["old_wt"] = 1.0
+            state["mean"] = mean
+    elif is_observation:
+        state["mean"] = value
+
+    if state["nobs"] < 1:
+        return math.nan, math.nan
+    numerator = state["sum_wt"] * state["sum_wt"]
+    denominator = numerator - state["sum_wt2"]
+    variance = (numerator / denominator) * state["cov"] if denominator > 0 else math.nan
+    std = math.nan if variance != variance else math.sqrt(max(variance, 0.0))
+    return state["mean"], std
+
+
+def _state_path(output_path: Path) -> Path:
+    return output_path.with_name(output_path.stem + EWM_STATE_SUFFIX)
+
+
+def _replay_ewm_state(output_path: Path) -> dict:
+    """Rebuild the EWM state by replaying the base columns stored in the output."""
+    header = ingestion.read_header(output_path)
+    columns = {
+        short_name: col for col, short_name in ingestion.find_columns(header, VARIABLE_PATTERNS)
+    }
+    history = ingestion.load(output_path, columns=list(columns.values()))
+
+    series_state = {}
+    for short_name, col in columns.items():
+        values = history[col].to_numpy(dtype="float64").tolist()
         for span in EWM_SPANS:
-            mean_col = f"{short_name}_ewm_mean_{span}"
-            std_col = f"{short_name}_ewm_std_{span}"
+            state = _initial_ewm_state()
+            for value in values:
+                _ewm_step(state, value, span)
+            series_state[f"{short_name}_{span}"] = state
 
-            df[mean_col] = series.ewm(span=span, adjust=False).mean()
-            df[std_col] = series.ewm(span=span, adjust=False).std()
+    last_ts = history["utc_time"].iloc[-1]
+    return {"utc_time": last_ts.isoformat(), "series": series_state}
 
-            created_columns.extend([mean_col, std_col])
 
-    return df, created_columns
+def _load_ewm_state(output_path: Path, last_ts: pd.Timestamp) -> dict:
+    state_path = _state_path(output_path)
+    if state_path.exists():
+        saved = json.loads(state_path.read_text())
+        if pd.Timestamp(saved["utc_time"]) == last_ts:
+            return saved
+    print(f"EWM state for {output_path.name} missing or stale, replaying history once...")
+    return _replay_ewm_state(output_path)
 
 
-def process_dataset(label: str, input_path: Path, output_path: Path) -> None:
-    df = pd.read_csv(input_path)
-    df["utc_time"] = pd.to_datetime(df["utc_time"], errors="coerce")
-    df.sort_values("utc_time", inplace=True)
-    df.set_index("utc_time", inplace=True)
+def process_frame(label: str, df: pd.DataFrame) -> pd.DataFrame:
+    utc = ingestion.parse_times(df["utc_time"])
+    df = df.assign(utc_time=utc).sort_values("utc_time").set_index("utc_time")
 
     shape_before = df.shape
     df_with_features, created_columns = add_ewm_features(df)
     shape_after = df_with_features.shape
 
     df_with_features.reset_index(inplace=True)
-    df_with_features.to_csv(output_path, index=False)
 
     print(f"--- {label} ---")
     print(f"Number of EWM features created: {len(created_columns)}")
     print(f"Shape before: {shape_before}, Shape after: {shape_after}")
-    print("Preview of first 15 rows (showing NaNs):")
-    print(df_with_features.head(15).to_string(index=False))
-    print(f"Output saved to: {output_path}\n")
+    instrumentation.preview(df_with_features, 15, "Preview of first 15 rows (showing NaNs):")
+    return feature_kernel.compact_features(df_with_features)
+
+
+@instrumentation.instrumented("ewm_features")
+def process_dataset(label: str, input_path: Path, output_path: Path) -> None:
+    df = ingestion.load(input_path)
+    resolved_path = storage.save(process_frame(label, df), output_path)
+    # A full recompute invalidates any state carried by earlier appends
+    _state_path(output_path).unlink(missing_ok=True)
+    print(f"Output saved to: {resolved_path}\n")
+
+
+def append_frame(label: str, new_rows: pd.DataFrame, output_path: Path) -> pd.DataFrame:
+    """Compute EWM features for ``new_rows`` from the carried state and append them."""
+    utc = ingestion.parse_times(new_rows["utc_time"])
+    new_rows = new_rows.assign(utc_time=utc).sort_values("utc_time").reset_index(drop=True)
+
+    last_ts = storage.last_timestamp(output_path)
+    if last_ts is not None and new_rows["utc_time"].iloc[0] <= last_ts:
+        raise ValueError(f"Rows to append must be newer than {last_ts} in {output_path.name}")
+    saved = _load_ewm_state(output_path, last_ts) if last_ts is not None else {"series": {}}
+
+    appended = new_rows.copy()
+    for column, short_name in feature_kernel.resolve_error_columns(
+        appended.columns, VARIABLE_PATTERNS
+    ):
+        values = appended[column].to_numpy(dtype="float64").tolist()
+        for span in EWM_SPANS:
+            state = saved["series"].setdefault(f"{short_name}_{span}", _initial_ewm_state())
+            steps = [_ewm_step(state, value, span) for value in values]
+            appended[f"{short_name}_ewm_mean_{span}"] = [mean for mean, _ in steps]
+            appended[f"{short_name}_ewm_std_{span}"] = [std for _, std in steps]
+
+    appended = feature_kernel.compact_features(appended)
+    resolved_path = storage.append(appended, output_path)
+    saved["utc_time"] = appended["utc_time"].iloc[-1].isoformat()
+    _state_path(output_path).write_text(json.dumps(saved, indent=2))
+
+    print(f"--- {label} (append) ---")
+    print(f"Rows appended: {len(appended)}")
+    print(f"Output saved to: {resolved_path}\n")
+    return appended
+
+
+@instrumentation.instrumented("ewm_features_append")
+def append_dataset(label: str, input_path: Path, output_path: Path) -> None:
+    if not storage.resolve_path(output_path).exists():
+        process_dataset(label, input_path, output_path)
+        return
+
+    last_ts = storage.last_timestamp(output_path)
+    new_rows = storage.read_after(input_path, last_ts)
+    if new_rows.empty:
+        print(f"--- {label} (append) ---")
+        print(f"No rows after {last_ts}, nothing to append\n")
+        return
+    append_frame(label, new_rows, output_path)
 
 
 def main() -> None:
+    parser = argparse.ArgumentParser(description="Add exponentially weighted features.")
+    parser.add_argument(
+        "--append",
+        action="store_true",
+        help="only compute features for input rows newer than the existing output",
+    )
+    args = parser.parse_args()
+
     for label, (input_path, output_path) in DATASETS.items():
-        if not input_path.exists():
+        if not storage.resolve_path(input_path).exists():
             print(f"Warning: Input file '{input_path}' not found. Skipping {label}...")
             continue
-        process_dataset(label, input_path, output_path)
+        if args.append:
+            append_dataset(label, input_path, output_path)
+        else:
+            process_dataset(label, input_path, output_path)
+    instrumentation.print_summary()
 
 
 if __name__ == "__main__":
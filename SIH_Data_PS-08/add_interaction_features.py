@@ -3,7 +3,15 @@ from __future__ import annotations
 from pathlib import Path
 
 import numpy as np
-import pandas as pd
+
+import feature_kernel
+import feature_store
+import ingestion
+import instrumentation
+import storage
+from lazy_imports import lazy_module
+
+pd = lazy_module("pandas")
 
 BASE_DIR = Path(__file__).resolve().parent
 FEATURE_ENGINEERING_DIR = BASE_DIR / "feature_engineering_data"
@@ -19,6 +27,12 @@ DATASETS = {
     ),
 }
 
+# Memory-mapped copy of the final feature matrix for training jobs (see feature_store)
+FEATURE_STORE_NAME = "{label}_feature_store"
+FEATURE_STORES = {
+    label: FEATURE_ENGINEERING_DIR / FEATURE_STORE_NAME.format(label=label) for label in DATASETS
+}
+
 EPS = 1e-6
 
 INTERACTION_COLUMNS = [
@@ -54,33 +68,44 @@ def add_interaction_features(df: pd.DataFrame) -> pd.DataFrame:
     return df
 
 
-def process_dataset(label: str, input_path: Path, output_path: Path) -> None:
-    df = pd.read_csv(input_path)
-    df["utc_time"] = pd.to_datetime(df["utc_time"], errors="coerce")
-    df.sort_values("utc_time", inplace=True)
-    df.set_index("utc_time", inplace=True)
+def process_frame(label: str, df: pd.DataFrame) -> pd.DataFrame:
+    utc = ingestion.parse_times(df["utc_time"])
+    df = df.assign(utc_time=utc).sort_values("utc_time").set_index("utc_time")
 
     shape_before = df.shape
     df_with_features = add_interaction_features(df)
     shape_after = df_with_features.shape
 
     df_with_features.reset_index(inplace=True)
-    df_with_features.to_csv(output_path, index=False)
 
     print(f"--- {label} ---")
     print(f"Shape before: {shape_before}, Shape after: {shape_after}")
     print(f"Interaction columns created: {INTERACTION_COLUMNS}")
-    print("Preview of first 10 rows:")
-    print(df_with_features.head(10).to_string(index=False))
-    print(f"Output saved to: {output_path}\n")
+    instrumentation.preview(df_with_features, 10, "Preview of first 10 rows:")
+    return feature_kernel.compact_features(df_with_features)
+
+
+@instrumentation.instrumented("interaction_features")
+def process_dataset(
+    label: str, input_path: Path, output_path: Path, store_path: Path | None = None
+) -> None:
+    df = ingestion.load(input_path)
+    features = process_frame(label, df)
+    output_path = storage.save(features, output_path)
+    print(f"Output saved to: {output_path}")
+    if store_path is not None:
+        feature_store.write_store(features, store_path, source=output_path)
+        print(f"Feature store saved to: {store_path}")
+    print()
 
 
 def main() -> None:
     for label, (input_path, output_path) in DATASETS.items():
-        if not input_path.exists():
+        if not storage.resolve_path(input_path).exists():
             print(f"Warning: Input file '{input_path}' not found. Skipping {label}...")
             continue
-        process_dataset(label, input_path, output_path)
+        process_dataset(label, input_path, output_path, FEATURE_STORES[label])
+    instrumentation.print_summary()
 
 
 if __name__ == "__main__":
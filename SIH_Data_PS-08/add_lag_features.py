@@ -1,8 +1,17 @@
 from __future__ import annotations
 
+import argparse
 from pathlib import Path
 
-import pandas as pd
+import feature_kernel
+import gap_index
+import ingestion
+import instrumentation
+import resample_satellites
+import storage
+from lazy_imports import lazy_module
+
+pd = lazy_module("pandas")
 
 BASE_DIR = Path(__file__).resolve().parent
 FEATURE_ENGINEERING_DIR = BASE_DIR / "feature_engineering_data"
@@ -26,49 +35,46 @@ LAG_COLUMN_NAMES = ["x", "y", "z", "clock"]
 LAG_STEPS = [1, 2, 4, 8, 16, 24, 48, 96]
 
 
-def add_lag_features(df: pd.DataFrame) -> pd.DataFrame:
-    """Add lag features for specified columns."""
-    df = df.copy()
-    
-    lag_columns_created = []
+def add_lag_features(
+    df: pd.DataFrame, gaps: gap_index.GapIndex | None = None
+) -> tuple[pd.DataFrame, list[str]]:
+    """Add lag features for specified columns.
+
+    Lags taken from a row inside a gap longer than ``$SIH_MAX_GAP_ROWS`` are NaN.
+    """
+    # Find the actual column names that match the patterns, once
+    patterns = list(zip(LAG_COLUMN_PATTERNS, LAG_COLUMN_NAMES))
+    resolved = feature_kernel.resolve_error_columns(df.columns, patterns)
+    columns = [col for col, _ in resolved]
+    short_names = [short_name for _, short_name in resolved]
     
-    for pattern, short_name in zip(LAG_COLUMN_PATTERNS, LAG_COLUMN_NAMES):
-        # Find the actual column name that matches the pattern
-        matching_cols = [col for col in df.columns if pattern in col]
-        
-        if not matching_cols:
-            print(f"Warning: No column matching '{pattern}' found in dataframe, skipping...")
-            continue
-        
-        # Use the first matching column
-        col = matching_cols[0]
-            
-        for lag_step in LAG_STEPS:
-            lag_col_name = f"{short_name}_lag_{lag_step}"
-            df[lag_col_name] = df[col].shift(lag_step)
-            lag_columns_created.append(lag_col_name)
+    # Build every lag column in one block and attach it in a single concat
+    lag_columns_created = feature_kernel.lag_columns(short_names, LAG_STEPS)
+    block = feature_kernel.feature_block(len(df), lag_columns_created)
+    feature_kernel.fill_lags(feature_kernel.error_matrix(df, columns), LAG_STEPS, block)
+    long_rows = gap_index.long_gap_rows(gaps, df.index)
+    if long_rows is not None:
+        masked = feature_kernel.mask_lags(block, LAG_STEPS, long_rows)
+        print(f"Lag values masked over long gaps: {masked}")
     
-    return df, lag_columns_created
+    return feature_kernel.join_block(df, block, lag_columns_created), lag_columns_created
 
 
-def process_dataset(label: str, input_path: Path, output_path: Path) -> None:
-    """Process a single dataset by adding lag features."""
-    # Load the CSV file
-    df = pd.read_csv(input_path)
-    
-    # Convert utc_time to datetime
-    df["utc_time"] = pd.to_datetime(df["utc_time"], errors="coerce")
-    
-    # Sort rows by utc_time
-    df.sort_values("utc_time", inplace=True)
+def process_frame(
+    label: str, df: pd.DataFrame, gaps: gap_index.GapIndex | None = None
+) -> pd.DataFrame:
+    """Add lag features to an in-memory frame with a ``utc_time`` column."""
+    # Convert utc_time to datetime and sort rows by it
+    utc = ingestion.parse_times(df["utc_time"])
+    df = df.assign(utc_time=utc).sort_values("utc_time")
     
     # Set utc_time as index (required for correct shifting)
-    df.set_index("utc_time", inplace=True)
+    df = df.set_index("utc_time")
     
     shape_before = df.shape
     
     # Add lag features
-    df_with_lags, lag_columns_created = add_lag_features(df)
+    df_with_lags, lag_columns_created = add_lag_features(df, gaps)
     
     shape_after = df_with_lags.shape
     
@@ -76,28 +82,105 @@ def process_dataset(label: str, input_path: Path, output_path: Path) -> None:
     # NaN will be present in the first max(LAG_STEPS) rows for lag columns
     nan_count = df_with_lags[lag_columns_created].isna().any(axis=1).sum()
     
-    # Reset index to save utc_time as a column
+    # Reset index to keep utc_time as a column
     df_with_lags.reset_index(inplace=True)
     
-    # Save to output file
-    df_with_lags.to_csv(output_path, index=False)
-    
     # Logging
     print(f"--- {label} ---")
     print(f"Number of lag columns created: {len(lag_columns_created)}")
     print(f"Shape before: {shape_before}, Shape after: {shape_after}")
     print(f"Number of rows containing NaN due to lagging: {nan_count}")
+    
+    return feature_kernel.compact_features(df_with_lags)
+
+
+@instrumentation.instrumented("lag_features")
+def process_dataset(
+    label: str, input_path: Path, output_path: Path, gaps_path: Path | None = None
+) -> None:
+    """Process a single dataset by adding lag features."""
+    # Load the CSV file
+    df = ingestion.load(input_path)
+    
+    df_with_lags = process_frame(label, df, gap_index.load(gaps_path))
+    
+    # Save to output file
+    output_path = storage.save(df_with_lags, output_path)
     print(f"Output saved to: {output_path}")
     print()
 
 
+def append_frame(
+    label: str,
+    new_rows: pd.DataFrame,
+    output_path: Path,
+    gaps: gap_index.GapIndex | None = None,
+) -> pd.DataFrame:
+    """Compute lag features for ``new_rows`` only and append them to ``output_path``."""
+    utc = ingestion.parse_times(new_rows["utc_time"])
+    new_rows = new_rows.assign(utc_time=utc).sort_values("utc_time")
+    
+    # The longest lag is the only history the new rows depend on
+    context = storage.tail(output_path, max(LAG_STEPS), columns=list(new_rows.columns))
+    context = context[list(new_rows.columns)]
+    context = context.assign(utc_time=ingestion.parse_times(context["utc_time"]))
+    if not context.empty and new_rows["utc_time"].iloc[0] <= context["utc_time"].iloc[-1]:
+        raise ValueError(
+            f"Rows to append must be newer than {context['utc_time'].iloc[-1]} in {output_path.name}"
+        )
+    
+    combined = pd.concat([context, new_rows], ignore_index=True).set_index("utc_time")
+    df_with_lags, lag_columns_created = add_lag_features(combined, gaps)
+    appended = feature_kernel.compact_features(df_with_lags.iloc[len(context):].reset_index())
+    
+    output_path = storage.append(appended, output_path)
+    
+    print(f"--- {label} (append) ---")
+    print(f"Context rows read: {len(context)}")
+    print(f"Rows appended: {len(appended)}")
+    print(f"Output saved to: {output_path}")
+    print()
+    return appended
+
+
+@instrumentation.instrumented("lag_features_append")
+def append_dataset(
+    label: str, input_path: Path, output_path: Path, gaps_path: Path | None = None
+) -> None:
+    """Append lag features for the input rows that are newer than the existing output."""
+    if not storage.resolve_path(output_path).exists():
+        process_dataset(label, input_path, output_path, gaps_path)
+        return
+    
+    last_ts = storage.last_timestamp(output_path)
+    new_rows = storage.read_after(input_path, last_ts)
+    if new_rows.empty:
+        print(f"--- {label} (append) ---")
+        print(f"No rows after {last_ts}, nothing to append\n")
+        return
+    append_frame(label, new_rows, output_path, gap_index.load(gaps_path))
+
+
 def main() -> None:
     """Process all datasets."""
+    parser = argparse.ArgumentParser(description="Add lag features.")
+    parser.add_argument(
+        "--append",
+        action="store_true",
+        help="only compute features for input rows newer than the existing output",
+    )
+    args = parser.parse_args()
+    
     for label, (input_path, output_path) in DATASETS.items():
-        if not input_path.exists():
+        if not storage.resolve_path(input_path).exists():
             print(f"Warning: Input file '{input_path}' not found, skipping {label}...")
             continue
-        process_dataset(label, input_path, output_path)
+        gaps_path = resample_satellites.GAP_INDEXES[label]
+        if args.append:
+            append_dataset(label, input_path, output_path, gaps_path)
+        else:
+            process_dataset(label, input_path, output_path, gaps_path)
+    instrumentation.print_summary()
 
 
 if __name__ == "__main__":
@@ -1,8 +1,17 @@
 from __future__ import annotations
 
+import argparse
 from pathlib import Path
 
-import pandas as pd
+import feature_kernel
+import gap_index
+import ingestion
+import instrumentation
+import resample_satellites
+import storage
+from lazy_imports import lazy_module
+
+pd = lazy_module("pandas")
 
 BASE_DIR = Path(__file__).resolve().parent
 FEATURE_ENGINEERING_DIR = BASE_DIR / "feature_engineering_data"
@@ -27,69 +36,126 @@ VARIABLE_PATTERNS = [
 ROLLING_WINDOWS = [3, 6, 12, 24]
 
 
-def add_rolling_features(df: pd.DataFrame) -> tuple[pd.DataFrame, list[str]]:
-    """Compute rolling statistics and slopes for specified variables."""
-    df = df.copy()
-    created_columns: list[str] = []
-
-    for pattern, short_name in VARIABLE_PATTERNS:
-        matching_cols = [col for col in df.columns if pattern in col]
-        if not matching_cols:
-            print(f"Warning: No column matching '{pattern}' found. Skipping...")
-            continue
-
-        col = matching_cols[0]
-        series = df[col]
-
-        for window in ROLLING_WINDOWS:
-            rolling = series.rolling(window=window, min_periods=window)
-
-            mean_col = f"{short_name}_roll_mean_{window}"
-            std_col = f"{short_name}_roll_std_{window}"
-            min_col = f"{short_name}_roll_min_{window}"
-            max_col = f"{short_name}_roll_max_{window}"
-            slope_col = f"{short_name}_roll_slope_{window}"
+def add_rolling_features(
+    df: pd.DataFrame, gaps: gap_index.GapIndex | None = None
+) -> tuple[pd.DataFrame, list[str]]:
+    """Compute rolling statistics and slopes for specified variables.
 
-            df[mean_col] = rolling.mean()
-            df[std_col] = rolling.std()
-            df[min_col] = rolling.min()
-            df[max_col] = rolling.max()
-            df[slope_col] = (series - series.shift(window - 1)) / window
+    Windows holding a row of a gap longer than ``$SIH_MAX_GAP_ROWS`` are NaN.
+    """
+    resolved = feature_kernel.resolve_error_columns(df.columns, VARIABLE_PATTERNS)
+    columns = [col for col, _ in resolved]
+    short_names = [short_name for _, short_name in resolved]
 
-            created_columns.extend(
-                [mean_col, std_col, min_col, max_col, slope_col]
-            )
+    created_columns = feature_kernel.rolling_columns(short_names, ROLLING_WINDOWS)
+    block = feature_kernel.feature_block(len(df), created_columns)
+    feature_kernel.fill_rolling(feature_kernel.error_matrix(df, columns), ROLLING_WINDOWS, block)
+    long_rows = gap_index.long_gap_rows(gaps, df.index)
+    if long_rows is not None:
+        masked = feature_kernel.mask_rolling(block, ROLLING_WINDOWS, long_rows)
+        print(f"Rolling values masked over long gaps: {masked}")
 
-    return df, created_columns
+    return feature_kernel.join_block(df, block, created_columns), created_columns
 
 
-def process_dataset(label: str, input_path: Path, output_path: Path) -> None:
-    df = pd.read_csv(input_path)
-    df["utc_time"] = pd.to_datetime(df["utc_time"], errors="coerce")
-    df.sort_values("utc_time", inplace=True)
-    df.set_index("utc_time", inplace=True)
+def process_frame(
+    label: str, df: pd.DataFrame, gaps: gap_index.GapIndex | None = None
+) -> pd.DataFrame:
+    utc = ingestion.parse_times(df["utc_time"])
+    df = df.assign(utc_time=utc).sort_values("utc_time").set_index("utc_time")
 
     shape_before = df.shape
-    df_with_features, created_columns = add_rolling_features(df)
+    df_with_features, created_columns = add_rolling_features(df, gaps)
     shape_after = df_with_features.shape
 
     df_with_features.reset_index(inplace=True)
-    df_with_features.to_csv(output_path, index=False)
 
     print(f"--- {label} ---")
     print(f"Number of rolling features created: {len(created_columns)}")
     print(f"Shape before: {shape_before}, Shape after: {shape_after}")
-    print("Preview of first 20 rows (showing NaNs):")
-    print(df_with_features.head(20).to_string(index=False))
+    instrumentation.preview(df_with_features, 20, "Preview of first 20 rows (showing NaNs):")
+    return feature_kernel.compact_features(df_with_features)
+
+
+@instrumentation.instrumented("rolling_features")
+def process_dataset(
+    label: str, input_path: Path, output_path: Path, gaps_path: Path | None = None
+) -> None:
+    df = ingestion.load(input_path)
+    output_path = storage.save(process_frame(label, df, gap_index.load(gaps_path)), output_path)
     print(f"Output saved to: {output_path}\n")
 
 
+def append_frame(
+    label: str,
+    new_rows: pd.DataFrame,
+    output_path: Path,
+    gaps: gap_index.GapIndex | None = None,
+) -> pd.DataFrame:
+    """Compute rolling features for ``new_rows`` only and append them to ``output_path``."""
+    utc = ingestion.parse_times(new_rows["utc_time"])
+    new_rows = new_rows.assign(utc_time=utc).sort_values("utc_time")
+
+    # A window of n rows needs the n - 1 rows before the first new one.
+    context = storage.tail(output_path, max(ROLLING_WINDOWS) - 1, columns=list(new_rows.columns))
+    context = context[list(new_rows.columns)]
+    context = context.assign(utc_time=ingestion.parse_times(context["utc_time"]))
+    if not context.empty and new_rows["utc_time"].iloc[0] <= context["utc_time"].iloc[-1]:
+        raise ValueError(
+            f"Rows to append must be newer than {context['utc_time'].iloc[-1]} in {output_path.name}"
+        )
+
+    combined = pd.concat([context, new_rows], ignore_index=True).set_index("utc_time")
+    df_with_features, _ = add_rolling_features(combined, gaps)
+    appended = feature_kernel.compact_features(
+        df_with_features.iloc[len(context):].reset_index()
+    )
+
+    output_path = storage.append(appended, output_path)
+
+    print(f"--- {label} (append) ---")
+    print(f"Context rows read: {len(context)}")
+    print(f"Rows appended: {len(appended)}")
+    print(f"Output saved to: {output_path}\n")
+    return appended
+
+
+@instrumentation.instrumented("rolling_features_append")
+def append_dataset(
+    label: str, input_path: Path, output_path: Path, gaps_path: Path | None = None
+) -> None:
+    if not storage.resolve_path(output_path).exists():
+        process_dataset(label, input_path, output_path, gaps_path)
+        return
+
+    last_ts = storage.last_timestamp(output_path)
+    new_rows = storage.read_after(input_path, last_ts)
+    if new_rows.empty:
+        print(f"--- {label} (append) ---")
+        print(f"No rows after {last_ts}, nothing to append\n")
+        return
+    append_frame(label, new_rows, output_path, gap_index.load(gaps_path))
+
+
 def main() -> None:
+    parser = argparse.ArgumentParser(description="Add rolling-window features.")
+    parser.add_argument(
+        "--append",
+        action="store_true",
+        help="only compute features for input rows newer than the existing output",
+    )
+    args = parser.parse_args()
+
     for label, (input_path, output_path) in DATASETS.items():
-        if not input_path.exists():
+        if not storage.resolve_path(input_path).exists():
             print(f"Warning: Input file '{input_path}' not found. Skipping {label}...")
             continue
-        process_dataset(label, input_path, output_path)
+        gaps_path = resample_satellites.GAP_INDEXES[label]
+        if args.append:
+            append_dataset(label, input_path, output_path, gaps_path)
+        else:
+            process_dataset(label, input_path, output_path, gaps_path)
+    instrumentation.print_summary()
 
 
 if __name__ == "__main__":
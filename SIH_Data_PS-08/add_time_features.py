@@ -1,9 +1,16 @@
 from __future__ import annotations
 
-import math
 from pathlib import Path
 
-import pandas as pd
+import numpy as np
+
+import feature_kernel
+import ingestion
+import instrumentation
+import storage
+from lazy_imports import lazy_module
+
+pd = lazy_module("pandas")
 
 BASE_DIR = Path(__file__).resolve().parent
 INPUT_DIR = BASE_DIR / "15min_resampled"
@@ -25,49 +32,130 @@ NEW_FEATURES = [
     "doy_cos",
 ]
 
-
-def add_time_features(df: pd.DataFrame) -> pd.DataFrame:
+SOLAR_DAY_SECONDS = 86_400.0
+SIDEREAL_DAY_SECONDS = 86_164.0905
+TROPICAL_YEAR_SECONDS = 365.242_19 * SOLAR_DAY_SECONDS
+# A MEO orbit of 12.88 h (BeiDou-type, the period synthetic_data simulates)
+MEO_ORBIT_SECONDS = 12.88 * 3600
+# (name, period in seconds, harmonics): columns {name}_sin_k / {name}_cos_k of
+# 2 pi k t / period for k = 1..harmonics, with t the time since the Unix epoch.
+# Satellites are matched by label prefix; other labels get DEFAULT_HARMONICS.
+HARMONICS = {
+    "MEO": [
+        ("orbit", MEO_ORBIT_SECONDS, 3),
+        ("day", SOLAR_DAY_SECONDS, 2),
+        ("year", TROPICAL_YEAR_SECONDS, 1),
+    ],
+    "GEO": [
+        ("sidereal", SIDEREAL_DAY_SECONDS, 3),
+        ("year", TROPICAL_YEAR_SECONDS, 1),
+    ],
+}
+DEFAULT_HARMONICS = [("day", SOLAR_DAY_SECONDS, 2), ("year", TROPICAL_YEAR_SECONDS, 1)]
+# Rows evaluated at a time, so the angle matrices of long inputs stay in cache
+HARMONIC_BLOCK_ROWS = 1 << 16
+
+
+def harmonics_for(label: str) -> list[tuple[str, float, int]]:
+    for prefix, harmonics in HARMONICS.items():
+        if label.upper().startswith(prefix):
+            return harmonics
+    return DEFAULT_HARMONICS
+
+
+def harmonic_columns(harmonics: list[tuple[str, float, int]]) -> list[str]:
+    return [
+        f"{name}_{function}_{k}"
+        for name, _, count in harmonics
+        for k in range(1, count + 1)
+        for function in ("sin", "cos")
+    ]
+
+
+def harmonic_features(times: np.ndarray, harmonics: list[tuple[str, float, int]]) -> np.ndarray:
+    """``(rows, 2 * terms)`` sin/cos of every harmonic, in :func:`harmonic_columns` order.
+
+    ``times`` are datetime64[ns] (or int64 nanoseconds). Each period's phase
+    is taken with an exact int64 remainder, so precision does not degrade
+    over multi-year spans. All terms of a block of rows are then one
+    ``np.sin`` and one ``np.cos`` call. NaT rows give NaN.
+    """
+    nanos = np.asarray(times).view("int64")
+    periods = np.array([round(period * 1e9) for _, period, _ in harmonics], dtype=np.int64)
+    # One remainder per period, shared by its harmonics
+    term_period = np.array([index for index, (_, _, count) in enumerate(harmonics) for _ in range(count)])
+    multiples = np.array([k for _, _, count in harmonics for k in range(1, count + 1)], dtype=float)
+    result = np.empty((len(nanos), 2 * len(term_period)))
+    for start in range(0, len(nanos), HARMONIC_BLOCK_ROWS):
+        block = nanos[start : start + HARMONIC_BLOCK_ROWS, None]
+        phases = np.remainder(block, periods) / periods
+        angles = (2 * np.pi * multiples) * phases[:, term_period]
+        result[start : start + len(block), 0::2] = np.sin(angles)
+        result[start : start + len(block), 1::2] = np.cos(angles)
+    result[nanos == np.iinfo(np.int64).min] = np.nan
+    return result
+
+
+def add_time_features(
+    df: pd.DataFrame, harmonics: list[tuple[str, float, int]] | None = None
+) -> pd.DataFrame:
+    """Calendar columns and Fourier harmonics of the ``utc_time`` index.
+
+    ``harmonics`` default to :data:`DEFAULT_HARMONICS`.
+    """
+    harmonics = DEFAULT_HARMONICS if harmonics is None else harmonics
     df = df.copy()
     df["hour"] = df.index.hour
     df["minute"] = df.index.minute
     df["dow"] = df.index.weekday
     df["doy"] = df.index.dayofyear
 
-    df["hour_sin"] = df["hour"].apply(lambda h: math.sin(2 * math.pi * h / 24))
-    df["hour_cos"] = df["hour"].apply(lambda h: math.cos(2 * math.pi * h / 24))
-    df["doy_sin"] = df["doy"].apply(lambda d: math.sin(2 * math.pi * d / 365))
-    df["doy_cos"] = df["doy"].apply(lambda d: math.cos(2 * math.pi * d / 365))
+    hour = df["hour"].to_numpy(dtype="float64")
+    doy = df["doy"].to_numpy(dtype="float64")
+    df["hour_sin"] = np.sin(2 * np.pi * hour / 24)
+    df["hour_cos"] = np.cos(2 * np.pi * hour / 24)
+    df["doy_sin"] = np.sin(2 * np.pi * doy / 365)
+    df["doy_cos"] = np.cos(2 * np.pi * doy / 365)
 
-    return df
+    values = harmonic_features(df.index.to_numpy(dtype="datetime64[ns]"), harmonics)
+    return feature_kernel.join_block(df, values, harmonic_columns(harmonics))
 
 
-def process_dataset(label: str, input_path: Path, output_path: Path) -> None:
-    df = pd.read_csv(input_path)
-    df["utc_time"] = pd.to_datetime(df["utc_time"], errors="coerce")
-    df.sort_values("utc_time", inplace=True)
-    df.set_index("utc_time", inplace=True)
+def process_frame(label: str, df: pd.DataFrame) -> pd.DataFrame:
+    utc = ingestion.parse_times(df["utc_time"])
+    df = df.assign(utc_time=utc).sort_values("utc_time").set_index("utc_time")
 
     shape_before = df.shape
-    df_with_features = add_time_features(df)
+    harmonics = harmonics_for(label)
+    df_with_features = add_time_features(df, harmonics)
     shape_after = df_with_features.shape
 
     df_with_features.reset_index(inplace=True)
-    df_with_features.to_csv(output_path, index=False)
 
     first_ts = df_with_features["utc_time"].iloc[0]
     last_ts = df_with_features["utc_time"].iloc[-1]
 
     print(f"--- {label} ---")
-    print(f"New features added: {len(NEW_FEATURES)}")
+    print(f"New features added: {len(NEW_FEATURES) + len(harmonic_columns(harmonics))}")
+    periods = [f"{name} {period / 3600:.4g} h x{count}" for name, period, count in harmonics]
+    print(f"Harmonic periods: {', '.join(periods)}")
     print(f"First timestamp: {first_ts}")
     print(f"Last timestamp: {last_ts}")
     print(f"Shape before: {shape_before}, Shape after: {shape_after}")
     print()
+    return feature_kernel.compact_features(df_with_features)
+
+
+@instrumentation.instrumented("time_features")
+def process_dataset(label: str, input_path: Path, output_path: Path) -> None:
+    df = ingestion.load(input_path)
+    storage.save(process_frame(label, df), output_path)
 
 
 def main() -> None:
     for label, (input_path, output_path) in DATASETS.items():
         process_dataset(label, input_path, output_path)
+    instrumentation.print_summary()
 
 
 if __name__ == "__main__":
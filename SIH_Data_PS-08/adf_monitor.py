@@ -0,0 +1,265 @@
+from __future__ import annotations
+
+import argparse
+import os
+from concurrent.futures import ProcessPoolExecutor
+from pathlib import Path
+
+import numpy as np
+from numpy.lib.stride_tricks import sliding_window_view
+
+import adf_tests
+import ingestion
+import instrumentation
+import storage
+from lazy_imports import lazy_module
+
+pd = lazy_module("pandas")
+
+INPUT_DIR = adf_tests.INPUT_DIR
+DATASETS = {
+    "MEO": (INPUT_DIR / "MEO_smoothed.csv", INPUT_DIR / "ADF_MEO_rolling.csv"),
+    "GEO": (INPUT_DIR / "GEO_smoothed.csv", INPUT_DIR / "ADF_GEO_rolling.csv"),
+}
+WINDOW_ROWS = 192  # two days of 15-minute rows
+STRIDE_ROWS = 24  # a new window every six hours
+# Windows computed per task; bounds memory and is the unit of work of the process pool
+WINDOW_BATCH = 2_048
+RESULT_FIELDS = ("adf_statistic", "p_value", "lags")
+
+
+def max_lag(window: int) -> int:
+    """``adfuller``'s default maximum lag for ``window`` values and a constant."""
+    lag = min(window // 2 - 2, int(np.ceil(12.0 * np.power(window / 100.0, 1 / 4.0))))
+    if lag < 0:
+        raise ValueError(f"A window of {window} rows is too short for an ADF test")
+    return lag
+
+
+def _design(values: np.ndarray, lags: int) -> np.ndarray:
+    # Row r is the regression row of t = r + 1:
+    # [1, x[t-1], dx[t-1], ..., dx[t-lags], dx[t]], the last column being the target.
+    # Shifting x by its mean only moves the constant, and keeps the sums well scaled.
+    x = values - np.nanmean(values)
+    x = np.where(np.isnan(x), 0.0, x)
+    dx = np.diff(x)
+    design = np.zeros((len(dx), lags + 3))
+    design[:, 0] = 1.0
+    design[:, 1] = x[:-1]
+    for lag in range(1, lags + 1):
+        design[lag:, lag + 1] = dx[:-lag]
+    design[:, -1] = dx
+    return design
+
+
+def _window_grams(
+    design: np.ndarray, first: int, length: int, stride: int, windows: int
+) -> np.ndarray:
+    """Gram matrices of rows ``[first + j * stride, + length)`` for every window ``j``.
+
+    Overlapping windows share their stride-long blocks, so each row's outer
+    product is formed once (plus once more for the leftover rows) rather than
+    once per window containing it.
+    """
+    full, rest = divmod(length, stride)
+    columns = design.shape[1]
+    grams = np.zeros((windows, columns, columns))
+    if full:
+        blocks = design[first : first + (windows + full - 1) * stride]
+        blocks = blocks.reshape(-1, stride, columns)
+        block_grams = blocks.transpose(0, 2, 1) @ blocks
+        grams += sliding_window_view(block_grams, full, axis=0).sum(axis=-1)
+    if rest:
+        starts = first + np.arange(windows) * stride + full * stride
+        leftover = design[starts[:, None] + np.arange(rest)]
+        grams += leftover.transpose(0, 2, 1) @ leftover
+    return grams
+
+
+def _fit(grams: np.ndarray, lag: int, rows: int) -> tuple[np.ndarray, np.ndarray]:
+    """t-statistic of the lagged level and AIC of the lag-``lag`` regression in every window."""
+    params = lag + 2
+    xx = grams[:, :params, :params]
+    xy = grams[:, :params, -1]
+    try:
+        inverse = np.linalg.inv(xx)
+    except np.linalg.LinAlgError:
+        # Constant windows; adfuller's OLS uses the pseudo-inverse too
+        inverse = np.linalg.pinv(xx)
+    beta = (inverse @ xy[..., None])[..., 0]
+    with np.errstate(divide="ignore", invalid="ignore"):
+        ssr = grams[:, -1, -1] - (beta * xy).sum(axis=-1)
+        tstat = beta[:, 1] / np.sqrt(ssr / (rows - params) * inverse[:, 1, 1])
+        aic = rows * (np.log(2 * np.pi) + np.log(ssr / rows) + 1) + 2 * params
+    return tstat, aic
+
+
+def _rolling_batch(
+    values: np.ndarray, window: int, stride: int, fixed_lag: int | None
+) -> tuple[np.ndarray, np.ndarray, np.ndarray]:
+    windows = (len(values) - window) // stride + 1
+    lags = max_lag(window) if fixed_lag is None else fixed_lag
+    design = _design(values, lags)
+    # The lag search compares every lag on the same rows, those after the longest lag
+    search_rows = window - 1 - lags
+    grams = _window_grams(design, lags, search_rows, stride, windows)
+
+    if fixed_lag is not None:
+        chosen = np.full(windows, lags)
+        tstat, _ = _fit(grams, lags, search_rows)
+    else:
+        aic = np.stack([_fit(grams, lag, search_rows)[1] for lag in range(lags + 1)], axis=1)
+        # argmin takes the first minimum: the shortest lag on ties, like adfuller
+        chosen = np.nanargmin(np.where(np.isnan(aic), np.inf, aic), axis=1)
+        tstat = np.empty(windows)
+        starts = np.arange(windows) * stride
+        # Refit each window with its lag on all the rows that lag allows
+        for lag in np.unique(chosen):
+            selected = np.flatnonzero(chosen == lag)
+            head = design[starts[selected, None] + np.arange(lag, lags)]
+            head_grams = head.transpose(0, 2, 1) @ head
+            tstat[selected], _ = _fit(grams[selected] + head_grams, int(lag), window - 1 - lag)
+
+    from statsmodels.tsa.adfvalues import mackinnonp
+
+    p_value = np.array([mackinnonp(stat) if np.isfinite(stat) else np.nan for stat in tstat])
+    # A window with a gap has no meaningful test
+    missing = sliding_window_view(np.isnan(values), window)[::stride].any(axis=1)
+    tstat[missing] = p_value[missing] = np.nan
+    return tstat, p_value, np.where(missing, -1, chosen)
+
+
+def rolling_adf(
+    values: np.ndarray,
+    window: int = WINDOW_ROWS,
+    stride: int = STRIDE_ROWS,
+    fixed_lag: int | None = None,
+    workers: int = 1,
+) -> tuple[np.ndarray, np.ndarray, np.ndarray]:
+    """ADF statistic, p-value and lags used for the windows ending at ``window + j * stride`` rows.
+
+    Each window gives what ``adfuller(window_values, autolag="AIC")`` gives
+    (or ``maxlag=fixed_lag, autolag=None``), up to rounding. Windows
+    containing NaN report NaN and lag -1. Batches of windows run on
+    ``workers`` processes.
+    """
+    windows = (len(values) - window) // stride + 1 if len(values) >= window else 0
+    if windows == 0:
+        return np.empty(0), np.empty(0), np.empty(0, dtype=np.int64)
+    tasks = [
+        values[start * stride : (min(start + WINDOW_BATCH, windows) - 1) * stride + window]
+        for start in range(0, windows, WINDOW_BATCH)
+    ]
+    arguments = ([window] * len(tasks), [stride] * len(tasks), [fixed_lag] * len(tasks))
+    if workers > 1 and len(tasks) > 1:
+        with ProcessPoolExecutor(max_workers=min(workers, len(tasks))) as executor:
+            batches = list(executor.map(_rolling_batch, tasks, *arguments))
+    else:
+        batches = list(map(_rolling_batch, tasks, *arguments))
+    return tuple(np.concatenate(parts) for parts in zip(*batches))
+
+
+def monitor_frame(
+    df: pd.DataFrame,
+    window: int = WINDOW_ROWS,
+    stride: int = STRIDE_ROWS,
+    fixed_lag: int | None = None,
+    workers: int = 1,
+    first_window: int = 0,
+) -> pd.DataFrame:
+    """One row per window from ``first_window`` on: its time span and each column's results."""
+    column_map = ingestion.resolve_columns(df.columns)
+    offset = first_window * stride
+    ends = np.arange(offset + window - 1, len(df), stride)
+    result = pd.DataFrame(
+        {
+            "utc_time": df["utc_time"].to_numpy()[ends],
+            "window_start": df["utc_time"].to_numpy()[ends - window + 1],
+        }
+    )
+    for target in ingestion.NUMERIC_COLUMNS:
+        values = df[column_map[target]].to_numpy(dtype="float64")[offset:]
+        for field, field_values in zip(
+            RESULT_FIELDS, rolling_adf(values, window, stride, fixed_lag, workers)
+        ):
+            result[f"{target}_{field}"] = field_values
+    return result
+
+
+def _first_new_window(
+    df: pd.DataFrame, output_path: Path, window: int, stride: int
+) -> int:
+    # Windows are anchored at the first input row, so a later run recomputes the
+    # same windows and only the ones ending after the last written row are new.
+    # Output written with another window length is rebuilt.
+    last_rows = storage.tail(output_path, 1, columns=["utc_time", "window_start"])
+    if last_rows.empty:
+        return 0
+    last_end, last_start = pd.to_datetime(last_rows.iloc[0])
+    times = df["utc_time"]
+    end_row = int(times.searchsorted(last_end))
+    if end_row >= len(times) or end_row < window - 1 or times.iloc[end_row - window + 1] != last_start:
+        return -1
+    return (end_row - window + 1) // stride + 1
+
+
+@instrumentation.instrumented("adf_monitor")
+def process_dataset(
+    label: str,
+    input_path: Path,
+    output_path: Path,
+    window: int = WINDOW_ROWS,
+    stride: int = STRIDE_ROWS,
+    fixed_lag: int | None = None,
+    workers: int = 1,
+) -> None:
+    df = ingestion.load(input_path)
+    first_window = 0
+    if storage.resolve_path(output_path).exists():
+        first_window = _first_new_window(df, output_path, window, stride)
+        if first_window < 0:
+            print(f"{output_path.name} was written with other windows; rebuilding it")
+            first_window = 0
+    result = monitor_frame(df, window, stride, fixed_lag, workers, first_window)
+    if first_window:
+        storage.append(result, output_path)
+    else:
+        storage.save(result, output_path)
+
+    print(f"--- {label} ---")
+    print(f"Window: {window} rows, stride: {stride} rows")
+    print(f"Windows written: {len(result)} ({'appended' if first_window else 'new file'})")
+    if not result.empty:
+        latest = result.iloc[-1]
+        print(f"Latest window: {latest['window_start']} to {latest['utc_time']}")
+        for target in ingestion.NUMERIC_COLUMNS:
+            p_value = latest[f"{target}_p_value"]
+            verdict = "Stationary" if p_value < adf_tests.SIGNIFICANCE_LEVEL else "Non-Stationary"
+            print(f"{target}: p={p_value:.4g} ({verdict})")
+    print()
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description="ADF test over sliding windows of every error column.")
+    parser.add_argument("--window", type=int, default=WINDOW_ROWS, help="rows per window")
+    parser.add_argument("--stride", type=int, default=STRIDE_ROWS, help="rows between window ends")
+    parser.add_argument(
+        "--fixed-lag", type=int, help="test every window with exactly this many lags (screening)"
+    )
+    parser.add_argument(
+        "--workers",
+        type=int,
+        default=os.cpu_count(),
+        help="processes computing batches of windows (default: CPU count)",
+    )
+    args = parser.parse_args()
+
+    for label, (input_path, output_path) in DATASETS.items():
+        process_dataset(
+            label, input_path, output_path, args.window, args.stride, args.fixed_lag, args.workers
+        )
+    instrumentation.print_summary()
+
+
+if __name__ == "__main__":
+    main()
@@ -1,11 +1,23 @@
 from __future__ import annotations
 
+import argparse
+import hashlib
+import json
+import os
+from concurrent.futures import ProcessPoolExecutor
 from pathlib import Path
 
-import pandas as pd
-from statsmodels.tsa.stattools import adfuller
+import numpy as np
 
-INPUT_DIR = Path(__file__).resolve().parent / "15min_resampled"
+import ingestion
+import instrumentation
+import storage
+from lazy_imports import lazy_module
+
+pd = lazy_module("pandas")
+
+BASE_DIR = Path(__file__).resolve().parent
+INPUT_DIR = BASE_DIR / "15min_resampled"
 DATASETS = {
     "MEO": (
         INPUT_DIR / "MEO_smoothed.csv",
@@ -16,82 +28,194 @@ DATASETS = {
         INPUT_DIR / "ADF_GEO_results.csv",
     ),
 }
-NUMERIC_COLUMNS = ["x_error", "y_error", "z_error", "satclockerror"]
-NORMALIZED_TARGETS = {"".join(col.lower().split("_")): col for col in NUMERIC_COLUMNS}
+ADF_AUTOLAG = "AIC"
+SIGNIFICANCE_LEVEL = 0.05
+# One JSON file per (series, parameters) result; delete the directory to clear it.
+# Set the variable to an empty string to disable the cache.
+ADF_CACHE_ENV = "SIH_ADF_CACHE"
+DEFAULT_ADF_CACHE = BASE_DIR / ".adf_cache"
 
 
-def _normalize_column_name(name: str) -> str:
-    base = name.split("(")[0]
-    return base.strip().lower().replace(" ", "").replace("_", "")
+def adf_params(fixed_lag: int | None = None) -> dict[str, object]:
+    """The ``adfuller`` arguments of a run: AIC lag search, or exactly ``fixed_lag`` lags.
 
+    A fixed lag fits one regression instead of one per candidate lag, for
+    quick screening runs.
+    """
+    if fixed_lag is None:
+        return {"autolag": ADF_AUTOLAG}
+    return {"maxlag": fixed_lag, "autolag": None}
 
-def _resolve_columns(df: pd.DataFrame) -> dict[str, str]:
-    mapping: dict[str, str] = {}
-    for column in df.columns:
-        if column.lower() == "utc_time":
-            continue
-        normalized = _normalize_column_name(column)
-        for normalized_target, target in NORMALIZED_TARGETS.items():
-            if normalized.startswith(normalized_target) and target not in mapping:
-                mapping[target] = column
-                break
-    missing = [target for target in NUMERIC_COLUMNS if target not in mapping]
-    if missing:
-        raise ValueError(f"Missing expected columns: {', '.join(missing)}")
-    return mapping
 
+def adf_cache_dir() -> Path | None:
+    configured = os.environ.get(ADF_CACHE_ENV)
+    if configured is None:
+        return DEFAULT_ADF_CACHE
+    return Path(configured) if configured else None
 
-def run_adf(series: pd.Series) -> dict[str, float | str]:
-    clean_series = series.dropna()
-    if clean_series.empty:
-        raise ValueError("Cannot run ADF on empty series after dropping NaNs")
-    result = adfuller(clean_series, autolag="AIC")
-    adf_statistic, p_value, used_lags, n_obs, critical_values, _ = result
-    interpretation = "Stationary" if p_value < 0.05 else "Non-Stationary"
-    return {
-        "adf_statistic": adf_statistic,
-        "p_value": p_value,
-        "num_lags_used": used_lags,
-        "num_observations_used": n_obs,
-        "critical_value_1%": critical_values["1%"],
-        "critical_value_5%": critical_values["5%"],
-        "critical_value_10%": critical_values["10%"],
-        "interpretation": interpretation,
-    }
 
+def series_key(values: np.ndarray, params: dict[str, object]) -> str:
+    """Hash of the values tested and the ``adfuller`` arguments."""
+    digest = hashlib.sha256()
+    digest.update(json.dumps(params, sort_keys=True).encode())
+    digest.update(np.ascontiguousarray(values, dtype="float64").tobytes())
+    return digest.hexdigest()
 
-def process_dataset(label: str, input_path: Path, output_path: Path) -> None:
-    df = pd.read_csv(input_path)
-    df["utc_time"] = pd.to_datetime(df["utc_time"], errors="coerce")
-    df = df.set_index("utc_time")
 
-    column_map = _resolve_columns(df.reset_index())
+def _adf_values(values: np.ndarray, params: dict[str, object]) -> dict[str, float | int]:
+    # statsmodels takes about a second to import; only the tests that run pay for it
+    from statsmodels.tsa.stattools import adfuller
+
+    adf_statistic, p_value, used_lags, n_obs, critical_values, *_ = adfuller(values, **params)
+    return {
+        "adf_statistic": float(adf_statistic),
+        "p_value": float(p_value),
+        "num_lags_used": int(used_lags),
+        "num_observations_used": int(n_obs),
+        "critical_value_1%": float(critical_values["1%"]),
+        "critical_value_5%": float(critical_values["5%"]),
+        "critical_value_10%": float(critical_values["10%"]),
+    }
 
-    results = []
-    stationary_count = 0
-    for target in NUMERIC_COLUMNS:
-        column = column_map[target]
-        stats = run_adf(df[column])
-        if stats["interpretation"] == "Stationary":
-            stationary_count += 1
-        stats_row = {"variable_name": column}
-        stats_row.update(stats)
-        results.append(stats_row)
 
-    output_df = pd.DataFrame(results)
-    output_df.to_csv(output_path, index=False)
+def _with_interpretation(values: dict[str, float | int]) -> dict[str, float | str]:
+    interpretation = "Stationary" if values["p_value"] < SIGNIFICANCE_LEVEL else "Non-Stationary"
+    return {**values, "interpretation": interpretation}
 
+
+def _clean_values(series: pd.Series) -> np.ndarray:
+    clean_series = series.dropna()
+    if clean_series.empty:
+        raise ValueError("Cannot run ADF on empty series after dropping NaNs")
+    return clean_series.to_numpy(dtype="float64")
+
+
+def run_adf(series: pd.Series, fixed_lag: int | None = None) -> dict[str, float | str]:
+    return _with_interpretation(_adf_values(_clean_values(series), adf_params(fixed_lag)))
+
+
+def _read_cached(cache_dir: Path | None, key: str) -> dict[str, float | int] | None:
+    if cache_dir is None:
+        return None
+    try:
+        return json.loads((cache_dir / f"{key}.json").read_text())
+    except (OSError, ValueError):
+        return None
+
+
+def _write_cached(cache_dir: Path | None, key: str, values: dict[str, float | int]) -> None:
+    if cache_dir is None:
+        return
+    cache_dir.mkdir(parents=True, exist_ok=True)
+    # Written whole then renamed, so stages running side by side never read half a file
+    path = cache_dir / f"{key}.json"
+    tmp_path = path.with_name(f"{key}.{os.getpid()}.tmp")
+    tmp_path.write_text(json.dumps(values) + "\n")
+    os.replace(tmp_path, path)
+
+
+def run_batch(
+    jobs: dict[tuple[str, str], pd.Series],
+    workers: int = 1,
+    fixed_lag: int | None = None,
+) -> tuple[dict[tuple[str, str], dict[str, float | str]], set[tuple[str, str]]]:
+    """ADF results of many ``(satellite, column)`` series, and the jobs read from the cache.
+
+    Series whose values and parameters were tested before are read back from
+    the cache; the rest are spread over ``workers`` processes (run in this
+    process when ``workers`` is 1).
+    """
+    params = adf_params(fixed_lag)
+    cache_dir = adf_cache_dir()
+    values = {job: _clean_values(series) for job, series in jobs.items()}
+    keys = {job: series_key(series_values, params) for job, series_values in values.items()}
+
+    results: dict[tuple[str, str], dict[str, float | int]] = {}
+    for job in jobs:
+        cached = _read_cached(cache_dir, keys[job])
+        if cached is not None:
+            results[job] = cached
+    cached_jobs = set(results)
+    pending = [job for job in jobs if job not in cached_jobs]
+
+    if workers > 1 and len(pending) > 1:
+        with ProcessPoolExecutor(max_workers=min(workers, len(pending))) as executor:
+            computed = executor.map(
+                _adf_values, [values[job] for job in pending], [params] * len(pending)
+            )
+            fresh = dict(zip(pending, computed))
+    else:
+        fresh = {job: _adf_values(values[job], params) for job in pending}
+    for job, job_values in fresh.items():
+        _write_cached(cache_dir, keys[job], job_values)
+        results[job] = job_values
+
+    ordered = {job: _with_interpretation(results[job]) for job in jobs}
+    return ordered, cached_jobs
+
+
+def load_series(label: str, input_path: Path) -> dict[tuple[str, str], pd.Series]:
+    # The tests only need the four error columns; skip the rest of the file
+    column_map = ingestion.resolve_columns(ingestion.read_header(input_path))
+    df = ingestion.load(input_path, columns=list(column_map.values()))
+    df = df.set_index("utc_time")
+    columns = [column_map[target] for target in ingestion.NUMERIC_COLUMNS]
+    return {(label, column): df[column] for column in columns}
+
+
+def write_results(
+    label: str,
+    output_path: Path,
+    results: dict[tuple[str, str], dict[str, float | str]],
+    cached_jobs: set[tuple[str, str]] = frozenset(),
+) -> None:
+    jobs = [job for job in results if job[0] == label]
+    rows = [{"variable_name": column, **results[(label, column)]} for _, column in jobs]
+    cached = sum(job in cached_jobs for job in jobs)
+    output_df = pd.DataFrame(rows)
+    storage.save(output_df, output_path)
+
+    stationary_count = int((output_df["interpretation"] == "Stationary").sum())
     print(f"ADF completed for {label} dataset")
-    print(f"Variables analyzed: {len(NUMERIC_COLUMNS)}")
-    print(
-        f"Stationary variables: {stationary_count}, Non-stationary: {len(NUMERIC_COLUMNS) - stationary_count}"
-    )
+    print(f"Variables analyzed: {len(rows)}")
+    print(f"Stationary variables: {stationary_count}, Non-stationary: {len(rows) - stationary_count}")
+    if cached:
+        print(f"Results reused from cache: {cached}")
     print()
 
 
+@instrumentation.instrumented("adf")
+def process_dataset(
+    label: str, input_path: Path, output_path: Path, workers: int = 1, fixed_lag: int | None = None
+) -> None:
+    results, cached_jobs = run_batch(load_series(label, input_path), workers, fixed_lag)
+    write_results(label, output_path, results, cached_jobs)
+
+
 def main() -> None:
-    for label, (input_path, output_path) in DATASETS.items():
-        process_dataset(label, input_path, output_path)
+    parser = argparse.ArgumentParser(description="Augmented Dickey-Fuller test of every error column.")
+    parser.add_argument(
+        "--workers",
+        type=int,
+        default=os.cpu_count(),
+        help="processes testing series in parallel (default: CPU count)",
+    )
+    parser.add_argument(
+        "--fixed-lag",
+        type=int,
+        help=f"test with exactly this many lags instead of the {ADF_AUTOLAG} lag search (screening)",
+    )
+    args = parser.parse_args()
+
+    # Every (satellite, column) series goes into one batch, so the pool stays busy
+    with instrumentation.stage("adf", "+".join(DATASETS)):
+        jobs: dict[tuple[str, str], pd.Series] = {}
+        for label, (input_path, _) in DATASETS.items():
+            jobs.update(load_series(label, input_path))
+        results, cached_jobs = run_batch(jobs, args.workers, args.fixed_lag)
+        for label, (_, output_path) in DATASETS.items():
+            write_results(label, output_path, results, cached_jobs)
+    instrumentation.print_summary()
 
 
 if __name__ == "__main__":
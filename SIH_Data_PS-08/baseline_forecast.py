@@ -0,0 +1,375 @@
+from __future__ import annotations
+
+import argparse
+import time
+from pathlib import Path
+
+import numpy as np
+
+import add_interaction_features
+import add_lag_features
+import feature_kernel
+import feature_store
+import ingestion
+import instrumentation
+import interpolate_timeseries
+import smooth_timeseries
+import storage
+import zscore_outliers
+from lazy_imports import lazy_module
+
+pd = lazy_module("pandas")
+
+# The final feature files; the memory-mapped store is read instead while it is current
+DATASETS = {label: output for label, (_, output) in add_interaction_features.DATASETS.items()}
+# Targets are the observed errors (outliers removed, nothing filled or smoothed)
+TARGETS = {label: output for label, (_, output) in zscore_outliers.DATASETS.items()}
+# The seasonal-naive forecast repeats the interpolated series of the day before
+SEASONAL = {label: output for label, (_, output) in interpolate_timeseries.DATASETS.items()}
+HORIZON_STEPS = 96  # forecast every 15-minute row of the next day
+SEASON_ROWS = 96  # the errors follow a daily pattern
+# The centred smoother reads this many rows ahead, so a feature row is only final
+# that many rows later: forecasts are issued from there
+ISSUE_DELAY = (smooth_timeseries.SMOOTHING_WINDOW - 1) // 2
+BASELINE_MODELS = ("seasonal_naive", "ar", "ridge")
+# The current value and every lag column: an AR model over the LAG_STEPS layout
+AR_LAGS = [0, *add_lag_features.LAG_STEPS]
+# Penalty per training target, on standardised features, of the AR and ridge models.
+# Most horizons have fewer observed training targets than AR coefficients, so AR
+# needs it as much as ridge does.
+RIDGE_ALPHA = 1.0
+# Keeps constant columns (zero after standardising) solvable at no measurable cost
+MIN_PENALTY = 1e-8
+# The last quarter of every series is held out; training targets end before it starts
+TEST_FRACTION = 0.25
+REPORT_HORIZONS = (1, 4, 16, 48, 96)
+
+
+def _features(label: str) -> tuple[list[str], np.ndarray, np.ndarray]:
+    """Feature columns, times and ``(rows, features)`` matrix of a satellite.
+
+    The store is only read while it holds the data of the feature file next
+    to it; one out of date is skipped for the file.
+    """
+    store_path = add_interaction_features.FEATURE_STORES[label]
+    csv_path = storage.resolve_path(DATASETS[label])
+    if (store_path / feature_store.SIDECAR_NAME).exists():
+        if not csv_path.exists() or feature_store.is_current(store_path, csv_path):
+            store = feature_store.open_store(store_path)
+            return store.columns, store.times(), np.asarray(store.select(), dtype=np.float64)
+        print(f"Warning: {store_path.name} does not match {csv_path.name}. Reading the file...")
+    df = storage.load(DATASETS[label])
+    columns = [column for column in df.columns if column != ingestion.TIME_COLUMN]
+    times = ingestion.parse_times(df[ingestion.TIME_COLUMN]).to_numpy(dtype="datetime64[ns]")
+    return columns, times, df[columns].to_numpy(dtype=np.float64)
+
+
+def _error_matrix(path: Path, times: np.ndarray) -> np.ndarray:
+    """The error columns of a stage file on the rows of ``times``, NaN where it has none."""
+    df = smooth_timeseries._coalesce_measurement_columns(ingestion.load(path))
+    column_map = ingestion.resolve_columns(df.columns)
+    columns = [column_map[target] for target in ingestion.NUMERIC_COLUMNS]
+    df = df.set_index(ingestion.parse_times(df[ingestion.TIME_COLUMN]))
+    return df[columns].reindex(pd.DatetimeIndex(times)).to_numpy(dtype=np.float64)
+
+
+def ar_positions(columns: list[str]) -> np.ndarray:
+    """``(error column, lag)`` positions of the current value and lags of every error column."""
+    column_map = ingestion.resolve_columns(columns)
+    positions = []
+    for target, short_name in zip(ingestion.NUMERIC_COLUMNS, add_lag_features.LAG_COLUMN_NAMES):
+        names = [column_map[target], *feature_kernel.lag_columns([short_name], AR_LAGS[1:])]
+        positions.append([columns.index(name) for name in names])
+    return np.array(positions)
+
+
+def load_samples(label: str) -> dict[str, np.ndarray]:
+    """The samples of one satellite, in time order.
+
+    A forecast is issued at row ``origin`` from the feature row
+    ``ISSUE_DELAY`` rows before it, and only where ``origin`` holds a new
+    observation of every error column: the interpolated and smoothed series
+    behind the features then draw on nothing later than the origin.
+
+    ``features`` is ``(samples, features)`` and ``lags`` ``(samples, error
+    column, lag)``, the AR inputs picked from it. ``targets`` and ``seasonal``
+    are ``(samples, horizon, error column)``: the observed errors of the
+    next day (0 where ``observed`` is False) and the interpolated errors at
+    the same rows one day earlier.
+    """
+    columns, times, features = _features(label)
+    observed = _error_matrix(TARGETS[label], times)
+    interpolated = _error_matrix(SEASONAL[label], times)
+
+    horizons = np.arange(1, HORIZON_STEPS + 1)
+    rows = np.arange(max(len(times) - ISSUE_DELAY - HORIZON_STEPS, 0))
+    origins = rows + ISSUE_DELAY
+    keep = (
+        ~np.isnan(features[rows]).any(axis=1)
+        & ~np.isnan(observed[origins]).any(axis=1)
+        & (origins + 1 >= SEASON_ROWS)
+    )
+    rows, origins = rows[keep], origins[keep]
+    target_rows = origins[:, None] + horizons
+    seasonal = interpolated[target_rows - SEASON_ROWS]
+    keep = ~np.isnan(seasonal).any(axis=(1, 2))
+    rows, origins, target_rows = rows[keep], origins[keep], target_rows[keep]
+
+    targets = observed[target_rows]
+    features = features[rows]
+    return {
+        "origins": origins,
+        "features": features,
+        "lags": features[:, ar_positions(columns)],
+        "targets": np.nan_to_num(targets, nan=0.0),
+        "observed": ~np.isnan(targets),
+        "seasonal": seasonal[keep],
+    }
+
+
+def split_samples(
+    samples: dict[str, np.ndarray], test_fraction: float = TEST_FRACTION
+) -> tuple[dict[str, np.ndarray], dict[str, np.ndarray]]:
+    """Chronological train/test split with no target row shared between the two."""
+    origins = samples["origins"]
+    if not len(origins):
+        return samples, samples
+    split = int(len(origins) * (1 - test_fraction))
+    first_test = origins[split] if split < len(origins) else origins[-1] + 1
+    train = origins + HORIZON_STEPS < first_test
+    test = origins >= first_test
+    return (
+        {name: values[train] for name, values in samples.items()},
+        {name: values[test] for name, values in samples.items()},
+    )
+
+
+def _stack(parts: list[dict[str, np.ndarray]]) -> dict[str, np.ndarray]:
+    # Satellites differ in sample count, and in feature count (each orbit has its own
+    # harmonics). Short ones are padded with zero rows and columns, which add nothing
+    # to the least-squares sums: padded targets are unobserved, and a zero column stays
+    # zero after standardising and gets a zero coefficient.
+    stacked = {}
+    for name in parts[0]:
+        shape = np.max([part[name].shape for part in parts], axis=0)
+        stacked[name] = np.zeros((len(parts), *shape), dtype=parts[0][name].dtype)
+        for index, part in enumerate(parts):
+            stacked[name][(index, *(slice(0, size) for size in part[name].shape))] = part[name]
+    return stacked
+
+
+class LinearModel:
+    """A batch of ridge regressions on standardised features, fitted in one solve.
+
+    ``design`` is ``(..., samples, features)``, ``targets`` and ``mask``
+    ``(..., samples, outputs)``; every leading index is its own regression
+    with its outputs sharing one design. Each output is fitted on the samples
+    where its target is observed (``mask``), so every output has its own
+    normal equations; all of them, for every satellite, error column and
+    horizon, go through one batched ``np.linalg.solve``. Features are
+    standardised over the samples with any target; the intercept is not
+    penalised. Without a penalty (``alpha`` 0) an output needs more observed
+    targets than parameters; outputs with fewer get NaN coefficients.
+    """
+
+    def __init__(
+        self, design: np.ndarray, targets: np.ndarray, mask: np.ndarray, alpha: float = RIDGE_ALPHA
+    ) -> None:
+        rows = mask.any(axis=-1, keepdims=True).astype(np.float64)
+        count = np.maximum(rows.sum(axis=-2, keepdims=True), 1.0)
+        self.mean = (design * rows).sum(axis=-2, keepdims=True) / count
+        variance = (np.square(design - self.mean) * rows).sum(axis=-2, keepdims=True) / count
+        spread = np.sqrt(variance)
+        self.scale = np.where(spread > 0, spread, 1.0)
+
+        # Standardised features and the intercept column, zero on unused rows
+        x = np.concatenate([(design - self.mean) / self.scale * rows, rows], axis=-1)
+        weight = mask.astype(np.float64)
+        size = x.shape[-1]
+        # Weighted Gram matrix of every output at once: (outputs x samples) @ (samples x size**2)
+        outer = (x[..., :, None] * x[..., None, :]).reshape(*x.shape[:-1], size * size)
+        gram = (np.swapaxes(weight, -1, -2) @ outer).reshape(*weight.shape[:-2], -1, size, size)
+        cross = np.swapaxes(weight * targets, -1, -2) @ x
+        # The penalty grows with each output's targets, so alpha means the same at any density
+        penalty = np.full(size, max(alpha, MIN_PENALTY))
+        penalty[-1] = MIN_PENALTY
+        fitted = np.maximum(weight.sum(axis=-2), 1.0)[..., None] * penalty
+        diagonal = np.arange(size)
+        gram[..., diagonal, diagonal] += fitted
+        # (..., outputs, features + 1)
+        self.coef = np.linalg.solve(gram, cross[..., None])[..., 0]
+        if alpha <= 0:
+            # Padded and constant columns are not parameters; the intercept is
+            parameters = (spread > 0).sum(axis=-1) + 1
+            underdetermined = weight.sum(axis=-2) <= parameters
+            self.coef[underdetermined] = np.nan
+
+    def predict(self, design: np.ndarray) -> np.ndarray:
+        standardised = (design - self.mean) / self.scale
+        x = np.concatenate([standardised, np.ones((*design.shape[:-1], 1))], axis=-1)
+        return x @ np.swapaxes(self.coef, -1, -2)
+
+
+def forecast_seasonal_naive(train: dict, test: dict) -> np.ndarray:
+    """Every step of the next day repeats the same step of the day before."""
+    return test["seasonal"]
+
+
+def forecast_ar(train: dict, test: dict, alpha: float = RIDGE_ALPHA) -> np.ndarray:
+    """Direct AR(p) per error column: one set of lag coefficients per horizon.
+
+    The lags are the ``LAG_STEPS`` columns of the lag stage, so the model
+    reaches back a day with only ``len(AR_LAGS)`` coefficients, shrunk by
+    the same ``alpha`` as the ridge model.
+    """
+
+    def design(samples: dict) -> np.ndarray:
+        # (satellite, samples, error column, lag) -> (satellite, error column, samples, lag)
+        return np.moveaxis(samples["lags"], 2, 1)
+
+    # (satellite, samples, horizon, error column) -> (satellite, error column, samples, horizon)
+    targets = np.moveaxis(train["targets"], 3, 1)
+    mask = np.moveaxis(train["observed"], 3, 1)
+    model = LinearModel(design(train), targets, mask, alpha)
+    return np.moveaxis(model.predict(design(test)), 1, 3)
+
+
+def forecast_ridge(train: dict, test: dict, alpha: float = RIDGE_ALPHA) -> np.ndarray:
+    """Ridge regression of every error column and horizon on all the engineered features."""
+    satellites, rows, horizons, channels = train["targets"].shape
+    targets = train["targets"].reshape(satellites, rows, horizons * channels)
+    mask = train["observed"].reshape(satellites, rows, horizons * channels)
+    model = LinearModel(train["features"], targets, mask, alpha)
+    return model.predict(test["features"]).reshape(satellites, -1, horizons, channels)
+
+
+FORECASTERS = {
+    "seasonal_naive": forecast_seasonal_naive,
+    "ar": forecast_ar,
+    "ridge": forecast_ridge,
+}
+
+
+def rmse_per_horizon(predictions: np.ndarray, targets: np.ndarray, mask: np.ndarray) -> np.ndarray:
+    """``(satellite, horizon, error column)`` RMSE over the observed targets, NaN where none."""
+    squared = np.where(mask, np.square(predictions - targets), 0.0)
+    with np.errstate(invalid="ignore", divide="ignore"):
+        return np.sqrt(squared.sum(axis=1) / mask.sum(axis=1))
+
+
+def evaluate(
+    labels: list[str],
+    models: list[str] = list(BASELINE_MODELS),
+    test_fraction: float = TEST_FRACTION,
+    alpha: float = RIDGE_ALPHA,
+) -> pd.DataFrame:
+    """Fit every model for all satellites at once and score it on the held-out rows.
+
+    Returns one row per model, satellite and horizon, with the RMSE (m) of
+    every error column against the observed errors.
+    """
+    trains, tests = [], []
+    for label in labels:
+        samples = load_samples(label)
+        train, test = split_samples(samples, test_fraction)
+        print(f"--- {label} ---")
+        print(
+            f"Forecast origins: {len(samples['origins'])} "
+            f"({len(train['origins'])} train, {len(test['origins'])} test)"
+        )
+        print(f"Observed test targets: {int(test['observed'].sum())}")
+        print(f"Features: {samples['features'].shape[1]}")
+        trains.append(train)
+        tests.append(test)
+    train = _stack(trains)
+    test = _stack(tests)
+    print()
+
+    horizons = np.arange(1, HORIZON_STEPS + 1)
+    reports = []
+    for name in models:
+        start = time.perf_counter()
+        if name == "seasonal_naive":
+            predictions = forecast_seasonal_naive(train, test)
+        else:
+            predictions = FORECASTERS[name](train, test, alpha)
+        seconds = time.perf_counter() - start
+        rmse = rmse_per_horizon(predictions, test["targets"], test["observed"])
+        print(f"{name}: {len(labels)} satellites x {HORIZON_STEPS} horizons in {seconds * 1000:.1f} ms")
+        for index, label in enumerate(labels):
+            report = pd.DataFrame(rmse[index], columns=ingestion.NUMERIC_COLUMNS)
+            report.insert(0, "horizon", horizons)
+            report.insert(0, "satellite", label)
+            report.insert(0, "model", name)
+            reports.append(report)
+    print()
+    return pd.concat(reports, ignore_index=True)
+
+
+def print_report(report: pd.DataFrame) -> None:
+    columns = ingestion.NUMERIC_COLUMNS
+    print(
+        "RMSE against the observed errors (outliers removed). Forecasts are issued at "
+        f"rows with a new observation, from the feature row {ISSUE_DELAY} row(s) earlier, "
+        "so no feature reads past the origin. The global z-score outlier filter still "
+        "sets its thresholds from the whole series."
+    )
+    print()
+    for label, rows in report.groupby("satellite", sort=False):
+        print(f"--- {label}: RMSE (m) ---")
+        naive = rows[rows["model"] == "seasonal_naive"][columns].to_numpy()
+        for name, model_rows in rows.groupby("model", sort=False):
+            print(f"{name}:")
+            shown = model_rows[model_rows["horizon"].isin(REPORT_HORIZONS)]
+            print(shown.to_string(index=False, columns=["horizon", *columns]))
+            values = model_rows[columns].to_numpy()
+            means = np.nanmean(values, axis=0)
+            print(f"Mean over horizons: {', '.join(f'{value:.4g}' for value in means)}")
+            if len(naive) and name != "seasonal_naive":
+                skill = 1 - means / np.nanmean(naive, axis=0)
+                print(f"Skill vs seasonal naive: {', '.join(f'{value:+.1%}' for value in skill)}")
+        print()
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(
+        description="Fit baseline day-ahead forecasters for all satellites and report RMSE per horizon."
+    )
+    parser.add_argument("--models", nargs="+", choices=BASELINE_MODELS, default=list(BASELINE_MODELS))
+    parser.add_argument(
+        "--alpha", type=float, default=RIDGE_ALPHA, help="AR and ridge penalty per training target"
+    )
+    parser.add_argument("--test-fraction", type=float, default=TEST_FRACTION)
+    parser.add_argument("--report", type=Path, help="write the RMSE of every horizon to this CSV")
+    args = parser.parse_args()
+
+    labels = []
+    for label, input_path in DATASETS.items():
+        store_path = add_interaction_features.FEATURE_STORES[label]
+        has_store = (store_path / feature_store.SIDECAR_NAME).exists()
+        if not has_store and not storage.resolve_path(input_path).exists():
+            print(f"Warning: Input file '{input_path}' not found. Skipping {label}...")
+            continue
+        missing = [
+            path
+            for path in (TARGETS[label], SEASONAL[label])
+            if not storage.resolve_path(path).exists()
+        ]
+        if missing:
+            print(f"Warning: Input file '{missing[0]}' not found. Skipping {label}...")
+            continue
+        labels.append(label)
+    if not labels:
+        return
+    with instrumentation.stage("baseline_forecast", "+".join(labels)):
+        report = evaluate(labels, args.models, args.test_fraction, args.alpha)
+    print_report(report)
+    if args.report:
+        args.report.parent.mkdir(parents=True, exist_ok=True)
+        report.to_csv(args.report, index=False)
+        print(f"Report saved to: {args.report}")
+    instrumentation.print_summary()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,270 @@
+from __future__ import annotations
+
+import argparse
+import contextlib
+import json
+import os
+import platform
+import subprocess
+import tempfile
+import traceback
+from concurrent.futures import ProcessPoolExecutor
+from datetime import datetime, timezone
+from pathlib import Path
+
+import numpy as np
+
+import add_ewm_features
+import add_interaction_features
+import add_lag_features
+import add_rolling_features
+import add_time_features
+import feature_kernel
+import instrumentation
+import interpolate_timeseries
+import resample_satellites
+import smooth_timeseries
+import storage
+import synthetic_data
+import zscore_outliers
+from lazy_imports import lazy_module
+from run_pipeline import _stage_output_path
+
+pd = lazy_module("pandas")
+
+BASE_DIR = Path(__file__).resolve().parent
+RESULTS_DIR = BASE_DIR / "benchmark_results"
+BENCH_LABEL = "BENCH"
+DEFAULT_SIZES = [10**3, 10**4, 10**5, 10**6]
+# The stage scripts in pipeline order, each timed through its own process_dataset
+BENCH_STAGES = [
+    ("resample", resample_satellites),
+    ("zscore", zscore_outliers),
+    ("interpolate", interpolate_timeseries),
+    ("smooth", smooth_timeseries),
+    ("time_features", add_time_features),
+    ("lag_features", add_lag_features),
+    ("rolling_features", add_rolling_features),
+    ("ewm_features", add_ewm_features),
+    ("interaction_features", add_interaction_features),
+]
+
+
+def _run_stage(name: str, module, input_path: Path, output_path: Path) -> None:
+    if name == "resample":
+        module.process_dataset(input_path, output_path, BENCH_LABEL)
+    else:
+        module.process_dataset(BENCH_LABEL, input_path, output_path)
+
+
+def benchmark_size(
+    rows: int,
+    cadence_seconds: float,
+    gap_fraction: float,
+    outlier_fraction: float,
+    skip: list[str],
+    seed: int,
+) -> list[dict[str, object]]:
+    """Generate ``rows`` raw samples and time every stage on them, in a scratch directory.
+
+    Runs in its own process so the peak RSS figures of one size do not carry
+    over into the next. Stage output is discarded; a failing stage ends the run
+    for this size.
+    """
+    # The stages measure themselves; keep benchmark runs out of the production metrics log
+    os.environ[instrumentation.METRICS_LOG_ENV] = ""
+    results = []
+    with tempfile.TemporaryDirectory(prefix="sih_bench_") as scratch:
+        work_dir = Path(scratch)
+        raw_path = work_dir / f"DATA_{BENCH_LABEL}_Train.csv"
+        with open(os.devnull, "w") as devnull, contextlib.redirect_stdout(devnull):
+            raw = synthetic_data.generate_satellite(
+                BENCH_LABEL,
+                rows,
+                cadence_seconds,
+                gap_fraction=gap_fraction,
+                outlier_fraction=outlier_fraction,
+                seed=seed,
+            )
+        raw.to_csv(raw_path, index=False)
+        del raw
+
+        input_path = raw_path
+        for name, module in BENCH_STAGES:
+            result: dict[str, object] = {"stage": name, "rows": rows}
+            if name in skip:
+                result["status"] = "skipped"
+                results.append(result)
+                continue
+            output_path = _stage_output_path(module.DATASETS, BENCH_LABEL, work_dir)
+            try:
+                with open(os.devnull, "w") as devnull, contextlib.redirect_stdout(devnull):
+                    _run_stage(name, module, input_path, output_path)
+            except Exception as exc:
+                result.update(status="failed", error=f"{type(exc).__name__}: {exc}")
+                result["traceback"] = traceback.format_exc()
+                results.append(result)
+                break
+            record = instrumentation.RECORDS[-1]
+            result.update(
+                status="ok",
+                seconds=record["wall_seconds"],
+                cpu_seconds=record["cpu_seconds"],
+                rss_before_mb=record["rss_before_mb"],
+                peak_rss_mb=record["peak_rss_mb"],
+                input_bytes=record["bytes_read"],
+                output_bytes=record["bytes_written"],
+            )
+            results.append(result)
+            input_path = output_path
+    return results
+
+
+def _environment() -> dict[str, object]:
+    try:
+        commit = subprocess.run(
+            ["git", "rev-parse", "--short", "HEAD"],
+            cwd=BASE_DIR,
+            capture_output=True,
+            text=True,
+            check=True,
+        ).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        commit = ""
+    return {
+        "commit": commit,
+        "python": platform.python_version(),
+        "pandas": pd.__version__,
+        "numpy": np.__version__,
+        "platform": platform.platform(),
+        "cpu_count": os.cpu_count(),
+        "storage_format": storage.storage_format(),
+        "feature_dtype": feature_kernel.feature_dtype().name,
+    }
+
+
+def run_benchmarks(
+    sizes: list[int],
+    cadence_seconds: float = 60.0,
+    gap_fraction: float = 0.05,
+    outlier_fraction: float = 0.001,
+    max_stage_seconds: float | None = None,
+    seed: int = 0,
+) -> dict[str, object]:
+    """Benchmark every stage at each size, smallest first.
+
+    A stage that fails, or takes longer than ``max_stage_seconds``, is skipped
+    at all larger sizes, so the report shows which stage gives out first.
+    """
+    results: list[dict[str, object]] = []
+    skip: list[str] = []
+    for rows in sorted(sizes):
+        with ProcessPoolExecutor(max_workers=1) as executor:
+            future = executor.submit(
+                benchmark_size, rows, cadence_seconds, gap_fraction, outlier_fraction, skip, seed
+            )
+            try:
+                size_results = future.result()
+            except Exception as exc:
+                # The worker died, most likely killed for running out of memory
+                size_results = [
+                    {"stage": "all", "rows": rows, "status": "failed", "error": repr(exc)}
+                ]
+        for result in size_results:
+            status = result["status"]
+            seconds = result.get("seconds")
+            if status == "failed" or (
+                max_stage_seconds is not None and seconds is not None and seconds > max_stage_seconds
+            ):
+                skip.append(str(result["stage"]))
+            if status == "ok":
+                print(
+                    f"{rows:>10} {result['stage']:<22} {seconds:9.3f} s "
+                    f"{result['peak_rss_mb']:9.1f} MB peak"
+                )
+            else:
+                print(f"{rows:>10} {result['stage']:<22} {status} {result.get('error', '')}")
+        results.extend(size_results)
+        if any(result["stage"] == "all" for result in size_results):
+            break
+
+    return {
+        "created": datetime.now(timezone.utc).isoformat(timespec="seconds"),
+        "environment": _environment(),
+        "config": {
+            "sizes": sorted(sizes),
+            "cadence_seconds": cadence_seconds,
+            "gap_fraction": gap_fraction,
+            "outlier_fraction": outlier_fraction,
+            "max_stage_seconds": max_stage_seconds,
+            "seed": seed,
+        },
+        "results": results,
+    }
+
+
+def summary_table(report: dict[str, object], field: str = "seconds") -> pd.DataFrame:
+    """One row per stage, one column per size."""
+    df = pd.DataFrame(report["results"])
+    df = df[df["status"] == "ok"]
+    return df.pivot(index="stage", columns="rows", values=field).reindex(
+        [name for name, _ in BENCH_STAGES]
+    )
+
+
+def compare_reports(baseline: dict[str, object], current: dict[str, object]) -> pd.DataFrame:
+    """Current time divided by baseline time for every stage and size both runs have."""
+    ratio = summary_table(current) / summary_table(baseline)
+    return ratio.dropna(axis=1, how="all").round(2)
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description="Time and memory-profile every pipeline stage.")
+    parser.add_argument(
+        "--sizes",
+        type=lambda text: [int(float(size)) for size in text.split(",")],
+        default=DEFAULT_SIZES,
+        help="comma-separated raw row counts, e.g. 1e3,1e5,1e7",
+    )
+    parser.add_argument("--cadence", type=float, default=60.0, help="seconds between raw samples")
+    parser.add_argument("--gap-fraction", type=float, default=0.05)
+    parser.add_argument("--outlier-fraction", type=float, default=0.001)
+    parser.add_argument(
+        "--max-stage-seconds",
+        type=float,
+        help="stop running a stage at larger sizes once it takes longer than this",
+    )
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--output", type=Path, help="results JSON (default: benchmark_results/)")
+    parser.add_argument("--compare", type=Path, help="earlier results JSON to compare against")
+    args = parser.parse_args()
+
+    report = run_benchmarks(
+        args.sizes,
+        args.cadence,
+        args.gap_fraction,
+        args.outlier_fraction,
+        args.max_stage_seconds,
+        args.seed,
+    )
+
+    output_path = args.output
+    if output_path is None:
+        stamp = datetime.now().strftime("%Y%m%d_%H%M%S")
+        output_path = RESULTS_DIR / f"stages_{stamp}.json"
+    output_path.parent.mkdir(parents=True, exist_ok=True)
+    output_path.write_text(json.dumps(report, indent=2) + "\n")
+
+    print("\nSeconds per stage:")
+    print(summary_table(report).to_string())
+    print("\nPeak RSS (MB) per stage:")
+    print(summary_table(report, "peak_rss_mb").to_string())
+    if args.compare is not None:
+        baseline = json.loads(args.compare.read_text())
+        print(f"\nTime relative to {args.compare.name} (< 1 is faster):")
+        print(compare_reports(baseline, report).to_string())
+    print(f"\nResults saved to: {output_path}")
+
+
+if __name__ == "__main__":
+    main()
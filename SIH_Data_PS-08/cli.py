@@ -0,0 +1,166 @@
+from __future__ import annotations
+
+import argparse
+import json
+import os
+import subprocess
+import sys
+import time
+from pathlib import Path
+
+import stage_dag
+
+BASE_DIR = Path(__file__).resolve().parent
+# pandas, statsmodels and the like are imported only once a stage actually runs, so
+# listing, planning (--dry-run) and dispatching stages start in a fraction of a second
+HEAVY_MODULES = ("pandas", "statsmodels", "sklearn", "scipy", "pyarrow")
+# The imports every stage script paid at start before they were deferred
+EAGER_BASELINE = "import pandas, statsmodels.tsa.stattools"
+IMPORT_TIME_COMMANDS = [
+    ["--help"],
+    ["run", "--dry-run"],
+    ["smooth", "--dry-run"],
+]
+
+
+def stage_names(stages: list[stage_dag.Stage]) -> list[str]:
+    """``"MEO:zscore"`` -> ``"zscore"``, once per stage, in pipeline order."""
+    return list(dict.fromkeys(stage.name.split(":", 1)[1] for stage in stages))
+
+
+def select_stages(
+    stages: list[stage_dag.Stage], names: list[str] | None
+) -> list[stage_dag.Stage]:
+    if names is None:
+        return stages
+    unknown = sorted(set(names) - set(stage_names(stages)))
+    if unknown:
+        raise SystemExit(f"Unknown stage(s): {', '.join(unknown)}")
+    return [stage for stage in stages if stage.name.split(":", 1)[1] in names]
+
+
+def _stage_list(value: str) -> list[str]:
+    return [name.strip() for name in value.split(",") if name.strip()]
+
+
+def _add_common_arguments(parser: argparse.ArgumentParser, datasets: list[str]) -> None:
+    parser.add_argument(
+        "--dataset",
+        action="append",
+        choices=datasets,
+        help="limit to one dataset (repeatable; default: all)",
+    )
+    parser.add_argument(
+        "--workers",
+        type=int,
+        default=os.cpu_count(),
+        help="worker processes for independent stages (default: CPU count)",
+    )
+    parser.add_argument(
+        "--dry-run", action="store_true", help="only list the stages, importing nothing heavy"
+    )
+
+
+def build_parser() -> argparse.ArgumentParser:
+    parser = argparse.ArgumentParser(
+        prog="python -m cli",
+        description="Run, plan or time the pipeline stages (run from this directory).",
+    )
+    stages = stage_dag.build_stages()
+    datasets = sorted({stage.name.split(":", 1)[0] for stage in stages})
+    commands = parser.add_subparsers(dest="command", required=True, metavar="command")
+
+    run = commands.add_parser("run", help="rerun the stages whose inputs or parameters changed")
+    _add_common_arguments(run, datasets)
+    run.add_argument(
+        "--stages", type=_stage_list, help="comma-separated stage names (default: every stage)"
+    )
+    run.add_argument("--force", action="store_true", help="rerun the stages even if up to date")
+
+    for name in stage_names(stages):
+        stage = commands.add_parser(name, help=f"run the {name} stage now, up to date or not")
+        _add_common_arguments(stage, datasets)
+
+    times = commands.add_parser(
+        "import-times", help="time the cold start of these commands in fresh interpreters"
+    )
+    times.add_argument("--repeat", type=int, default=3, help="runs per command; the best counts")
+    return parser
+
+
+def _time_command(arguments: list[str]) -> tuple[float, list[str]]:
+    # The child reports which heavy libraries the command really imported
+    probe = (
+        "import json, runpy, sys, lazy_imports\n"
+        f"sys.argv = ['cli', *{arguments!r}]\n"
+        "try:\n"
+        "    runpy.run_module('cli', run_name='__main__')\n"
+        "except SystemExit:\n"
+        "    pass\n"
+        f"print(json.dumps([name for name in {HEAVY_MODULES!r} if lazy_imports.is_loaded(name)]))\n"
+    )
+    return _time_child(probe)
+
+
+def _time_child(code: str) -> tuple[float, list[str]]:
+    start = time.perf_counter()
+    completed = subprocess.run(
+        [sys.executable, "-c", code], cwd=BASE_DIR, capture_output=True, text=True, check=True
+    )
+    elapsed = time.perf_counter() - start
+    last_line = completed.stdout.strip().splitlines()[-1] if completed.stdout.strip() else "[]"
+    return elapsed, json.loads(last_line)
+
+
+def import_times(repeat: int = 3) -> list[dict[str, object]]:
+    """Wall time of a fresh interpreter running each command, best of ``repeat``.
+
+    The eager baseline is a fresh interpreter that only imports what every
+    stage used to import at start, so the difference is what a scheduler
+    launching single stages saves per launch.
+    """
+    baseline_code = f"{EAGER_BASELINE}\nprint([])\n"
+    rows = [
+        {
+            "command": f"(eager baseline) {EAGER_BASELINE}",
+            "seconds": min(_time_child(baseline_code)[0] for _ in range(repeat)),
+            "heavy_imports": "pandas, statsmodels",
+        }
+    ]
+    for arguments in IMPORT_TIME_COMMANDS:
+        runs = [_time_command(arguments) for _ in range(repeat)]
+        rows.append(
+            {
+                "command": "python -m cli " + " ".join(arguments),
+                "seconds": min(seconds for seconds, _ in runs),
+                "heavy_imports": ", ".join(runs[0][1]) or "none",
+            }
+        )
+    return rows
+
+
+def main(argv: list[str] | None = None) -> None:
+    args = build_parser().parse_args(argv)
+
+    if args.command == "import-times":
+        rows = import_times(args.repeat)
+        width = max(len(str(row["command"])) for row in rows)
+        for row in rows:
+            print(f"{row['command']:<{width}}  {row['seconds']:6.3f} s  heavy: {row['heavy_imports']}")
+        return
+
+    stages = stage_dag.build_stages(args.dataset)
+    if args.command == "run":
+        stages = select_stages(stages, args.stages)
+        force = args.force
+    else:
+        stages = select_stages(stages, [args.command])
+        force = True
+    if args.dry_run:
+        stage_dag.plan(stages, force)
+        return
+    stage_dag.run_and_report(stages, args.workers, force)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,286 @@
+from __future__ import annotations
+
+import os
+
+import numpy as np
+
+import ingestion
+from lazy_imports import lazy_module
+
+pd = lazy_module("pandas")
+
+# Error channels and the short names used in feature column names
+ERROR_PATTERNS = [
+    ("x_error", "x"),
+    ("y_error", "y"),
+    ("z_error", "z"),
+    ("satclockerror", "clock"),
+]
+ROLLING_STATS = ["mean", "std", "min", "max", "slope"]
+# Precision of the stored feature columns. float32 halves the memory of the feature
+# matrices and cuts their CSV size by a third; the kernels accumulate in float64
+# either way and round once on output, so every float32 feature is within a
+# relative 2**-24 of its float64 value (0.06 mm on a 1 km error). CSV keeps the
+# shortest decimal that reads back as the same float32; read as float64 it is
+# within 2**-23.
+FEATURE_DTYPE_ENV = "SIH_FEATURE_DTYPE"
+DEFAULT_FEATURE_DTYPE = "float64"
+FEATURE_DTYPES = ("float64", "float32")
+FLOAT32_MAX_RELATIVE_ERROR = 2.0**-24
+
+
+def feature_dtype(dtype: str | None = None) -> np.dtype:
+    dtype = (dtype or os.environ.get(FEATURE_DTYPE_ENV, DEFAULT_FEATURE_DTYPE)).lower()
+    if dtype not in FEATURE_DTYPES:
+        raise ValueError(
+            f"Unknown feature dtype '{dtype}', expected one of: {', '.join(FEATURE_DTYPES)}"
+        )
+    return np.dtype(dtype)
+
+
+def resolve_error_columns(
+    columns: pd.Index | list[str], patterns: list[tuple[str, str]] = ERROR_PATTERNS
+) -> list[tuple[str, str]]:
+    """Return ``(column, short_name)`` for the first column matching each pattern."""
+    resolved = ingestion.find_columns(columns, patterns)
+    found = {short_name for _, short_name in resolved}
+    for pattern, short_name in patterns:
+        if short_name not in found:
+            print(f"Warning: No column matching '{pattern}' found. Skipping...")
+    return resolved
+
+
+def lag_columns(short_names: list[str], lag_steps: list[int]) -> list[str]:
+    return [f"{name}_lag_{step}" for name in short_names for step in lag_steps]
+
+
+def rolling_columns(short_names: list[str], windows: list[int]) -> list[str]:
+    return [
+        f"{name}_roll_{stat}_{window}"
+        for name in short_names
+        for window in windows
+        for stat in ROLLING_STATS
+    ]
+
+
+def ewm_columns(short_names: list[str], spans: list[int]) -> list[str]:
+    return [
+        f"{name}_ewm_{stat}_{span}"
+        for name in short_names
+        for span in spans
+        for stat in ("mean", "std")
+    ]
+
+
+def _write_channels(out: np.ndarray, per_channel: int, position: int, stat: np.ndarray) -> None:
+    # Output columns are grouped by channel; ``stat`` is channel-major (channels, n)
+    for channel, row in enumerate(stat):
+        out[:, channel * per_channel + position] = row
+
+
+def fill_lags(values: np.ndarray, lag_steps: list[int], out: np.ndarray) -> None:
+    """Write ``values`` shifted by every lag step into ``out`` (channel-major columns)."""
+    n, channels = values.shape
+    for channel in range(channels):
+        series = values[:, channel]
+        for position, step in enumerate(lag_steps):
+            column = out[:, channel * len(lag_steps) + position]
+            column[: min(step, n)] = np.nan
+            if step < n:
+                column[step:] = series[: n - step]
+
+
+def fill_rolling(values: np.ndarray, windows: list[int], out: np.ndarray) -> None:
+    """Write trailing mean, std, min, max and slope for every window into ``out``.
+
+    One running accumulation over lagged views serves all windows: the window
+    sum for length w is the accumulator after w terms, so the 3-, 6-, 12- and
+    24-row windows share the work. Every value only depends on its own window
+    and the terms are always added in the same order, which keeps append mode
+    bit-identical to a full recompute (a global prefix sum would not). Windows
+    that are incomplete or contain NaN give NaN, as with
+    ``rolling(window, min_periods=window)``.
+    """
+    n = values.shape[0]
+    per_channel = len(windows) * len(ROLLING_STATS)
+    # Channel-major so every shifted slice below is contiguous
+    series = np.ascontiguousarray(values.T)
+    total = series.copy()
+    lowest = series.copy()
+    highest = series.copy()
+    running = {}
+    if 1 in windows:
+        running[1] = (total.copy(), lowest.copy(), highest.copy())
+    for steps in range(1, max(windows)):
+        if steps < n:
+            total[:, steps:] += series[:, : n - steps]
+            np.minimum(lowest[:, steps:], series[:, : n - steps], out=lowest[:, steps:])
+            np.maximum(highest[:, steps:], series[:, : n - steps], out=highest[:, steps:])
+        total[:, : min(steps, n)] = np.nan
+        lowest[:, : min(steps, n)] = np.nan
+        highest[:, : min(steps, n)] = np.nan
+        if steps + 1 in windows:
+            running[steps + 1] = (total.copy(), lowest.copy(), highest.copy())
+
+    squared = np.empty_like(series)
+    scratch = np.empty_like(series)
+    for index, window in enumerate(windows):
+        window_total, window_min, window_max = running.pop(window)
+        mean = window_total / window
+        np.subtract(series, mean, out=squared)
+        np.square(squared, out=squared)
+        for steps in range(1, min(window, n)):
+            term = scratch[:, steps:]
+            np.subtract(series[:, : n - steps], mean[:, steps:], out=term)
+            np.square(term, out=term)
+            squared[:, steps:] += term
+        with np.errstate(invalid="ignore", divide="ignore"):
+            std = np.sqrt(squared / (window - 1))
+        # A constant window: the exact answer instead of rounding residue, as online
+        constant = window_min == window_max
+        mean[constant] = window_min[constant]
+        if window > 1:
+            std[constant] = 0.0
+        slope = np.full_like(series, np.nan)
+        if window - 1 < n:
+            slope[:, window - 1 :] = (series[:, window - 1 :] - series[:, : n - window + 1]) / window
+
+        base = index * len(ROLLING_STATS)
+        for offset, stat in enumerate((mean, std, window_min, window_max, slope)):
+            _write_channels(out, per_channel, base + offset, stat)
+
+
+def mask_lags(out: np.ndarray, lag_steps: list[int], in_gap: np.ndarray) -> int:
+    """Set the lags taken from a row in ``in_gap`` to NaN in a ``fill_lags`` block.
+
+    Returns the number of values masked.
+    """
+    n = len(in_gap)
+    channels = out.shape[1] // len(lag_steps)
+    masked = 0
+    for position, step in enumerate(lag_steps):
+        rows = np.zeros(n, dtype=bool)
+        if step < n:
+            rows[step:] = in_gap[: n - step]
+        for channel in range(channels):
+            out[rows, channel * len(lag_steps) + position] = np.nan
+        masked += int(rows.sum()) * channels
+    return masked
+
+
+def mask_rolling(out: np.ndarray, windows: list[int], in_gap: np.ndarray) -> int:
+    """Set the windows of a ``fill_rolling`` block that contain a row in ``in_gap`` to NaN.
+
+    Returns the number of values masked.
+    """
+    n = len(in_gap)
+    per_channel = len(windows) * len(ROLLING_STATS)
+    channels = out.shape[1] // per_channel
+    # Gap rows up to and including each row, so a window count is one difference
+    counts = np.concatenate([[0], np.cumsum(in_gap)])
+    masked = 0
+    for index, window in enumerate(windows):
+        ends = np.arange(1, n + 1)
+        rows = counts[ends] > counts[np.maximum(ends - window, 0)]
+        for channel in range(channels):
+            first = channel * per_channel + index * len(ROLLING_STATS)
+            out[rows, first : first + len(ROLLING_STATS)] = np.nan
+        masked += int(rows.sum()) * channels * len(ROLLING_STATS)
+    return masked
+
+
+def fill_ewm(values: np.ndarray, spans: list[int], out: np.ndarray) -> None:
+    """Write ``ewm(span, adjust=False)`` mean and std for every span into ``out``.
+
+    The recursion is sequential in time, so it runs through pandas' compiled
+    kernel over all channels at once rather than in Python.
+    """
+    per_channel = len(spans) * 2
+    frame = pd.DataFrame(values)
+    for index, span in enumerate(spans):
+        ewm = frame.ewm(span=span, adjust=False)
+        _write_channels(out, per_channel, index * 2, ewm.mean().to_numpy().T)
+        _write_channels(out, per_channel, index * 2 + 1, ewm.std().to_numpy().T)
+
+
+def error_matrix(df: pd.DataFrame, columns: list[str]) -> np.ndarray:
+    return df[columns].to_numpy(dtype="float64")
+
+
+def feature_block(rows: int, names: list[str]) -> np.ndarray:
+    # Fortran order keeps every feature column contiguous and lets pandas wrap
+    # the block without copying it.
+    return np.empty((rows, len(names)), dtype=feature_dtype(), order="F")
+
+
+def compact_features(df: pd.DataFrame) -> pd.DataFrame:
+    """Cast the float feature columns of ``df`` to the feature precision.
+
+    The error columns the features are computed from stay float64. Frames read
+    back from CSV come in as float64, so every feature stage applies this to
+    its whole output.
+    """
+    dtype = feature_dtype()
+    if dtype == np.float64:
+        return df
+    error_columns = set(ingestion.resolve_columns(df.columns, required=False).values())
+    columns = [
+        column
+        for column in df.columns
+        if column not in error_columns and df[column].dtype == np.float64
+    ]
+    return df.astype(dict.fromkeys(columns, dtype)) if columns else df
+
+
+def max_deviation(reference: pd.DataFrame, compact: pd.DataFrame) -> pd.DataFrame:
+    """Largest absolute and relative difference per float column of two feature frames."""
+    columns = [column for column in reference.columns if reference[column].dtype.kind == "f"]
+    expected = reference[columns].to_numpy(dtype="float64")
+    actual = compact[columns].to_numpy(dtype="float64")
+    with np.errstate(invalid="ignore", divide="ignore"):
+        absolute = np.abs(actual - expected)
+        relative = np.where(absolute == 0, 0.0, absolute / np.abs(expected))
+    return pd.DataFrame(
+        {
+            "max_abs": np.nanmax(np.where(np.isinf(absolute), np.nan, absolute), axis=0, initial=0.0),
+            "max_rel": np.nanmax(relative, axis=0, initial=0.0),
+            "nan_mismatch": (np.isnan(expected) != np.isnan(actual)).sum(axis=0),
+        },
+        index=columns,
+    )
+
+
+def join_block(df: pd.DataFrame, block: np.ndarray, names: list[str]) -> pd.DataFrame:
+    """Attach a feature block to ``df`` in a single concat instead of column by column."""
+    features = pd.DataFrame(block, index=df.index, columns=names, copy=False)
+    return pd.concat([df, features], axis=1)
+
+
+def window_feature_block(
+    values: np.ndarray,
+    short_names: list[str],
+    lag_steps: list[int],
+    windows: list[int],
+    spans: list[int],
+    in_gap: np.ndarray | None = None,
+) -> tuple[np.ndarray, list[str]]:
+    """Lags, rolling and EWM features of an ``(n, channels)`` matrix in one allocation.
+
+    Lags and windows that draw on an ``in_gap`` row are masked as in the lag
+    and rolling stages.
+    """
+    names = (
+        lag_columns(short_names, lag_steps)
+        + rolling_columns(short_names, windows)
+        + ewm_columns(short_names, spans)
+    )
+    block = feature_block(values.shape[0], names)
+    lag_end = len(short_names) * len(lag_steps)
+    rolling_end = lag_end + len(short_names) * len(windows) * len(ROLLING_STATS)
+    fill_lags(values, lag_steps, block[:, :lag_end])
+    fill_rolling(values, windows, block[:, lag_end:rolling_end])
+    fill_ewm(values, spans, block[:, rolling_end:])
+    if in_gap is not None:
+        mask_lags(block[:, :lag_end], lag_steps, in_gap)
+        mask_rolling(block[:, lag_end:rolling_end], windows, in_gap)
+    return block, names
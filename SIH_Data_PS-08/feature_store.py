@@ -0,0 +1,288 @@
+from __future__ import annotations
+
+import argparse
+import hashlib
+import json
+import os
+import time
+from pathlib import Path
+
+import numpy as np
+
+import feature_kernel
+import instrumentation
+import storage
+from lazy_imports import lazy_module
+
+pd = lazy_module("pandas")
+
+STORE_VERSION = 1
+SIDECAR_NAME = "store.json"
+TIME_COLUMN = "utc_time"
+# Rows copied into the matrix at a time while writing
+WRITE_CHUNK_ROWS = 65_536
+HASH_CHUNK_BYTES = 1 << 20
+
+
+def _source_files(source: Path) -> list[Path]:
+    # A stage file, or every file of an ``.npyframe`` directory
+    if source.is_dir():
+        return sorted(child for child in source.rglob("*") if child.is_file())
+    return [source]
+
+
+def _source_stat(source: Path) -> tuple[int, int]:
+    stats = [child.stat() for child in _source_files(source)]
+    return sum(stat.st_size for stat in stats), max((stat.st_mtime_ns for stat in stats), default=0)
+
+
+def source_stamp(source: Path) -> dict[str, object]:
+    """Name, size, modification time and SHA-256 of the stage file a store is written from."""
+    source = Path(source)
+    digest = hashlib.sha256()
+    for child in _source_files(source):
+        if child != source:
+            digest.update(str(child.relative_to(source)).encode())
+        with open(child, "rb") as handle:
+            while chunk := handle.read(HASH_CHUNK_BYTES):
+                digest.update(chunk)
+    size, mtime_ns = _source_stat(source)
+    return {"path": source.name, "size": size, "mtime_ns": mtime_ns, "sha256": digest.hexdigest()}
+
+
+def write_store(
+    df: pd.DataFrame,
+    path: Path,
+    dtype: str | np.dtype | None = None,
+    source: Path | None = None,
+) -> Path:
+    """Write the feature columns of ``df`` as one row-major matrix, indexed by ``utc_time``.
+
+    ``path`` is a directory holding the matrix and the index as ``.npy`` files
+    and a JSON sidecar naming them, with the column names and original dtypes.
+    Every column is cast to ``dtype`` (the feature precision by default).
+    A rewrite puts new files next to the old ones and switches the sidecar
+    over last, so processes that already have the store open keep reading the
+    old pages. ``source`` is the stage file holding the same rows; the sidecar
+    records its :func:`source_stamp` so readers can tell when the file has
+    moved on without the store (see :func:`is_current`).
+    """
+    dtype = feature_kernel.feature_dtype() if dtype is None else np.dtype(dtype)
+    times = df[TIME_COLUMN].to_numpy(dtype="datetime64[ns]")
+    if np.isnat(times).any():
+        raise ValueError("Cannot index a feature store by a time column with missing values")
+    if len(times) > 1 and (np.diff(times.view("int64")) < 0).any():
+        raise ValueError("A feature store needs rows sorted by time")
+    columns = [column for column in df.columns if column != TIME_COLUMN]
+    for column in columns:
+        if not (pd.api.types.is_numeric_dtype(df[column]) or pd.api.types.is_bool_dtype(df[column])):
+            raise ValueError(f"Column '{column}' is not numeric and cannot go into a feature store")
+
+    path.mkdir(parents=True, exist_ok=True)
+    previous = _read_sidecar(path) if (path / SIDECAR_NAME).exists() else None
+    generation = f"{time.time_ns():x}"
+    matrix_name = f"features.{generation}.npy"
+    index_name = f"{TIME_COLUMN}.{generation}.npy"
+
+    matrix = np.lib.format.open_memmap(
+        path / matrix_name, mode="w+", dtype=dtype, shape=(len(df), len(columns))
+    )
+    positions = df.columns.get_indexer(columns)
+    for start in range(0, len(df), WRITE_CHUNK_ROWS):
+        rows = slice(start, start + WRITE_CHUNK_ROWS)
+        matrix[rows] = df.iloc[rows, positions].to_numpy(dtype=dtype)
+    matrix.flush()
+    del matrix
+    np.save(path / index_name, times, allow_pickle=False)
+
+    sidecar = {
+        "version": STORE_VERSION,
+        "rows": len(df),
+        "dtype": dtype.name,
+        "matrix": matrix_name,
+        "index": index_name,
+        "columns": columns,
+        "source_dtypes": [str(df[column].dtype) for column in columns],
+    }
+    if source is not None:
+        sidecar["source"] = source_stamp(source)
+    tmp_path = path / f"{SIDECAR_NAME}.{os.getpid()}.tmp"
+    tmp_path.write_text(json.dumps(sidecar, indent=2) + "\n")
+    os.replace(tmp_path, path / SIDECAR_NAME)
+    if previous is not None:
+        for name in (previous["matrix"], previous["index"]):
+            if name not in (matrix_name, index_name):
+                (path / name).unlink(missing_ok=True)
+    instrumentation.record_write(df, path)
+    return path
+
+
+def _read_sidecar(path: Path) -> dict:
+    sidecar = json.loads((path / SIDECAR_NAME).read_text())
+    if sidecar.get("version", STORE_VERSION) > STORE_VERSION:
+        raise ValueError(f"{path} was written by a newer version (format {sidecar['version']})")
+    return sidecar
+
+
+def is_current(path: Path, source: Path) -> bool:
+    """Whether the store at ``path`` still holds the data of the stage file ``source``.
+
+    The size and modification time recorded at write time settle it without
+    reading the file; when they differ, the hash does, so a copied or touched
+    file keeps its store. A store written without a source counts as current
+    when it is no older than the file.
+    """
+    path, source = Path(path), Path(source)
+    if not (path / SIDECAR_NAME).exists() or not source.exists():
+        return False
+    stamp = _read_sidecar(path).get("source")
+    size, mtime_ns = _source_stat(source)
+    if stamp is None:
+        return (path / SIDECAR_NAME).stat().st_mtime_ns >= mtime_ns
+    if (size, mtime_ns) == (stamp["size"], stamp["mtime_ns"]):
+        return True
+    return size == stamp["size"] and source_stamp(source)["sha256"] == stamp["sha256"]
+
+
+def _as_time(value) -> np.datetime64:
+    # Strings, datetimes, pd.Timestamp and np.datetime64 alike, without importing pandas
+    return np.datetime64(value, "ns")
+
+
+class FeatureStore:
+    """Read-only, memory-mapped view of a store written by :func:`write_store`.
+
+    The matrix and index are mapped with ``mmap_mode="r"``: nothing is read
+    until it is touched, and every process opening the same store shares the
+    pages of the OS cache instead of holding its own copy. Selections are
+    views into the mapping wherever numpy allows it (see :meth:`select`).
+    """
+
+    def __init__(self, path: Path) -> None:
+        self.path = Path(path)
+        # A rewrite may remove the files named by the sidecar just read; read it again once
+        for attempt in range(2):
+            sidecar = _read_sidecar(self.path)
+            try:
+                self.matrix = np.load(self.path / sidecar["matrix"], mmap_mode="r")
+                self.index = np.load(self.path / sidecar["index"], mmap_mode="r")
+                break
+            except FileNotFoundError:
+                if attempt:
+                    raise
+        self.columns: list[str] = sidecar["columns"]
+        self.source_dtypes = dict(zip(self.columns, sidecar["source_dtypes"]))
+        # Stamp of the stage file the store was written from, if recorded
+        self.source: dict[str, object] | None = sidecar.get("source")
+        self._positions = {column: position for position, column in enumerate(self.columns)}
+        if self.matrix.shape != (sidecar["rows"], len(self.columns)):
+            raise ValueError(f"{self.path}: matrix shape {self.matrix.shape} does not match the sidecar")
+
+    def __len__(self) -> int:
+        return len(self.index)
+
+    @property
+    def dtype(self) -> np.dtype:
+        return self.matrix.dtype
+
+    def rows(self, start=None, end=None) -> slice:
+        """Rows with ``start <= utc_time < end``; either bound may be omitted."""
+        first = 0 if start is None else int(np.searchsorted(self.index, _as_time(start), "left"))
+        last = len(self) if end is None else int(np.searchsorted(self.index, _as_time(end), "left"))
+        return slice(first, max(first, last))
+
+    def _column_indexer(self, columns: list[str] | None) -> slice | list[int]:
+        if columns is None:
+            return slice(None)
+        try:
+            positions = [self._positions[column] for column in columns]
+        except KeyError as exc:
+            raise KeyError(f"No column {exc.args[0]!r} in {self.path.name}") from None
+        if len(positions) == 1:
+            return slice(positions[0], positions[0] + 1)
+        steps = set(np.diff(positions).tolist())
+        if len(steps) == 1 and (step := steps.pop()) > 0:
+            # Evenly spaced columns (a contiguous run, or every n-th) are a strided view
+            return slice(positions[0], positions[-1] + 1, step)
+        return positions
+
+    def select(self, columns: list[str] | None = None, start=None, end=None) -> np.ndarray:
+        """``(rows, columns)`` array of a time range and a column subset.
+
+        A view into the mapping (no copy) for any time range combined with all
+        columns, a single column, or columns evenly spaced in store order, such
+        as a contiguous run. Other column subsets cannot be expressed as a view
+        and are copied, for the selected rows only.
+        """
+        return self.matrix[self.rows(start, end), self._column_indexer(columns)]
+
+    def column(self, column: str, start=None, end=None) -> np.ndarray:
+        """One column over a time range, as a strided view."""
+        if column not in self._positions:
+            raise KeyError(f"No column {column!r} in {self.path.name}")
+        return self.matrix[self.rows(start, end), self._positions[column]]
+
+    def times(self, start=None, end=None) -> np.ndarray:
+        return self.index[self.rows(start, end)]
+
+    def frame(self, columns: list[str] | None = None, start=None, end=None) -> pd.DataFrame:
+        """The selection as a DataFrame indexed by ``utc_time`` (this copies)."""
+        rows = self.rows(start, end)
+        names = self.columns if columns is None else list(columns)
+        return pd.DataFrame(
+            np.array(self.select(columns, start, end)),
+            index=pd.DatetimeIndex(np.array(self.index[rows]), name=TIME_COLUMN),
+            columns=names,
+        )
+
+
+def open_store(path: Path) -> FeatureStore:
+    return FeatureStore(path)
+
+
+def main() -> None:
+    # Imported here: add_interaction_features imports this module
+    import add_interaction_features
+
+    parser = argparse.ArgumentParser(
+        description="Compare reading the feature CSV with opening its memory-mapped feature store."
+    )
+    parser.add_argument(
+        "labels", nargs="*", default=list(add_interaction_features.FEATURE_STORES)
+    )
+    args = parser.parse_args()
+
+    for label in args.labels:
+        path = add_interaction_features.FEATURE_STORES[label]
+        csv_path = add_interaction_features.DATASETS[label][1]
+        if not (path / SIDECAR_NAME).exists():
+            print(f"Warning: No feature store at '{path}'. Skipping {label}...")
+            continue
+
+        start = time.perf_counter()
+        frame = storage.load(csv_path)
+        matrix = frame.drop(columns=TIME_COLUMN).to_numpy(dtype=feature_kernel.feature_dtype())
+        csv_seconds = time.perf_counter() - start
+        start = time.perf_counter()
+        store = open_store(path)
+        mapped = store.select()
+        np.nansum(mapped)
+        store_seconds = time.perf_counter() - start
+
+        print(f"--- {label} ---")
+        if not is_current(path, storage.resolve_path(csv_path)):
+            print(f"Warning: The store is older than {csv_path.name}; rerun the interaction stage")
+        print(f"Store: {path.name}, {len(store)} rows x {len(store.columns)} columns, {store.dtype}")
+        if len(store):
+            print(f"Time span: {store.index[0]} to {store.index[-1]}")
+        with np.errstate(invalid="ignore", divide="ignore"):
+            relative = np.abs(mapped - matrix) / np.abs(matrix)
+        # Non-zero only from the rounding of the CSV parser (or of a float32 store)
+        print(f"Largest relative difference to the CSV: {np.nanmax(relative, initial=0.0):.3g}")
+        print(f"CSV load + to_numpy: {csv_seconds * 1000:.1f} ms")
+        print(f"Store open + full scan: {store_seconds * 1000:.1f} ms")
+        print()
+
+
+if __name__ == "__main__":
+    main()
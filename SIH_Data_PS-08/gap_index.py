@@ -0,0 +1,118 @@
+from __future__ import annotations
+
+import json
+import os
+from pathlib import Path
+
+import numpy as np
+
+GAP_INDEX_VERSION = 1
+GAP_INDEX_SUFFIX = ".gaps.json"
+# Longest run of empty slots that interpolation fills; longer gaps stay NaN and the
+# lag and rolling features that draw on them are masked. Unset: every gap is filled.
+MAX_GAP_ENV = "SIH_MAX_GAP_ROWS"
+
+
+def max_gap_rows(value: int | str | None = None) -> int | None:
+    value = value if value is not None else os.environ.get(MAX_GAP_ENV, "")
+    if value in ("", "none"):
+        return None
+    rows = int(value)
+    if rows < 0:
+        raise ValueError(f"The maximum gap length cannot be negative, got {rows}")
+    return rows
+
+
+def sidecar_path(data_path: Path) -> Path:
+    """``MEO_15min_raw.csv`` -> ``MEO_15min_raw.gaps.json``, next to the resampled file."""
+    data_path = Path(data_path)
+    return data_path.with_name(data_path.stem + GAP_INDEX_SUFFIX)
+
+
+def _as_nanos(times) -> np.ndarray:
+    return np.asarray(times, dtype="datetime64[ns]").view(np.int64)
+
+
+class GapIndex:
+    """Runs of empty resampling slots, as ``(start, length)`` pairs.
+
+    ``starts`` are the times of the first empty slot of every run (int64
+    nanoseconds) and ``lengths`` the number of slots in it, ``step``
+    nanoseconds apart. Rows are looked up by time, so the index applies to
+    every later stage on the same grid without scanning its frame for NaNs.
+    """
+
+    def __init__(self, starts: np.ndarray, lengths: np.ndarray, step: int) -> None:
+        self.starts = np.asarray(starts, dtype=np.int64)
+        self.lengths = np.asarray(lengths, dtype=np.int64)
+        self.step = int(step)
+
+    @classmethod
+    def from_empty(cls, times, empty: np.ndarray, step: int) -> GapIndex:
+        """Run-length encode the ``empty`` rows of a resampled frame with bin times ``times``."""
+        edges = np.diff(np.concatenate([[0], np.asarray(empty, dtype=np.int8), [0]]))
+        first = np.flatnonzero(edges == 1)
+        lengths = np.flatnonzero(edges == -1) - first
+        return cls(_as_nanos(times)[first], lengths, step)
+
+    def __len__(self) -> int:
+        return len(self.starts)
+
+    @property
+    def empty_rows(self) -> int:
+        return int(self.lengths.sum())
+
+    def longer_than(self, rows: int | None) -> GapIndex:
+        """The runs of more than ``rows`` slots (none when ``rows`` is None)."""
+        keep = self.lengths > rows if rows is not None else np.zeros(len(self), dtype=bool)
+        return GapIndex(self.starts[keep], self.lengths[keep], self.step)
+
+    def row_mask(self, times) -> np.ndarray:
+        """Which of the sorted ``times`` fall inside a run."""
+        times = _as_nanos(times)
+        first = np.searchsorted(times, self.starts, "left")
+        last = np.searchsorted(times, self.starts + self.lengths * self.step, "left")
+        edges = np.bincount(first, minlength=len(times) + 1) - np.bincount(
+            last, minlength=len(times) + 1
+        )
+        return np.cumsum(edges[: len(times)]) > 0
+
+    def save(self, path: Path) -> Path:
+        path = Path(path)
+        path.parent.mkdir(parents=True, exist_ok=True)
+        index = {
+            "version": GAP_INDEX_VERSION,
+            "step_ns": self.step,
+            "starts_ns": self.starts.tolist(),
+            "lengths": self.lengths.tolist(),
+        }
+        path.write_text(json.dumps(index) + "\n")
+        return path
+
+    @classmethod
+    def load(cls, path: Path) -> GapIndex:
+        index = json.loads(Path(path).read_text())
+        if index.get("version", GAP_INDEX_VERSION) > GAP_INDEX_VERSION:
+            raise ValueError(f"{path} was written by a newer version (format {index['version']})")
+        return cls(index["starts_ns"], index["lengths"], index["step_ns"])
+
+
+def load(path: Path | None) -> GapIndex | None:
+    """The gap index at ``path``, or None if there is none (the stages then mask nothing)."""
+    if path is None or not Path(path).exists():
+        return None
+    return GapIndex.load(path)
+
+
+def long_gap_rows(gaps: GapIndex | None, times, max_rows: int | None = None) -> np.ndarray | None:
+    """Rows of ``times`` inside gaps longer than ``max_rows`` (``$SIH_MAX_GAP_ROWS``).
+
+    None when there is nothing to mask: no index, no limit, or no gap that long.
+    """
+    max_rows = max_gap_rows(max_rows)
+    if gaps is None or max_rows is None:
+        return None
+    long_gaps = gaps.longer_than(max_rows)
+    if not len(long_gaps):
+        return None
+    return long_gaps.row_mask(times)
@@ -0,0 +1,262 @@
+from __future__ import annotations
+
+import functools
+import re
+from pathlib import Path
+from typing import Iterator
+
+import numpy as np
+
+import storage
+from lazy_imports import lazy_module
+
+pd = lazy_module("pandas")
+
+TIME_COLUMN = "utc_time"
+NUMERIC_COLUMNS = ["x_error", "y_error", "z_error", "satclockerror"]
+NORMALIZED_TARGETS = {"".join(col.lower().split("_")): col for col in NUMERIC_COLUMNS}
+# Digits each strptime directive accepts; formats built only from these take the fast parser
+FIELD_DIGITS = {"%Y": (4, 4), "%m": (1, 2), "%d": (1, 2), "%H": (1, 2), "%M": (1, 2), "%S": (1, 2)}
+FIELD_RANGES = {"%Y": (1678, 2261), "%m": (1, 12), "%d": (1, 31), "%H": (0, 23), "%M": (0, 59), "%S": (0, 59)}
+NANOS_PER = {"%H": 3600 * 10**9, "%M": 60 * 10**9, "%S": 10**9}
+DAY_NANOS = 24 * 3600 * 10**9
+
+
+def normalize_column_name(name: str) -> str:
+    """``"y_error  (m)"`` -> ``"yerror"``: drop the unit, spaces, underscores and case."""
+    return name.split("(")[0].strip().lower().replace(" ", "").replace("_", "")
+
+
+@functools.lru_cache(maxsize=256)
+def _resolve_header(header: tuple[str, ...]) -> tuple[tuple[str, str], ...]:
+    mapping: dict[str, str] = {}
+    for column in header:
+        if column.lower() == TIME_COLUMN:
+            continue
+        normalized = normalize_column_name(column)
+        for normalized_target, target in NORMALIZED_TARGETS.items():
+            if normalized.startswith(normalized_target) and target not in mapping:
+                mapping[target] = column
+                break
+    return tuple(mapping.items())
+
+
+def resolve_columns(columns: pd.Index | list[str], required: bool = True) -> dict[str, str]:
+    """Map each of ``NUMERIC_COLUMNS`` to the first column whose normalised name starts with it.
+
+    The result is cached per header, so every stage reading the same layout
+    resolves it once.
+    """
+    mapping = dict(_resolve_header(tuple(columns)))
+    missing = [target for target in NUMERIC_COLUMNS if target not in mapping]
+    if required and missing:
+        raise ValueError(f"Missing expected columns: {', '.join(missing)}")
+    return {target: mapping[target] for target in NUMERIC_COLUMNS if target in mapping}
+
+
+@functools.lru_cache(maxsize=256)
+def _find_header(
+    header: tuple[str, ...], patterns: tuple[tuple[str, str], ...]
+) -> tuple[tuple[str, str], ...]:
+    found = []
+    for pattern, short_name in patterns:
+        matching_cols = [col for col in header if pattern in col]
+        if matching_cols:
+            found.append((matching_cols[0], short_name))
+    return tuple(found)
+
+
+def find_columns(
+    columns: pd.Index | list[str], patterns: list[tuple[str, str]]
+) -> list[tuple[str, str]]:
+    """``(column, short_name)`` for the first column containing each pattern, cached per header."""
+    return list(_find_header(tuple(columns), tuple(patterns)))
+
+
+def read_header(path: Path) -> list[str]:
+    """Column names of a stage file (in any storage format) without reading its rows."""
+    return list(storage.tail(path, 0).columns)
+
+
+def detect_time_format(values: pd.Series) -> str | None:
+    """The format ``pd.to_datetime`` infers for a column: the one of its first value."""
+    try:
+        from pandas.tseries.api import guess_datetime_format
+    except ImportError:  # pandas < 2.2
+        from pandas._libs.tslibs.parsing import guess_datetime_format
+
+    present = values.dropna()
+    if present.empty or not isinstance(present.iloc[0], str):
+        return None
+    # When the first value matches no known format, every value is parsed on its own
+    return guess_datetime_format(present.iloc[0]) or "mixed"
+
+
+@functools.lru_cache(maxsize=32)
+def _numeric_layout(time_format: str) -> tuple[tuple[str, ...], bytes] | None:
+    # "%m/%d/%Y %H:%M" -> (("%m", "%d", "%Y", "%H", "%M"), b"// :"). ISO formats are
+    # left to pandas, whose C parser already handles them quickly.
+    if time_format.startswith("%Y-%m-%d"):
+        return None
+    tokens = re.findall(r"%.|.", time_format)
+    fields = tuple(tokens[0::2])
+    separators = tokens[1::2]
+    if (
+        len(tokens) % 2 == 0
+        or any(field not in FIELD_DIGITS for field in fields)
+        or len(set(fields)) != len(fields)
+        or not {"%Y", "%m", "%d"} <= set(fields)
+        or any(sep.startswith("%") or sep.isdigit() for sep in separators)
+    ):
+        return None
+    return fields, "".join(separators).encode()
+
+
+def _days_from_civil(year: np.ndarray, month: np.ndarray, day: np.ndarray) -> np.ndarray:
+    # Days since 1970-01-01 of a proleptic Gregorian date (H. Hinnant's algorithm)
+    year = year - (month <= 2)
+    era = year // 400
+    year_of_era = year - era * 400
+    day_of_year = (153 * (month + np.where(month > 2, -3, 9)) + 2) // 5 + day - 1
+    day_of_era = year_of_era * 365 + year_of_era // 4 - year_of_era // 100 + day_of_year
+    return era * 146097 + day_of_era - 719468
+
+
+def _parse_numeric(
+    values: np.ndarray, fields: tuple[str, ...], separators: bytes
+) -> tuple[np.ndarray, np.ndarray] | None:
+    """Parse all-digit timestamp fields from the raw bytes, one character column at a time.
+
+    Returns nanoseconds and a mask of the rows that were parsed; anything the
+    format does not describe unambiguously (wrong separators, digit counts or
+    ranges, missing values) is left unmasked for pandas to handle.
+    """
+    try:
+        raw = values.astype("S")
+    except (UnicodeEncodeError, ValueError, TypeError):
+        return None
+    rows = len(raw)
+    if rows == 0 or raw.dtype.itemsize == 0:
+        return None
+    chars = raw.view(np.uint8).reshape(rows, raw.dtype.itemsize)
+    last_field = len(fields) - 1
+    expected = np.frombuffer(separators + b"\0", dtype=np.uint8)
+
+    numbers = np.zeros((len(fields), rows), dtype=np.int64)
+    digits = np.zeros((len(fields), rows), dtype=np.int64)
+    number = np.zeros(rows, dtype=np.int64)
+    count = np.zeros(rows, dtype=np.int64)
+    field = np.zeros(rows, dtype=np.intp)
+    ended = np.zeros(rows, dtype=bool)
+    ok = np.ones(rows, dtype=bool)
+    for column in np.ascontiguousarray(chars.T):
+        value = column.astype(np.int64) - 48
+        is_digit = (value >= 0) & (value <= 9)
+        is_end = column == 0
+        is_separator = ~is_digit & ~is_end
+        ok &= ~ended | is_end
+        ended |= is_end
+        np.copyto(number, number * 10 + value, where=is_digit)
+        count += is_digit
+        ok &= ~is_separator | ((field < last_field) & (column == expected[field]))
+        if not is_separator.any():
+            continue
+        for position in range(last_field):
+            closes = is_separator & (field == position)
+            np.copyto(numbers[position], number, where=closes)
+            np.copyto(digits[position], count, where=closes)
+        np.copyto(number, 0, where=is_separator)
+        np.copyto(count, 0, where=is_separator)
+        field = np.where(is_separator & ok, field + 1, field)
+    numbers[last_field] = number
+    digits[last_field] = count
+    ok &= field == last_field
+
+    parts = {}
+    for position, name in enumerate(fields):
+        low_digits, high_digits = FIELD_DIGITS[name]
+        low, high = FIELD_RANGES[name]
+        count, number = digits[position], numbers[position]
+        ok &= (count >= low_digits) & (count <= high_digits) & (number >= low) & (number <= high)
+        parts[name] = number
+
+    year, month, day = parts["%Y"], parts["%m"], parts["%d"]
+    days = _days_from_civil(year, month, day)
+    # Rejects day 31 of a 30-day month, 29 February of common years and so on
+    ok &= days < _days_from_civil(year + (month == 12), month % 12 + 1, np.ones_like(day))
+    nanos = days * DAY_NANOS
+    for name, scale in NANOS_PER.items():
+        if name in parts:
+            nanos += parts[name] * scale
+    return nanos, ok
+
+
+def parse_times(values: pd.Series, time_format: str | None = None) -> pd.Series:
+    """``pd.to_datetime(values, errors="coerce")`` with the format detected once.
+
+    Gives the same result as the pandas call. Formats made only of numeric
+    fields (such as ``9/1/2025 6:00``) are parsed straight from the bytes,
+    which is several times faster than strptime.
+    """
+    if pd.api.types.is_datetime64_any_dtype(values):
+        return values
+    if time_format is None:
+        time_format = detect_time_format(values)
+    layout = _numeric_layout(time_format) if time_format not in (None, "mixed") else None
+    parsed = None
+    if layout is not None and values.dtype == object:
+        parsed = _parse_numeric(values.to_numpy(), *layout)
+    if parsed is None:
+        return pd.to_datetime(values, format=time_format, errors="coerce")
+
+    nanos, ok = parsed
+    result = pd.Series(nanos.view("datetime64[ns]"), index=values.index, name=values.name)
+    if not ok.all():
+        result[~ok] = pd.to_datetime(values[~ok], format=time_format, errors="coerce")
+    return result
+
+
+def _column_dtypes(header: list[str], usecols: list[str]) -> dict[str, str]:
+    error_columns = set(resolve_columns(header, required=False).values())
+    dtype = {column: "float64" for column in usecols if column in error_columns}
+    if TIME_COLUMN in usecols:
+        dtype[TIME_COLUMN] = "object"
+    return dtype
+
+
+def load(path: Path, columns: list[str] | None = None) -> pd.DataFrame:
+    """Read a stage file with the error columns typed float64 and ``utc_time`` parsed.
+
+    ``columns`` limits the read to those columns (``utc_time`` is always kept).
+    """
+    header = read_header(path)
+    usecols = header if columns is None else [c for c in header if c in columns or c == TIME_COLUMN]
+    df = storage.load(
+        path, columns=None if columns is None else usecols, dtype=_column_dtypes(header, usecols)
+    )
+    if TIME_COLUMN in df.columns:
+        df[TIME_COLUMN] = parse_times(df[TIME_COLUMN])
+    return df
+
+
+def iter_chunks(path: Path, chunk_rows: int) -> Iterator[pd.DataFrame]:
+    """:func:`load` ``chunk_rows`` rows at a time, detecting the time format once."""
+    header = read_header(path)
+    time_format = None
+    for chunk in storage.iter_chunks(path, chunk_rows, dtype=_column_dtypes(header, header)):
+        if TIME_COLUMN in chunk.columns:
+            if time_format is None:
+                time_format = detect_time_format(chunk[TIME_COLUMN])
+            chunk[TIME_COLUMN] = parse_times(chunk[TIME_COLUMN], time_format)
+        yield chunk
+
+
+def raw_dtypes(path: Path) -> dict[str, str]:
+    """Column types of a raw ``DATA_*.csv`` file: text ``utc_time``, float error channels."""
+    header = pd.read_csv(path, nrows=0).columns
+    return {column: "object" if column == TIME_COLUMN else "float64" for column in header}
+
+
+def read_raw(path: Path) -> pd.DataFrame:
+    """Read a raw file with explicit column types; ``utc_time`` is left as text."""
+    return pd.read_csv(path, dtype=raw_dtypes(path))
@@ -0,0 +1,272 @@
+from __future__ import annotations
+
+import argparse
+import contextlib
+import functools
+import inspect
+import json
+import os
+import resource
+import time
+from datetime import datetime, timezone
+from pathlib import Path
+from typing import Callable, Iterator
+
+from lazy_imports import lazy_module
+
+pd = lazy_module("pandas")
+
+BASE_DIR = Path(__file__).resolve().parent
+# Every stage run appends one JSON line here; set the variable to an empty string to disable.
+METRICS_LOG_ENV = "SIH_METRICS_LOG"
+DEFAULT_METRICS_LOG = BASE_DIR / "logs" / "stage_metrics.jsonl"
+# Set to 1 to print the frame previews the stages used to print unconditionally.
+PREVIEW_ENV = "SIH_PREVIEW"
+RUN_ID = os.environ.get("SIH_RUN_ID") or f"{time.strftime('%Y%m%dT%H%M%S')}-{os.getpid()}"
+SUMMARY_COLUMNS = [
+    "stage",
+    "dataset",
+    "status",
+    "wall_seconds",
+    "cpu_seconds",
+    "peak_rss_mb",
+    "rows_in",
+    "rows_out",
+    "nans_in",
+    "nans_out",
+    "bytes_read",
+    "bytes_written",
+]
+# Runs slower than this multiple of a stage's median are flagged by the log summary
+REGRESSION_RATIO = 1.5
+
+RECORDS: list[dict[str, object]] = []
+_active: StageRecord | None = None
+
+
+def rss_bytes(field: str = "VmRSS") -> int:
+    """Current (``VmRSS``) or peak (``VmHWM``) resident memory of this process."""
+    try:
+        with open("/proc/self/status") as status:
+            for line in status:
+                if line.startswith(field + ":"):
+                    return int(line.split()[1]) * 1024
+    except OSError:
+        pass
+    # Outside Linux only the lifetime peak is available
+    return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss * 1024
+
+
+def reset_peak_rss() -> None:
+    # Writing 5 to clear_refs resets VmHWM to the current RSS (Linux 4.0+)
+    with contextlib.suppress(OSError):
+        with open("/proc/self/clear_refs", "w") as clear_refs:
+            clear_refs.write("5")
+
+
+def path_bytes(path: Path) -> int:
+    """Size of a stage file, or of all files in an ``.npyframe`` directory."""
+    if path.is_dir():
+        return sum(child.stat().st_size for child in path.rglob("*") if child.is_file())
+    return path.stat().st_size
+
+
+def _nan_count(df: pd.DataFrame) -> int:
+    return int(df.isna().sum().sum())
+
+
+def _byte_count(path: Path | None, size: int | None) -> int:
+    if size is not None:
+        return size
+    return path_bytes(path) if path is not None else 0
+
+
+class StageRecord:
+    """Metrics of one stage run on one dataset, filled in while the stage runs."""
+
+    def __init__(self, stage: str, dataset: str) -> None:
+        self.stage = stage
+        self.dataset = dataset
+        self.rows_in = 0
+        self.nans_in = 0
+        self.bytes_read = 0
+        self.rows_out = 0
+        self.nans_out = 0
+        self.bytes_written = 0
+
+    def read(self, df: pd.DataFrame, path: Path | None = None, size: int | None = None) -> None:
+        self.rows_in += len(df)
+        self.nans_in += _nan_count(df)
+        self.bytes_read += _byte_count(path, size)
+
+    def wrote(self, df: pd.DataFrame, path: Path | None = None, size: int | None = None) -> None:
+        # The output frame is the last one written; bytes add up over all files
+        self.rows_out = len(df)
+        self.nans_out = _nan_count(df)
+        self.bytes_written += _byte_count(path, size)
+
+
+def record_read(df: pd.DataFrame, path: Path | None = None, size: int | None = None) -> None:
+    """Count a frame read by the running stage (no-op outside a stage).
+
+    ``size`` overrides the byte count taken from ``path``, for partial reads.
+    """
+    if _active is not None:
+        _active.read(df, path, size)
+
+
+def record_write(df: pd.DataFrame, path: Path | None = None, size: int | None = None) -> None:
+    """Count a frame written by the running stage (no-op outside a stage)."""
+    if _active is not None:
+        _active.wrote(df, path, size)
+
+
+def metrics_log_path() -> Path | None:
+    configured = os.environ.get(METRICS_LOG_ENV)
+    if configured is None:
+        return DEFAULT_METRICS_LOG
+    return Path(configured) if configured else None
+
+
+def _write_log_line(entry: dict[str, object]) -> None:
+    log_path = metrics_log_path()
+    if log_path is None:
+        return
+    log_path.parent.mkdir(parents=True, exist_ok=True)
+    # One write() on an O_APPEND descriptor, so lines from parallel workers do not interleave
+    line = (json.dumps(entry) + "\n").encode()
+    fd = os.open(log_path, os.O_WRONLY | os.O_APPEND | os.O_CREAT, 0o644)
+    try:
+        os.write(fd, line)
+    finally:
+        os.close(fd)
+
+
+@contextlib.contextmanager
+def stage(name: str, dataset: str) -> Iterator[StageRecord]:
+    """Measure one stage run and log it.
+
+    Frames loaded and saved through ``storage`` while the block runs are counted
+    automatically. A stage started inside another one is folded into the outer
+    record.
+    """
+    global _active
+    record = StageRecord(name, dataset)
+    if _active is not None:
+        yield _active
+        return
+
+    _active = record
+    rss_before = rss_bytes()
+    reset_peak_rss()
+    wall_start = time.perf_counter()
+    cpu_start = time.process_time()
+    status, error = "ok", ""
+    try:
+        yield record
+    except BaseException as exc:
+        status, error = "failed", f"{type(exc).__name__}: {exc}"
+        raise
+    finally:
+        _active = None
+        entry = {
+            "time": datetime.now(timezone.utc).isoformat(timespec="seconds"),
+            "run_id": RUN_ID,
+            "stage": name,
+            "dataset": dataset,
+            "status": status,
+            "wall_seconds": round(time.perf_counter() - wall_start, 4),
+            "cpu_seconds": round(time.process_time() - cpu_start, 4),
+            "rss_before_mb": round(rss_before / 2**20, 1),
+            "peak_rss_mb": round(rss_bytes("VmHWM") / 2**20, 1),
+            "rows_in": record.rows_in,
+            "rows_out": record.rows_out,
+            "nans_in": record.nans_in,
+            "nans_out": record.nans_out,
+            "bytes_read": record.bytes_read,
+            "bytes_written": record.bytes_written,
+        }
+        if error:
+            entry["error"] = error
+        RECORDS.append(entry)
+        _write_log_line(entry)
+
+
+def instrumented(name: str) -> Callable:
+    """Run the decorated ``process_dataset``-style function inside ``stage(name, label)``."""
+
+    def decorator(function: Callable) -> Callable:
+        signature = inspect.signature(function)
+
+        @functools.wraps(function)
+        def wrapper(*args, **kwargs):
+            label = signature.bind(*args, **kwargs).arguments["label"]
+            with stage(name, label):
+                return function(*args, **kwargs)
+
+        return wrapper
+
+    return decorator
+
+
+def preview(df: pd.DataFrame, rows: int, title: str) -> None:
+    """Print the first ``rows`` rows of ``df``, only when previews are switched on."""
+    if os.environ.get(PREVIEW_ENV, "") not in ("", "0"):
+        print(title)
+        print(df.head(rows).to_string(index=False))
+
+
+def summary_table(records: list[dict[str, object]]) -> pd.DataFrame:
+    return pd.DataFrame(records, columns=SUMMARY_COLUMNS)
+
+
+def print_summary(
+    records: list[dict[str, object]] | None = None, title: str = "Stage summary"
+) -> None:
+    """Print the stages run by this process (or ``records``), slowest first."""
+    table = summary_table(RECORDS if records is None else records)
+    if table.empty:
+        return
+    total = table["wall_seconds"].sum()
+    table = table.sort_values("wall_seconds", ascending=False)
+    print(f"=== {title} ===")
+    print(table.to_string(index=False))
+    print(f"Total wall time: {total:.3f} s")
+
+
+def read_log(log_path: Path) -> pd.DataFrame:
+    return pd.read_json(log_path, lines=True)
+
+
+def log_summary(log: pd.DataFrame) -> pd.DataFrame:
+    """The latest run of every stage and dataset next to its median over all runs."""
+    log = log[log["status"] == "ok"].sort_values("time", kind="stable")
+    grouped = log.groupby(["stage", "dataset"], sort=False)
+    summary = grouped.tail(1).set_index(["stage", "dataset"])[
+        ["time", "wall_seconds", "peak_rss_mb", "rows_out"]
+    ]
+    summary = summary.rename(columns={"wall_seconds": "last_seconds"})
+    summary["runs"] = grouped.size()
+    summary["median_seconds"] = grouped["wall_seconds"].median()
+    summary["vs_median"] = (summary["last_seconds"] / summary["median_seconds"]).round(2)
+    summary["regression"] = summary["vs_median"] > REGRESSION_RATIO
+    return summary.sort_values("last_seconds", ascending=False).reset_index()
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description="Summarise the stage metrics log.")
+    parser.add_argument("log", type=Path, nargs="?", default=metrics_log_path())
+    args = parser.parse_args()
+
+    if args.log is None or not args.log.exists():
+        raise SystemExit(f"No metrics log at {args.log}")
+    summary = log_summary(read_log(args.log))
+    print(summary.to_string(index=False))
+    regressions = summary[summary["regression"]]
+    if not regressions.empty:
+        print(f"\nSlower than {REGRESSION_RATIO}x their median:")
+        print(regressions[["stage", "dataset", "last_seconds", "median_seconds"]].to_string(index=False))
+
+
+if __name__ == "__main__":
+    main()
@@ -2,7 +2,16 @@ from __future__ import annotations
 
 from pathlib import Path
 
-import pandas as pd
+import numpy as np
+
+import gap_index
+import ingestion
+import instrumentation
+import resample_satellites
+import storage
+from lazy_imports import lazy_module
+
+pd = lazy_module("pandas")
 
 INPUT_DIR = Path(__file__).resolve().parent / "15min_resampled"
 DATASETS = {
@@ -15,11 +24,19 @@ def _count_total_nans(df: pd.DataFrame) -> int:
     return int(df.isna().sum().sum())
 
 
-def process_dataset(label: str, input_path: Path, output_path: Path) -> None:
-    df = pd.read_csv(input_path)
-    df["utc_time"] = pd.to_datetime(df["utc_time"], errors="coerce")
+def process_frame(
+    label: str,
+    df: pd.DataFrame,
+    gaps: gap_index.GapIndex | None = None,
+    max_gap_rows: int | None = None,
+) -> pd.DataFrame:
+    """Interpolate in time, leaving the gap runs longer than ``max_gap_rows`` empty.
 
-    df = df.set_index("utc_time")
+    ``max_gap_rows`` defaults to ``$SIH_MAX_GAP_ROWS``; without a limit, or
+    without a gap index, every gap is filled.
+    """
+    utc = ingestion.parse_times(df["utc_time"])
+    df = df.assign(utc_time=utc).set_index("utc_time")
 
     before_nans = _count_total_nans(df)
 
@@ -33,10 +50,14 @@ def process_dataset(label: str, input_path: Path, output_path: Path) -> None:
         interpolated = interpolated.ffill()
         boundary_actions.append("ffill")
 
+    long_rows = gap_index.long_gap_rows(gaps, interpolated.index, max_gap_rows)
+    if long_rows is not None:
+        # Put the long gaps back; the short ones and the outliers stay filled
+        interpolated.loc[long_rows] = np.nan
+
     after_nans = _count_total_nans(interpolated)
 
     result = interpolated.reset_index()
-    result.to_csv(output_path, index=False)
 
     print(f"--- {label} ---")
     print(f"NaNs before interpolation: {before_nans}")
@@ -45,12 +66,27 @@ def process_dataset(label: str, input_path: Path, output_path: Path) -> None:
         print("Boundary fills applied: " + ", ".join(boundary_actions))
     else:
         print("Boundary fills applied: none")
+    if gaps is not None:
+        limit = gap_index.max_gap_rows(max_gap_rows)
+        filled = len(gaps) - len(gaps.longer_than(limit))
+        limit_text = "none" if limit is None else f"{limit} rows"
+        print(f"Gap runs filled: {filled} of {len(gaps)} (limit: {limit_text})")
     print()
+    return result
+
+
+@instrumentation.instrumented("interpolate")
+def process_dataset(
+    label: str, input_path: Path, output_path: Path, gaps_path: Path | None = None
+) -> None:
+    df = ingestion.load(input_path)
+    storage.save(process_frame(label, df, gap_index.load(gaps_path)), output_path)
 
 
 def main() -> None:
     for label, (input_path, output_path) in DATASETS.items():
-        process_dataset(label, input_path, output_path)
+        process_dataset(label, input_path, output_path, resample_satellites.GAP_INDEXES[label])
+    instrumentation.print_summary()
 
 
 if __name__ == "__main__":
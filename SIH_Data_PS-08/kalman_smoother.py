@@ -0,0 +1,308 @@
+from __future__ import annotations
+
+import argparse
+import time
+from pathlib import Path
+
+import numpy as np
+
+import ingestion
+import instrumentation
+import smooth_timeseries
+import storage
+from lazy_imports import lazy_module
+
+pd = lazy_module("pandas")
+
+INPUT_DIR = Path(__file__).resolve().parent / "15min_resampled"
+# Reads the outlier-free files with their gaps still open: the filter fills them
+# itself, in place of the interpolate and smooth stages
+DATASETS = {
+    "MEO": (
+        INPUT_DIR / "MEO_Zscore_outliers_removed.csv",
+        INPUT_DIR / "MEO_kalman_smoothed.csv",
+    ),
+    "GEO": (
+        INPUT_DIR / "GEO_Zscore_outliers_removed.csv",
+        INPUT_DIR / "GEO_kalman_smoothed.csv",
+    ),
+}
+# random_walk: the error level drifts by white noise every row.
+# constant_velocity: level and rate, with white noise on the rate (smoother trends).
+KALMAN_MODELS = ("random_walk", "constant_velocity")
+KALMAN_MODEL = "random_walk"
+# Observation pairs further apart than this (one day) are left out of the noise fit
+MAX_FIT_SPACING = 96
+# Variance of the smoothed value of a column goes in "variance_<column>"
+VARIANCE_PREFIX = "variance_"
+
+
+def _transition(model: str) -> tuple[np.ndarray, np.ndarray]:
+    """State transition ``F`` and process noise shape ``Q / q`` of one 15-minute step."""
+    if model == "random_walk":
+        return np.ones((1, 1)), np.ones((1, 1))
+    if model == "constant_velocity":
+        return np.array([[1.0, 1.0], [0.0, 1.0]]), np.array([[1 / 3, 1 / 2], [1 / 2, 1.0]])
+    raise ValueError(f"Unknown Kalman model '{model}', expected one of: {', '.join(KALMAN_MODELS)}")
+
+
+def fit_noise(values: np.ndarray, model: str = KALMAN_MODEL) -> tuple[np.ndarray, np.ndarray]:
+    """Process and measurement noise variances ``(q, r)`` of every column of ``values``.
+
+    Two observations ``k`` rows apart differ by ``2 r`` plus the process
+    noise built up over ``k`` steps (``q k`` for a random walk, ``q k**3 / 3``
+    for a constant-velocity rate), so a least-squares line through the squared
+    differences of consecutive observations gives both, gaps included.
+    """
+    _transition(model)
+    columns = values.shape[1]
+    q = np.ones(columns)
+    r = np.ones(columns)
+    for column in range(columns):
+        rows = np.flatnonzero(~np.isnan(values[:, column]))
+        spacing = np.diff(rows)
+        keep = spacing <= MAX_FIT_SPACING
+        squared = np.diff(values[rows, column])[keep] ** 2
+        spacing = spacing[keep].astype(np.float64)
+        if len(squared) < 3:
+            continue
+        growth = spacing if model == "random_walk" else spacing**3 / 3
+        design = np.column_stack([np.full(len(growth), 2.0), growth])
+        (r_fit, q_fit), *_ = np.linalg.lstsq(design, squared, rcond=None)
+        # Both must stay positive; a tiny floor keeps the filter well defined
+        floor = max(float(squared.mean()), 1e-12) * 1e-6
+        r[column] = max(r_fit, floor)
+        q[column] = max(q_fit, floor)
+    return q, r
+
+
+class KalmanFilter:
+    """Forward Kalman filter over many series at once, one time loop for all.
+
+    ``values`` batches are ``(rows, series)``: every column is one channel of
+    one satellite, with its own noise variances. The state arrays are stacked
+    as ``(series, k)`` means and ``(series, k, k)`` covariances, so each row is
+    a handful of numpy operations whatever the number of series. A series
+    starts at its first observation (level known to within ``r``, rate to
+    within that of a one-row difference); before it, its estimates are NaN.
+    NaN observations (gaps, removed outliers) only advance the prediction.
+    Batches can be fed as data arrives (online mode): the state carries over,
+    and the filtered values equal those of one pass over the whole series.
+    """
+
+    def __init__(
+        self, q: np.ndarray, r: np.ndarray, model: str = KALMAN_MODEL, keep_history: bool = False
+    ) -> None:
+        self.model = model
+        self.transition, noise_shape = _transition(model)
+        self.noise = np.asarray(q, dtype=np.float64)[:, None, None] * noise_shape
+        self.r = np.asarray(r, dtype=np.float64)
+        series, states = len(self.r), len(self.transition)
+        self.mean = np.zeros((series, states))
+        self.covariance = np.zeros((series, states, states))
+        self.started = np.zeros(series, dtype=bool)
+        # Covariance of a series' state at its first observation
+        self.initial_covariance = np.zeros((series, states, states))
+        self.initial_covariance[:, 0, 0] = self.r
+        if states > 1:
+            self.initial_covariance[:, 1, 1] = 2 * self.r + self.noise[:, 1, 1]
+        self.keep_history = keep_history
+        # (started, predicted mean, predicted covariance, filtered mean, filtered covariance)
+        self.history: list[tuple[np.ndarray, ...]] = []
+
+    def update(self, values: np.ndarray) -> tuple[np.ndarray, np.ndarray]:
+        """Filtered level and its variance for the next ``(rows, series)`` batch."""
+        values = np.asarray(values, dtype=np.float64)
+        levels = np.empty(values.shape)
+        variances = np.empty(values.shape)
+        transition = self.transition
+        for row, observed in enumerate(values):
+            mean = self.mean @ transition.T
+            covariance = transition @ self.covariance @ transition.T + self.noise
+            valid = ~np.isnan(observed)
+            starting = valid & ~self.started
+            if starting.any():
+                mean[starting] = 0.0
+                mean[starting, 0] = observed[starting]
+                covariance[starting] = self.initial_covariance[starting]
+                self.started |= starting
+            predicted = (mean, covariance)
+
+            # The first observation is already in the starting state
+            update = valid & ~starting
+            gain = covariance[:, :, 0] / (covariance[:, 0, 0] + self.r)[:, None]
+            gain *= update[:, None]
+            innovation = np.where(update, observed - mean[:, 0], 0.0)
+            mean = mean + gain * innovation[:, None]
+            covariance = covariance - gain[:, :, None] * covariance[:, 0, None, :]
+
+            self.mean, self.covariance = mean, covariance
+            levels[row] = np.where(self.started, mean[:, 0], np.nan)
+            variances[row] = np.where(self.started, covariance[:, 0, 0], np.nan)
+            if self.keep_history:
+                self.history.append((self.started.copy(), *predicted, mean, covariance))
+        return levels, variances
+
+
+def rts_smooth(
+    values: np.ndarray,
+    model: str = KALMAN_MODEL,
+    q: np.ndarray | None = None,
+    r: np.ndarray | None = None,
+) -> tuple[np.ndarray, np.ndarray]:
+    """Kalman filter and Rauch-Tung-Striebel smoother over the ``(rows, series)`` ``values``.
+
+    Returns the smoothed level of every row and series and its variance. Every
+    estimate uses the whole series, so gaps are bridged from both sides and
+    their variance peaks in the middle of the gap. Rows before a series' first
+    observation take its first smoothed level, with the variance growing by
+    ``q`` per row back from there. Noise variances are fitted per series with
+    :func:`fit_noise` unless given.
+    """
+    if q is None or r is None:
+        fitted_q, fitted_r = fit_noise(values, model)
+        q = fitted_q if q is None else q
+        r = fitted_r if r is None else r
+    q = np.asarray(q, dtype=np.float64)
+    kalman = KalmanFilter(q, r, model, keep_history=True)
+    levels, variances = kalman.update(values)
+    if not len(values):
+        return levels, variances
+
+    transition = kalman.transition
+    states = len(transition)
+    *_, mean, covariance = kalman.history[-1]
+    for row in range(len(values) - 2, -1, -1):
+        started, _, _, filtered_mean, filtered_covariance = kalman.history[row]
+        _, predicted_mean, predicted_covariance, _, _ = kalman.history[row + 1]
+        # Series not started yet have no state to smooth; keep their inverse defined
+        predicted_covariance = np.where(
+            started[:, None, None], predicted_covariance, np.eye(states)
+        )
+        gain = filtered_covariance @ transition.T @ np.linalg.inv(predicted_covariance)
+        mean = filtered_mean + (gain @ (mean - predicted_mean)[:, :, None])[:, :, 0]
+        correction = gain @ (covariance - predicted_covariance) @ gain.transpose(0, 2, 1)
+        covariance = filtered_covariance + correction
+        levels[row] = np.where(started, mean[:, 0], np.nan)
+        variances[row] = np.where(started, covariance[:, 0, 0], np.nan)
+
+    first = np.argmax(~np.isnan(levels), axis=0)
+    for series in np.flatnonzero(kalman.started & (first > 0)):
+        lead = first[series]
+        levels[:lead, series] = levels[lead, series]
+        variances[:lead, series] = variances[lead, series] + q[series] * np.arange(lead, 0, -1)
+    return levels, variances
+
+
+def _stack(arrays: list[np.ndarray]) -> np.ndarray:
+    # Satellites have different lengths; the short ones are padded with NaN rows at
+    # the end, which only advance their prediction and are cut off afterwards
+    rows = max((len(array) for array in arrays), default=0)
+    stacked = np.full((rows, sum(array.shape[1] for array in arrays)), np.nan)
+    column = 0
+    for array in arrays:
+        stacked[: len(array), column : column + array.shape[1]] = array
+        column += array.shape[1]
+    return stacked
+
+
+def smooth_frames(
+    frames: dict[str, pd.DataFrame], model: str = KALMAN_MODEL, online: bool = False
+) -> dict[str, pd.DataFrame]:
+    """Smooth the error columns of several satellites' stage frames in one batch.
+
+    Every frame comes back in the ``*_smoothed.csv`` layout (time and the
+    coalesced error columns, gaps filled) followed by one variance column per
+    error column. ``online`` runs the forward filter only, whose estimates use
+    no later rows, as a live process would see them.
+    """
+    prepared = {}
+    for label, df in frames.items():
+        df = smooth_timeseries._coalesce_measurement_columns(df)
+        df["utc_time"] = ingestion.parse_times(df["utc_time"])
+        columns = list(ingestion.resolve_columns(df.columns).values())
+        prepared[label] = (df, columns)
+    values = _stack([df[columns].to_numpy(dtype="float64") for df, columns in prepared.values()])
+
+    if online:
+        levels, variances = KalmanFilter(*fit_noise(values, model), model).update(values)
+    else:
+        levels, variances = rts_smooth(values, model)
+
+    smoothed = {}
+    column = 0
+    for label, (df, columns) in prepared.items():
+        block = slice(column, column + len(columns))
+        column += len(columns)
+        out = df.copy()
+        out[columns] = levels[: len(df), block]
+        variance = pd.DataFrame(
+            variances[: len(df), block],
+            index=df.index,
+            columns=[VARIANCE_PREFIX + name for name in columns],
+        )
+        smoothed[label] = pd.concat([out, variance], axis=1)
+    return smoothed
+
+
+def process_frame(label: str, df: pd.DataFrame, model: str = KALMAN_MODEL) -> pd.DataFrame:
+    return smooth_frames({label: df}, model)[label]
+
+
+def process_datasets(labels: list[str], model: str = KALMAN_MODEL, online: bool = False) -> None:
+    """Smooth every satellite in ``labels`` in one batch and write their files."""
+    with instrumentation.stage("kalman", "+".join(labels)) as record:
+        frames = {label: ingestion.load(DATASETS[label][0]) for label in labels}
+        start = time.perf_counter()
+        smoothed = smooth_frames(frames, model, online)
+        seconds = time.perf_counter() - start
+        for label, df in smoothed.items():
+            output_path = storage.save(df, DATASETS[label][1])
+            columns = [column for column in df.columns if column.startswith(VARIANCE_PREFIX)]
+            print(f"--- {label} ---")
+            print(f"Model: {model} ({'forward filter' if online else 'RTS smoother'})")
+            print(f"NaNs before: {int(frames[label].isna().sum().sum())}")
+            print(f"NaNs after: {int(df.drop(columns=columns).isna().sum().sum())}")
+            for column in columns:
+                print(f"Median {column}: {df[column].median():.3g}")
+            print(f"Output saved to: {output_path}")
+            print()
+        # One file per satellite: the record keeps the last frame written, so set the totals
+        record.rows_out = sum(len(df) for df in smoothed.values())
+        record.nans_out = sum(int(df.isna().sum().sum()) for df in smoothed.values())
+        series = sum(len(ingestion.resolve_columns(df.columns)) for df in frames.values())
+        print(f"{series} series smoothed together in {seconds:.3f} s")
+
+
+@instrumentation.instrumented("kalman")
+def process_dataset(
+    label: str, input_path: Path, output_path: Path, model: str = KALMAN_MODEL
+) -> None:
+    """One satellite on its own, with the ``(label, input, output)`` signature of the stages."""
+    storage.save(process_frame(label, ingestion.load(input_path), model), output_path)
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(
+        description="Fill and smooth the outlier-free series with a Kalman filter and RTS smoother."
+    )
+    parser.add_argument("--model", choices=KALMAN_MODELS, default=KALMAN_MODEL)
+    parser.add_argument(
+        "--online",
+        action="store_true",
+        help="forward filter only: every estimate uses only the rows up to it, as in live use",
+    )
+    args = parser.parse_args()
+
+    labels = []
+    for label, (input_path, _) in DATASETS.items():
+        if not storage.resolve_path(input_path).exists():
+            print(f"Warning: Input file '{input_path}' not found. Skipping {label}...")
+            continue
+        labels.append(label)
+    process_datasets(labels, args.model, args.online)
+    instrumentation.print_summary()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,33 @@
+from __future__ import annotations
+
+import importlib.util
+import sys
+from types import ModuleType
+
+
+def lazy_module(name: str) -> ModuleType:
+    """Import ``name`` on first attribute access instead of now.
+
+    ``pd = lazy_module("pandas")`` at the top of a stage module costs nothing
+    until the stage actually touches ``pd``, so the CLI can list, plan and
+    dispatch stages without paying for pandas. A module that is already
+    imported is returned as is.
+    """
+    if name in sys.modules:
+        return sys.modules[name]
+    spec = importlib.util.find_spec(name)
+    if spec is None or spec.loader is None:
+        raise ModuleNotFoundError(f"No module named '{name}'", name=name)
+    loader = importlib.util.LazyLoader(spec.loader)
+    spec.loader = loader
+    module = importlib.util.module_from_spec(spec)
+    sys.modules[name] = module
+    loader.exec_module(module)
+    return module
+
+
+def is_loaded(name: str) -> bool:
+    """Whether ``name`` has been imported for real, not just registered lazily."""
+    # A lazy module turns back into a plain ModuleType once it has been executed
+    module = sys.modules.get(name)
+    return module is not None and type(module) is ModuleType
@@ -1,69 +1,343 @@
 from __future__ import annotations
 
+import argparse
+import glob
+import heapq
 from pathlib import Path
+from typing import Iterable, Iterator
 
-import pandas as pd
+import numpy as np
+
+import ingestion
+import instrumentation
+from lazy_imports import lazy_module
+
+pd = lazy_module("pandas")
+
+DATA_DIR = Path(__file__).resolve().parent
+SOURCE_FILES = [DATA_DIR / "DATA_MEO_Train.csv", DATA_DIR / "DATA_MEO_Train2.csv"]
+OUTPUT_PATH = DATA_DIR / "MEO_merged.csv"
+# Rows read from each source, and written to the output, at a time. Memory is
+# about (sources + 1) x CHUNK_ROWS rows however long the inputs are.
+CHUNK_ROWS = 65_536
+NAT = np.iinfo(np.int64).min
+
+
+class MergeStats:
+    """Counts reported by a merge, filled in while the sources stream through it."""
+
+    def __init__(self) -> None:
+        self.rows_in = 0
+        self.rows_out = 0
+        self.nans_out = 0
+        self.missing_utc = 0
+        self.empty_fields = 0
+        self.first_time: pd.Timestamp | None = None
+        self.last_time: pd.Timestamp | None = None
+
+    def print(self) -> None:
+        print(f"Rows after merge (before dedup): {self.rows_in}")
+        print(f"Rows after removing duplicate timestamps: {self.rows_out}")
+        print(f"Duplicates removed: {self.rows_in - self.rows_out}")
+        print(f"Rows missing utc_time: {self.missing_utc}")
+        print(f"Rows with empty string fields: {self.empty_fields}")
+        if self.first_time is not None:
+            print(
+                "Time range: "
+                f"{self.first_time.isoformat(sep=' ')} to {self.last_time.isoformat(sep=' ')}"
+            )
+        else:
+            print("Time range: unavailable (all utc_time values are missing)")
 
 
 def _count_empty_string_rows(df: pd.DataFrame) -> int:
-    def _is_empty(value: object) -> bool:
-        return isinstance(value, str) and value.strip() == ""
+    empty = np.zeros(len(df), dtype=bool)
+    for column in df.columns:
+        values = df[column]
+        if values.dtype != object:
+            continue
+        try:
+            # Non-string cells strip to NaN, which is never equal to ""
+            empty |= values.str.strip().eq("").to_numpy()
+        except AttributeError:
+            # No string cells at all (the .str accessor refuses such columns)
+            continue
+    return int(empty.sum())
 
-    return df.applymap(_is_empty).any(axis=1).sum()
 
+def _missing_utc(raw_utc: pd.Series) -> np.ndarray:
+    return (raw_utc.isna() | raw_utc.astype(str).str.strip().eq("")).to_numpy()
 
-def main() -> None:
-    data_dir = Path(__file__).resolve().parent
-    file1 = data_dir / "DATA_MEO_Train.csv"
-    file2 = data_dir / "DATA_MEO_Train2.csv"
 
-    df1 = pd.read_csv(file1)
-    df2 = pd.read_csv(file2)
+def expand_sources(patterns: Iterable[str | Path]) -> list[Path]:
+    """Files named by paths or glob patterns, in the order given, each listed once."""
+    paths: list[Path] = []
+    for pattern in patterns:
+        matches = sorted(glob.glob(str(pattern))) or (
+            [str(pattern)] if Path(pattern).exists() else []
+        )
+        if not matches:
+            raise FileNotFoundError(f"No input files match {pattern}")
+        paths += [Path(match) for match in matches if Path(match) not in paths]
+    return paths
 
-    print(f"Rows in {file1.name}: {len(df1)}")
-    print(f"Rows in {file2.name}: {len(df2)}")
 
-    combined = pd.concat([df1, df2], ignore_index=True)
+def _is_time_sorted(chunks: Iterable[pd.DataFrame]) -> bool:
+    last = NAT
+    time_format = None
+    for chunk in chunks:
+        if time_format is None:
+            time_format = ingestion.detect_time_format(chunk["utc_time"])
+        times = ingestion.parse_times(chunk["utc_time"], time_format).to_numpy("int64")
+        times = times[times != NAT]
+        if len(times) and (times[0] < last or (np.diff(times) < 0).any()):
+            return False
+        if len(times):
+            last = times[-1]
+    return True
 
-    raw_utc = combined["utc_time"]
-    missing_utc_mask = raw_utc.isna() | raw_utc.astype(str).str.strip().eq("")
-    missing_utc_count = int(missing_utc_mask.sum())
-    empty_field_count = int(_count_empty_string_rows(combined))
 
-    combined["utc_time"] = pd.to_datetime(raw_utc, errors="coerce")
-    combined.sort_values("utc_time", inplace=True)
+def _timed_chunks(
+    chunks: Iterable[pd.DataFrame], columns: list[str], stats: MergeStats, missing: dict, source: int
+) -> Iterator[tuple[np.ndarray, pd.DataFrame]]:
+    """Count, parse and widen the chunks of one source.
 
-    pre_dedup_rows = len(combined)
-    combined = combined.drop_duplicates(subset=["utc_time"], keep="first")
-    duplicates_removed = pre_dedup_rows - len(combined)
+    Rows without a time are taken out: like ``drop_duplicates`` after a sort,
+    only the first of them over all sources is kept, and it goes last.
+    """
+    time_format = None
+    for chunk in chunks:
+        missing_utc = _missing_utc(chunk["utc_time"])
+        stats.rows_in += len(chunk)
+        stats.missing_utc += int(missing_utc.sum())
+        stats.empty_fields += _count_empty_string_rows(chunk)
 
-    combined.reset_index(drop=True, inplace=True)
+        if time_format is None:
+            time_format = ingestion.detect_time_format(chunk["utc_time"])
+        chunk = chunk.reindex(columns=columns)
+        chunk["utc_time"] = ingestion.parse_times(chunk["utc_time"], time_format)
+        times = chunk["utc_time"].to_numpy("int64")
+        unparsed = times == NAT
+        if unparsed.any():
+            missing.setdefault(source, chunk[unparsed].iloc[:1])
+            chunk, times = chunk[~unparsed], times[~unparsed]
+        if len(chunk):
+            yield times, chunk
 
-    output_file = data_dir / "MEO_merged.csv"
-    combined.to_csv(output_file, index=False)
 
-    print(f"Rows after merge (before dedup): {pre_dedup_rows}")
-    print(f"Rows after removing duplicate timestamps: {len(combined)}")
-    print(f"Duplicates removed: {duplicates_removed}")
+def _sorted_source(
+    chunks: Iterable[pd.DataFrame], columns: list[str], stats: MergeStats, missing: dict, source: int
+) -> Iterator[tuple[np.ndarray, pd.DataFrame]]:
+    # Stable, so rows sharing a time keep their file order for the keep-first dedup
+    for times, chunk in _timed_chunks(chunks, columns, stats, missing, source):
+        order = np.argsort(times, kind="stable")
+        yield times[order], chunk.iloc[order]
 
-    if missing_utc_count:
-        print(f"Rows missing utc_time: {missing_utc_count}")
-    else:
-        print("Rows missing utc_time: 0")
 
-    if empty_field_count:
-        print(f"Rows with empty string fields: {empty_field_count}")
-    else:
-        print("Rows with empty string fields: 0")
+def merge_sorted(
+    sources: list[Iterator[tuple[np.ndarray, pd.DataFrame]]],
+    stats: MergeStats,
+    missing: dict[int, pd.DataFrame],
+    chunk_rows: int = CHUNK_ROWS,
+) -> Iterator[pd.DataFrame]:
+    """K-way merge of time-sorted sources, keeping the first row of every ``utc_time``.
 
-    valid_utc = combined["utc_time"].dropna()
-    if not valid_utc.empty:
-        print(
-            "Time range: "
-            f"{valid_utc.min().isoformat(sep=' ')} to {valid_utc.max().isoformat(sep=' ')}"
-        )
+    A heap holds the next time of each source. The source at its top hands over
+    every row that sorts before the runner-up's next row in one slice, so rows
+    move in blocks rather than one at a time, and only as row positions until a
+    whole output chunk is gathered. Ties go to the earlier source, so the row
+    kept for a duplicated time is the one a stable sort of the concatenated
+    inputs would put first.
+    """
+    # Per source: its current chunk's times, the chunk and the next row to hand over
+    heads: list[tuple[np.ndarray, pd.DataFrame, int] | None] = []
+    heap: list[tuple[int, int]] = []
+    for index, source in enumerate(sources):
+        head = next(source, None)
+        heads.append(None if head is None else (*head, 0))
+        if head is not None:
+            heap.append((int(head[0][0]), index))
+    heapq.heapify(heap)
+
+    last = NAT
+    buffered: list[tuple[pd.DataFrame, np.ndarray]] = []
+    buffered_rows = 0
+    while heap:
+        _, index = heapq.heappop(heap)
+        times, chunk, start = heads[index]
+        if heap:
+            bound, bound_index = heap[0]
+            side = "right" if index < bound_index else "left"
+            stop = start + int(np.searchsorted(times[start:], bound, side=side))
+        else:
+            stop = len(times)
+
+        block_times = times[start:stop]
+        keep = np.flatnonzero(block_times != np.concatenate(([last], block_times[:-1])))
+        last = block_times[-1]
+        if len(keep):
+            buffered.append((chunk, keep + start))
+            buffered_rows += len(keep)
+
+        if stop == len(times):
+            head = next(sources[index], None)
+            if head is None:
+                continue
+            times, chunk, stop = *head, 0
+        heads[index] = (times, chunk, stop)
+        heapq.heappush(heap, (int(times[stop]), index))
+
+        if buffered_rows >= chunk_rows:
+            yield _gather(buffered, stats)
+            buffered, buffered_rows = [], 0
+    if missing:
+        row = missing[min(missing)]
+        buffered.append((row, np.zeros(1, dtype=np.intp)))
+    if buffered:
+        yield _gather(buffered, stats)
+
+
+def _gather(buffered: list[tuple[pd.DataFrame, np.ndarray]], stats: MergeStats) -> pd.DataFrame:
+    # One concat of the chunks involved and one take, however many blocks there are
+    frames: list[pd.DataFrame] = []
+    offsets: dict[int, int] = {}
+    total = 0
+    for chunk, _ in buffered:
+        if id(chunk) not in offsets:
+            offsets[id(chunk)] = total
+            frames.append(chunk)
+            total += len(chunk)
+    positions = np.concatenate([rows + offsets[id(chunk)] for chunk, rows in buffered])
+    df = pd.concat(frames).iloc[positions]
+    stats.rows_out += len(df)
+    stats.nans_out += int(df.isna().sum().sum())
+    valid = df["utc_time"].dropna()
+    if not valid.empty:
+        if stats.first_time is None:
+            stats.first_time = valid.iloc[0]
+        stats.last_time = valid.iloc[-1]
+    return df
+
+
+def _union_columns(headers: Iterable[Iterable[str]]) -> list[str]:
+    # The column order pd.concat gives the same frames
+    columns: list[str] = []
+    for header in headers:
+        columns += [column for column in header if column not in columns]
+    return columns
+
+
+def merge_frames(frames: list[pd.DataFrame]) -> pd.DataFrame:
+    """Merge frames already in memory, with the same dedup and counts as :func:`merge_files`."""
+    columns = _union_columns(frame.columns for frame in frames)
+    stats = MergeStats()
+    missing: dict[int, pd.DataFrame] = {}
+    sources = [
+        _sorted_source([frame], columns, stats, missing, index) for index, frame in enumerate(frames)
+    ]
+    rows = sum(len(frame) for frame in frames)
+    merged = list(merge_sorted(sources, stats, missing, chunk_rows=max(rows, 1)))
+    stats.print()
+    if not merged:
+        return pd.DataFrame(columns=columns)
+    return pd.concat(merged).reset_index(drop=True)
+
+
+def read_sources(paths: list[Path]) -> list[pd.DataFrame]:
+    frames = []
+    for path in paths:
+        frame = ingestion.read_raw(path)
+        instrumentation.record_read(frame, path)
+        print(f"Rows in {path.name}: {len(frame)}")
+        frames.append(frame)
+    return frames
+
+
+def _csv_chunks(path: Path, chunk_rows: int) -> Iterator[pd.DataFrame]:
+    chunks = pd.read_csv(path, chunksize=chunk_rows, dtype=ingestion.raw_dtypes(path))
+    for index, chunk in enumerate(chunks):
+        instrumentation.record_read(chunk, path if index == 0 else None)
+        yield chunk
+
+
+def _file_source(
+    path: Path, columns: list[str], stats: MergeStats, missing: dict, source: int, chunk_rows: int
+) -> Iterator[tuple[np.ndarray, pd.DataFrame]]:
+    # Checking the order reads only the time column
+    if _is_time_sorted(pd.read_csv(path, usecols=["utc_time"], chunksize=chunk_rows)):
+        return _timed_chunks(_csv_chunks(path, chunk_rows), columns, stats, missing, source)
+    # A file out of time order is sorted whole, so it alone costs memory in proportion to its rows
+    print(f"{path.name} is not in time order; sorting it in memory")
+    chunks = [ingestion.read_raw(path)]
+    instrumentation.record_read(chunks[0], path)
+    return _sorted_source(chunks, columns, stats, missing, source)
+
+
+def merge_files(
+    label: str, paths: list[Path], output_path: Path, chunk_rows: int = CHUNK_ROWS
+) -> MergeStats:
+    """Merge raw CSV files into one time-ordered file, streaming ``chunk_rows`` at a time."""
+    with instrumentation.stage("merge", label) as record:
+        stats = _merge_files(label, [Path(path) for path in paths], output_path, chunk_rows)
+        # The output never exists as one frame, so record its totals directly
+        record.rows_out, record.nans_out = stats.rows_out, stats.nans_out
+        record.bytes_written += instrumentation.path_bytes(output_path)
+    return stats
+
+
+def _merge_files(label: str, paths: list[Path], output_path: Path, chunk_rows: int) -> MergeStats:
+    headers = [pd.read_csv(path, nrows=0).columns for path in paths]
+    columns = _union_columns(headers)
+    stats = MergeStats()
+    missing: dict[int, pd.DataFrame] = {}
+    print(f"Input files: {len(paths)}")
+    sources = [
+        _file_source(path, columns, stats, missing, index, chunk_rows)
+        for index, path in enumerate(paths)
+    ]
+
+    output_path.parent.mkdir(parents=True, exist_ok=True)
+    pd.DataFrame(columns=columns).to_csv(output_path, index=False)
+    for chunk in merge_sorted(sources, stats, missing, chunk_rows):
+        chunk.to_csv(output_path, mode="a", header=False, index=False)
+
+    print(f"--- {label} ---")
+    stats.print()
+    print(f"Output saved to: {output_path}")
+    print()
+    return stats
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description="Merge the raw files of one satellite.")
+    parser.add_argument(
+        "sources",
+        nargs="*",
+        help="raw CSV files or glob patterns, e.g. 'daily/DATA_MEO_*.csv' (default: the MEO files)",
+    )
+    parser.add_argument(
+        "--manifest",
+        type=Path,
+        help="CSV with satellite,path columns; merges the files listed for --label",
+    )
+    parser.add_argument("--label", default="MEO")
+    parser.add_argument("--output", type=Path, default=OUTPUT_PATH)
+    parser.add_argument("--chunk-rows", type=int, default=CHUNK_ROWS)
+    args = parser.parse_args()
+
+    if args.manifest is not None:
+        # Imported here: run_pipeline imports this module
+        from run_pipeline import load_manifest
+
+        paths = load_manifest(args.manifest).get(args.label, [])
+        if not paths:
+            raise SystemExit(f"No files for {args.label} in {args.manifest}")
+    elif args.sources:
+        paths = expand_sources(args.sources)
     else:
-        print("Time range: unavailable (all utc_time values are missing)")
+        paths = SOURCE_FILES
+    merge_files(args.label, paths, args.output, args.chunk_rows)
+    instrumentation.print_summary()
 
 
 if __name__ == "__main__":
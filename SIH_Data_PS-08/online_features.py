@@ -0,0 +1,352 @@
+from __future__ import annotations
+
+import contextlib
+import math
+import os
+from collections import deque
+from pathlib import Path
+
+import numpy as np
+
+import add_ewm_features
+import add_interaction_features
+import add_lag_features
+import add_rolling_features
+import add_time_features
+import gap_index
+import ingestion
+import resample_satellites
+from lazy_imports import lazy_module
+
+pd = lazy_module("pandas")
+
+INPUT_DIR = Path(__file__).resolve().parent / "15min_resampled"
+DATASETS = {
+    "MEO": INPUT_DIR / "MEO_smoothed.csv",
+    "GEO": INPUT_DIR / "GEO_smoothed.csv",
+}
+DEFAULT_BASE_COLUMNS = ("x_error (m)", "y_error (m)", "z_error (m)", "satclockerror (m)")
+SHORT_NAMES = [short_name for _, short_name in add_rolling_features.VARIABLE_PATTERNS]
+PARITY_TOLERANCE = 1e-9
+# Gap limit of the masked parity check: every gap run longer than this is masked
+PARITY_MAX_GAP_ROWS = 2
+
+
+class _RollingWindow:
+    """Trailing window of one channel: shifted running sums and monotonic min/max deques.
+
+    The sums are kept relative to a reference value that is reset to the window
+    mean every ``window`` updates, when they are also rebuilt from the window
+    contents. That bounds the cancellation of the add/remove updates while
+    keeping the cost amortised O(1) per sample.
+    """
+
+    def __init__(self, window: int) -> None:
+        self.window = window
+        self.values: deque[float] = deque()
+        self.reference = 0.0
+        self.count = 0
+        self.shifted_sum = 0.0
+        self.shifted_sum_sq = 0.0
+        self.nan_count = 0
+        self.min_queue: deque[tuple[int, float]] = deque()
+        self.max_queue: deque[tuple[int, float]] = deque()
+        self.updates = 0
+
+    def _resync(self) -> None:
+        valid = [value for value in self.values if value == value]
+        self.count = len(valid)
+        self.reference = math.fsum(valid) / self.count if valid else 0.0
+        self.shifted_sum = math.fsum(value - self.reference for value in valid)
+        self.shifted_sum_sq = math.fsum((value - self.reference) ** 2 for value in valid)
+
+    def update(self, position: int, value: float) -> tuple[float, float, float, float]:
+        self.values.append(value)
+        if value == value:
+            self.count += 1
+            self.shifted_sum += value - self.reference
+            self.shifted_sum_sq += (value - self.reference) ** 2
+            while self.min_queue and self.min_queue[-1][1] >= value:
+                self.min_queue.pop()
+            self.min_queue.append((position, value))
+            while self.max_queue and self.max_queue[-1][1] <= value:
+                self.max_queue.pop()
+            self.max_queue.append((position, value))
+        else:
+            self.nan_count += 1
+
+        if len(self.values) > self.window:
+            leaving = self.values.popleft()
+            if leaving == leaving:
+                self.count -= 1
+                self.shifted_sum -= leaving - self.reference
+                self.shifted_sum_sq -= (leaving - self.reference) ** 2
+            else:
+                self.nan_count -= 1
+        oldest = position - self.window + 1
+        while self.min_queue and self.min_queue[0][0] < oldest:
+            self.min_queue.popleft()
+        while self.max_queue and self.max_queue[0][0] < oldest:
+            self.max_queue.popleft()
+
+        self.updates += 1
+        if self.updates % self.window == 0:
+            self._resync()
+
+        # Same rule as rolling(window, min_periods=window): a full window without NaNs
+        if len(self.values) < self.window or self.nan_count:
+            return math.nan, math.nan, math.nan, math.nan
+        lowest = self.min_queue[0][1]
+        highest = self.max_queue[0][1]
+        if self.window == 1:
+            return value, math.nan, lowest, highest
+        if lowest == highest:
+            # A constant window: report the exact answer instead of rounding residue
+            return lowest, 0.0, lowest, highest
+
+        mean = self.reference + self.shifted_sum / self.window
+        squared = self.shifted_sum_sq - self.shifted_sum * self.shifted_sum / self.window
+        std = math.sqrt(max(squared, 0.0) / (self.window - 1))
+        return mean, std, lowest, highest
+
+
+class OnlineFeatureEngine:
+    """Produce one row of the batch feature matrix per 15-minute sample.
+
+    ``update`` takes the values the batch feature stages would see (the smoothed
+    errors) and returns the row ``add_interaction_features`` writes for that
+    timestamp, with the same column names and order. Memory is bounded by the
+    longest lag: a ring buffer of the last ``max(LAG_STEPS)`` samples, one
+    sliding window per rolling length and a few floats per EWM span. Lags, EWM
+    and interaction values match the batch stages exactly; rolling mean/std come
+    from running sums and agree to within ``PARITY_TOLERANCE``.
+
+    With a gap limit (``max_gap_rows`` or ``$SIH_MAX_GAP_ROWS``), lags taken
+    from a row of a longer gap and rolling windows holding one are NaN, as in
+    the batch lag and rolling stages. Whether a missing row belongs to a long
+    gap is only known once the gap ends, so a limit needs the resampler's
+    ``gaps`` index.
+    """
+
+    def __init__(
+        self,
+        base_columns: tuple[str, str, str, str] = DEFAULT_BASE_COLUMNS,
+        harmonics: list[tuple[str, float, int]] | None = None,
+        gaps: gap_index.GapIndex | None = None,
+        max_gap_rows: int | None = None,
+    ) -> None:
+        self.base_columns = list(base_columns)
+        self.harmonics = add_time_features.DEFAULT_HARMONICS if harmonics is None else harmonics
+        self.harmonic_columns = add_time_features.harmonic_columns(self.harmonics)
+        # One slot more than the longest lag so the current sample never overwrites it
+        self.history_size = (
+            max(max(add_lag_features.LAG_STEPS), max(add_rolling_features.ROLLING_WINDOWS)) + 1
+        )
+        self.history = np.full((len(SHORT_NAMES), self.history_size), np.nan)
+        self.position = -1
+        self.windows = [
+            {window: _RollingWindow(window) for window in add_rolling_features.ROLLING_WINDOWS}
+            for _ in SHORT_NAMES
+        ]
+        self.ewm_states = [
+            {span: add_ewm_features._initial_ewm_state() for span in add_ewm_features.EWM_SPANS}
+            for _ in SHORT_NAMES
+        ]
+        self.columns = self._build_columns()
+
+        limit = gap_index.max_gap_rows(max_gap_rows)
+        if limit is not None and gaps is None:
+            raise ValueError(
+                f"A gap limit of {limit} rows needs the gap index of the resampled series"
+            )
+        self.long_gaps = gaps.longer_than(limit) if gaps is not None else None
+        if self.long_gaps is not None and not len(self.long_gaps):
+            self.long_gaps = None
+        self.in_gap = np.zeros(self.history_size, dtype=bool)
+        self.last_gap_position = -self.history_size
+
+    def _build_columns(self) -> list[str]:
+        columns = [
+            "utc_time",
+            *self.base_columns,
+            *add_time_features.NEW_FEATURES,
+            *self.harmonic_columns,
+        ]
+        for short_name in add_lag_features.LAG_COLUMN_NAMES:
+            columns.extend(f"{short_name}_lag_{step}" for step in add_lag_features.LAG_STEPS)
+        for short_name in SHORT_NAMES:
+            for window in add_rolling_features.ROLLING_WINDOWS:
+                columns.extend(
+                    f"{short_name}_roll_{stat}_{window}"
+                    for stat in ("mean", "std", "min", "max", "slope")
+                )
+        for short_name in SHORT_NAMES:
+            for span in add_ewm_features.EWM_SPANS:
+                columns.extend([f"{short_name}_ewm_mean_{span}", f"{short_name}_ewm_std_{span}"])
+        columns.extend(add_interaction_features.INTERACTION_COLUMNS)
+        return columns
+
+    def _lagged(self, channel: int, steps: int) -> float:
+        if steps > self.position:
+            return math.nan
+        return float(self.history[channel, (self.position - steps) % self.history_size])
+
+    def _lag_in_gap(self, steps: int) -> bool:
+        return steps <= self.position and bool(
+            self.in_gap[(self.position - steps) % self.history_size]
+        )
+
+    def update(
+        self, timestamp: pd.Timestamp, x: float, y: float, z: float, clock: float
+    ) -> dict[str, object]:
+        """Consume the next 15-minute sample and return its feature row."""
+        timestamp = pd.Timestamp(timestamp)
+        values = [float(x), float(y), float(z), float(clock)]
+        self.position += 1
+
+        row: dict[str, object] = {"utc_time": timestamp}
+        row.update(zip(self.base_columns, values))
+
+        hour = timestamp.hour
+        doy = timestamp.dayofyear
+        row["hour"] = hour
+        row["minute"] = timestamp.minute
+        row["dow"] = timestamp.weekday()
+        row["doy"] = doy
+        row["hour_sin"] = math.sin(2 * math.pi * hour / 24)
+        row["hour_cos"] = math.cos(2 * math.pi * hour / 24)
+        row["doy_sin"] = math.sin(2 * math.pi * doy / 365)
+        row["doy_cos"] = math.cos(2 * math.pi * doy / 365)
+        harmonics = add_time_features.harmonic_features(np.array([timestamp.value]), self.harmonics)
+        row.update(zip(self.harmonic_columns, harmonics[0].tolist()))
+
+        self.history[:, self.position % self.history_size] = values
+        in_gap = self.long_gaps is not None and bool(
+            self.long_gaps.row_mask(np.array([timestamp.value]))[0]
+        )
+        self.in_gap[self.position % self.history_size] = in_gap
+        if in_gap:
+            self.last_gap_position = self.position
+        for channel, short_name in enumerate(add_lag_features.LAG_COLUMN_NAMES):
+            for step in add_lag_features.LAG_STEPS:
+                lagged = math.nan if self._lag_in_gap(step) else self._lagged(channel, step)
+                row[f"{short_name}_lag_{step}"] = lagged
+
+        for channel, short_name in enumerate(SHORT_NAMES):
+            value = values[channel]
+            for window, rolling in self.windows[channel].items():
+                mean, std, lowest, highest = rolling.update(self.position, value)
+                row[f"{short_name}_roll_mean_{window}"] = mean
+                row[f"{short_name}_roll_std_{window}"] = std
+                row[f"{short_name}_roll_min_{window}"] = lowest
+                row[f"{short_name}_roll_max_{window}"] = highest
+                row[f"{short_name}_roll_slope_{window}"] = (
+                    value - self._lagged(channel, window - 1)
+                ) / window
+                if self.last_gap_position > self.position - window:
+                    for stat in ("mean", "std", "min", "max", "slope"):
+                        row[f"{short_name}_roll_{stat}_{window}"] = math.nan
+
+        for channel, short_name in enumerate(SHORT_NAMES):
+            for span, state in self.ewm_states[channel].items():
+                mean, std = add_ewm_features._ewm_step(state, values[channel], span)
+                row[f"{short_name}_ewm_mean_{span}"] = mean
+                row[f"{short_name}_ewm_std_{span}"] = std
+
+        x, y, z, clock = values
+        eps = add_interaction_features.EPS
+        # x * x rather than x**2: numpy squares exactly, libm pow() can be an ulp off
+        pos_err_norm = math.sqrt(x * x + y * y + z * z)
+        row["pos_err_norm"] = pos_err_norm
+        row["xy_ratio"] = x / (y + eps)
+        row["xz_ratio"] = x / (z + eps)
+        row["yz_ratio"] = y / (z + eps)
+        row["clock_pos_ratio"] = clock / (pos_err_norm + eps)
+
+        return {column: row[column] for column in self.columns}
+
+
+def _batch_features(
+    df: pd.DataFrame,
+    harmonics: list[tuple[str, float, int]] | None = None,
+    gaps: gap_index.GapIndex | None = None,
+) -> pd.DataFrame:
+    df = df.set_index("utc_time")
+    df = add_time_features.add_time_features(df, harmonics)
+    df, _ = add_lag_features.add_lag_features(df, gaps)
+    df, _ = add_rolling_features.add_rolling_features(df, gaps)
+    df, _ = add_ewm_features.add_ewm_features(df)
+    return add_interaction_features.add_interaction_features(df).reset_index()
+
+
+@contextlib.contextmanager
+def _gap_limit(max_gap_rows: int | None):
+    # The batch stages read the limit from the environment
+    previous = os.environ.get(gap_index.MAX_GAP_ENV)
+    os.environ[gap_index.MAX_GAP_ENV] = "" if max_gap_rows is None else str(max_gap_rows)
+    try:
+        yield
+    finally:
+        if previous is None:
+            del os.environ[gap_index.MAX_GAP_ENV]
+        else:
+            os.environ[gap_index.MAX_GAP_ENV] = previous
+
+
+def check_parity(
+    label: str,
+    input_path: Path,
+    gaps: gap_index.GapIndex | None = None,
+    max_gap_rows: int | None = None,
+) -> bool:
+    """Replay a smoothed series through the engine and compare it with the batch stages.
+
+    With ``gaps`` and ``max_gap_rows`` both sides mask the longer gaps.
+    """
+    df = ingestion.load(input_path)
+    df = df.sort_values("utc_time").reset_index(drop=True)
+    harmonics = add_time_features.harmonics_for(label)
+    with _gap_limit(max_gap_rows):
+        batch = _batch_features(df, harmonics, gaps)
+    engine = OnlineFeatureEngine(tuple(batch.columns[1:5]), harmonics, gaps, max_gap_rows)
+    online = pd.DataFrame(
+        [engine.update(*row) for row in df[["utc_time", *engine.base_columns]].itertuples(index=False)],
+        columns=engine.columns,
+    )
+
+    same_layout = list(online.columns) == list(batch.columns)
+    numeric = batch.columns.drop("utc_time")
+    online_values = online[numeric].to_numpy(dtype="float64")
+    batch_values = batch[numeric].to_numpy(dtype="float64")
+    same_nans = bool((np.isnan(online_values) == np.isnan(batch_values)).all())
+    with np.errstate(invalid="ignore"):
+        deviation = np.nanmax(np.abs(online_values - batch_values), axis=0, initial=0.0)
+    worst = int(np.argmax(deviation))
+    passed = same_layout and same_nans and deviation[worst] <= PARITY_TOLERANCE
+
+    limit_text = "none" if max_gap_rows is None else f"{max_gap_rows} rows"
+    print(f"--- {label} (gap limit: {limit_text}) ---")
+    print(f"Rows replayed: {len(online)}")
+    print(f"Column names and order match batch output: {same_layout}")
+    print(f"NaN positions match batch output: {same_nans}")
+    print(f"Max abs deviation: {deviation[worst]:.3e} ({numeric[worst]})")
+    print(f"Parity {'PASSED' if passed else 'FAILED'} (tolerance {PARITY_TOLERANCE:g})")
+    print()
+    return passed
+
+
+def main() -> None:
+    results = []
+    for label, input_path in DATASETS.items():
+        results.append(check_parity(label, input_path))
+        gaps = gap_index.load(resample_satellites.GAP_INDEXES[label])
+        if gaps is None:
+            print(f"Warning: No gap index for {label}. Skipping the masked check...\n")
+            continue
+        results.append(check_parity(label, input_path, gaps, PARITY_MAX_GAP_ROWS))
+    if not all(results):
+        raise SystemExit(1)
+
+
+if __name__ == "__main__":
+    main()
@@ -1,11 +1,34 @@
 from __future__ import annotations
 
+import argparse
 from pathlib import Path
 
-import pandas as pd
+import numpy as np
+
+import gap_index
+import ingestion
+import instrumentation
+import storage
+from lazy_imports import lazy_module
+
+pd = lazy_module("pandas")
 
 
 OUTPUT_DIR_NAME = "15min_resampled"
+DATA_DIR = Path(__file__).resolve().parent
+OUTPUT_DIR = DATA_DIR / OUTPUT_DIR_NAME
+RESAMPLE_RULE = "15T"
+# Raw rows per chunk for --chunk-rows runs; memory is this plus one accumulator row per bin
+CHUNK_ROWS = 1_000_000
+DAY_NANOS = 24 * 3600 * 10**9
+DATASETS = {
+    "MEO": (DATA_DIR / "MEO_merged.csv", OUTPUT_DIR / "MEO_15min_raw.csv"),
+    "GEO": (DATA_DIR / "DATA_GEO_Train.csv", OUTPUT_DIR / "GEO_15min_raw.csv"),
+}
+# Run-length index of the empty slots, written next to each resampled file
+GAP_INDEXES = {
+    label: gap_index.sidecar_path(output_path) for label, (_, output_path) in DATASETS.items()
+}
 
 
 def log_dataset_stats(
@@ -16,7 +39,7 @@ def log_dataset_stats(
     original_last: pd.Timestamp | None,
     resampled_first: pd.Timestamp | None,
     resampled_last: pd.Timestamp | None,
-    nan_rows: int,
+    gaps: gap_index.GapIndex,
 ) -> None:
     print(f"--- {name} ---")
     print(f"Original rows: {original_rows}")
@@ -38,29 +61,30 @@ def log_dataset_stats(
     else:
         print("Resampled time range: unavailable (no valid timestamps)")
 
-    print(f"Rows with NaNs from empty 15-min slots: {nan_rows}")
+    print(f"Rows with NaNs from empty 15-min slots: {gaps.empty_rows}")
+    longest = int(gaps.lengths.max()) if len(gaps) else 0
+    print(f"Gap runs: {len(gaps)}, longest {longest} slots")
     print()
 
 
-def process_dataset(dataset_path: Path, output_path: Path, label: str) -> None:
-    df = pd.read_csv(dataset_path)
+def resample_frame(label: str, df: pd.DataFrame) -> tuple[pd.DataFrame, gap_index.GapIndex]:
+    """Resampled frame and the gap index of its empty slots."""
     original_rows = len(df)
 
-    utc = pd.to_datetime(df["utc_time"], errors="coerce")
+    utc = ingestion.parse_times(df["utc_time"])
     original_first = utc.min() if not utc.isna().all() else None
     original_last = utc.max() if not utc.isna().all() else None
 
-    df["utc_time"] = utc
-    df = df.set_index("utc_time")
+    df = df.assign(utc_time=utc).set_index("utc_time")
 
-    resampled = df.resample("15T").mean()
-    nan_rows = int(resampled.isna().all(axis=1).sum())
+    resampled = df.resample(RESAMPLE_RULE).mean()
+    empty = resampled.isna().to_numpy().all(axis=1)
+    gaps = gap_index.GapIndex.from_empty(resampled.index, empty, _bin_nanos(RESAMPLE_RULE))
 
     resampled_first = resampled.index.min() if not resampled.empty else None
     resampled_last = resampled.index.max() if not resampled.empty else None
 
     resampled_reset = resampled.reset_index()
-    resampled_reset.to_csv(output_path, index=False)
 
     log_dataset_stats(
         label,
@@ -70,26 +94,236 @@ def process_dataset(dataset_path: Path, output_path: Path, label: str) -> None:
         original_last,
         resampled_first,
         resampled_last,
-        nan_rows,
+        gaps,
     )
+    return resampled_reset, gaps
 
 
-def main() -> None:
-    data_dir = Path(__file__).resolve().parent
-    output_dir = data_dir / OUTPUT_DIR_NAME
-    output_dir.mkdir(exist_ok=True)
-
-    process_dataset(
-        data_dir / "MEO_merged.csv",
-        output_dir / "MEO_15min_raw.csv",
-        "MEO",
+def process_frame(label: str, df: pd.DataFrame) -> pd.DataFrame:
+    return resample_frame(label, df)[0]
+
+
+def save_resampled(resampled: pd.DataFrame, gaps: gap_index.GapIndex, output_path: Path) -> None:
+    storage.save(resampled, output_path)
+    gaps.save(gap_index.sidecar_path(output_path))
+
+
+@instrumentation.instrumented("resample")
+def process_dataset(dataset_path: Path, output_path: Path, label: str) -> None:
+    df = ingestion.read_raw(dataset_path)
+    instrumentation.record_read(df, dataset_path)
+    save_resampled(*resample_frame(label, df), output_path)
+
+
+def _bin_nanos(rule: str) -> int:
+    # resample() starts its bins at midnight of the first day; for rules that
+    # divide a day those edges are simply multiples of the rule since the epoch.
+    nanos = pd.tseries.frequencies.to_offset(rule).nanos
+    if DAY_NANOS % nanos:
+        raise ValueError(f"Chunked resampling needs a rule that divides a day, got {rule!r}")
+    return nanos
+
+
+class _BinAccumulator:
+    """Per-bin Kahan sums that reproduce ``resample(rule).mean()`` bit for bit.
+
+    pandas sorts the rows by time (stably) and adds the values of each bin in
+    that order with Kahan compensation. Chunks can be folded in one after the
+    other as long as every bin receives its rows in time order. A bin that is
+    handed a row older than one it already holds is marked dirty and rebuilt
+    from its raw rows after the last chunk.
+    """
+
+    def __init__(self, columns: int, bin_nanos: int) -> None:
+        self.bin_nanos = bin_nanos
+        self.first_bin: int | None = None
+        self.sums = np.zeros((0, columns))
+        self.compensation = np.zeros((0, columns))
+        self.counts = np.zeros((0, columns), dtype=np.int64)
+        self.last_time = np.zeros(0, dtype=np.int64)
+        self.dirty = np.zeros(0, dtype=bool)
+
+    def _cover(self, low: int, high: int) -> None:
+        if self.first_bin is None:
+            self.first_bin = low
+        before = max(self.first_bin - low, 0)
+        after = max(high - (self.first_bin + len(self.dirty) - 1), 0)
+        if before or after:
+            self.sums = np.pad(self.sums, ((before, after), (0, 0)))
+            self.compensation = np.pad(self.compensation, ((before, after), (0, 0)))
+            self.counts = np.pad(self.counts, ((before, after), (0, 0)))
+            self.last_time = np.pad(
+                self.last_time, (before, after), constant_values=np.iinfo(np.int64).min
+            )
+            self.dirty = np.pad(self.dirty, (before, after))
+            self.first_bin -= before
+
+    def _fold(self, index: np.ndarray, values: np.ndarray) -> None:
+        # ``index`` is grouped by bin with each bin's rows in summation order.
+        # Bins are independent, so pass k adds the k-th row of every bin at once.
+        starts = np.flatnonzero(np.r_[True, index[1:] != index[:-1]])
+        sizes = np.diff(np.r_[starts, len(index)])
+        for step in range(int(sizes.max())):
+            rows = starts[sizes > step] + step
+            target = index[rows]
+            value = values[rows]
+            present = ~np.isnan(value)
+            current = self.sums[target]
+            adjusted = value - self.compensation[target]
+            total = current + adjusted
+            with np.errstate(invalid="ignore"):
+                compensation = (total - current) - adjusted
+            # An infinite value leaves a NaN compensation; pandas resets it to 0
+            compensation[np.isnan(compensation)] = 0.0
+            self.sums[target] = np.where(present, total, current)
+            self.compensation[target] = np.where(present, compensation, self.compensation[target])
+            self.counts[target] += present
+
+    def add(self, times: np.ndarray, values: np.ndarray) -> None:
+        """Fold in one chunk of rows (valid ``int64`` nanosecond times only)."""
+        if not len(times):
+            return
+        bins = times // self.bin_nanos
+        self._cover(int(bins.min()), int(bins.max()))
+        index = bins - self.first_bin
+        order = np.argsort(index, kind="stable")
+        index, times, values = index[order], times[order], values[order]
+
+        same_bin = index[1:] == index[:-1]
+        self.dirty[index[1:][same_bin & (times[1:] < times[:-1])]] = True
+        first_rows = np.r_[True, ~same_bin]
+        older = times[first_rows] < self.last_time[index[first_rows]]
+        self.dirty[index[first_rows][older]] = True
+        last_rows = np.r_[~same_bin, True]
+        self.last_time[index[last_rows]] = np.maximum(
+            self.last_time[index[last_rows]], times[last_rows]
+        )
+        self._fold(index, values)
+
+    def dirty_bins(self) -> np.ndarray:
+        return np.flatnonzero(self.dirty) + (self.first_bin or 0)
+
+    def rebuild(self, times: np.ndarray, values: np.ndarray) -> None:
+        """Recompute the dirty bins from all of their rows, in file order."""
+        index = times // self.bin_nanos - self.first_bin
+        for array in (self.sums, self.compensation, self.counts):
+            array[np.unique(index)] = 0
+        # Stable sort by time, then by bin: pandas' order within every bin
+        order = np.argsort(times, kind="stable")
+        order = order[np.argsort(index[order], kind="stable")]
+        self._fold(index[order], values[order])
+        self.dirty[:] = False
+
+    def means(self) -> np.ndarray:
+        with np.errstate(invalid="ignore", divide="ignore"):
+            return np.where(self.counts > 0, self.sums / self.counts, np.nan)
+
+
+def _chunk_arrays(
+    chunk: pd.DataFrame, value_columns: list[str], time_format: str | None
+) -> tuple[np.ndarray, np.ndarray]:
+    utc = ingestion.parse_times(chunk["utc_time"], time_format)
+    valid = utc.notna().to_numpy()
+    times = utc.to_numpy(dtype="datetime64[ns]").view(np.int64)[valid]
+    return times, chunk[value_columns].to_numpy(dtype="float64")[valid]
+
+
+def resample_chunked(
+    dataset_path: Path, label: str, chunk_rows: int = CHUNK_ROWS, rule: str = RESAMPLE_RULE
+) -> tuple[pd.DataFrame, gap_index.GapIndex]:
+    """``resample_frame`` for a raw CSV too large to load: reads ``chunk_rows`` rows at a time.
+
+    Gives the same frame and gaps as ``resample_frame(label, pd.read_csv(dataset_path))``,
+    including the all-NaN rows of empty slots and the logged stats. Memory is one
+    chunk plus one accumulator row per output bin; only rows of bins that
+    received out-of-order timestamps are read a second time.
+    """
+    bin_nanos = _bin_nanos(rule)
+    original_rows = 0
+    time_format = None
+    dtype = ingestion.raw_dtypes(dataset_path)
+    value_columns: list[str] = []
+    accumulator = None
+    first_time = last_time = None
+
+    for chunk in pd.read_csv(dataset_path, chunksize=chunk_rows, dtype=dtype):
+        instrumentation.record_read(chunk, dataset_path if accumulator is None else None)
+        if accumulator is None:
+            value_columns = [column for column in chunk.columns if column != "utc_time"]
+            accumulator = _BinAccumulator(len(value_columns), bin_nanos)
+        if time_format is None:
+            time_format = ingestion.detect_time_format(chunk["utc_time"])
+        original_rows += len(chunk)
+
+        times, values = _chunk_arrays(chunk, value_columns, time_format)
+        if len(times):
+            low, high = times.min(), times.max()
+            first_time = low if first_time is None else min(first_time, low)
+            last_time = high if last_time is None else max(last_time, high)
+        accumulator.add(times, values)
+
+    if accumulator is not None and accumulator.dirty.any():
+        dirty = accumulator.dirty_bins()
+        rows = []
+        for chunk in pd.read_csv(dataset_path, chunksize=chunk_rows, dtype=dtype):
+            times, values = _chunk_arrays(chunk, value_columns, time_format)
+            keep = np.isin(times // bin_nanos, dirty)
+            rows.append((times[keep], values[keep]))
+        accumulator.rebuild(
+            np.concatenate([times for times, _ in rows]),
+            np.concatenate([values for _, values in rows]),
+        )
+        print(f"Bins with out-of-order rows recomputed: {len(dirty)}")
+
+    if accumulator is None or accumulator.first_bin is None:
+        resampled = pd.DataFrame(columns=["utc_time", *value_columns])
+        bins_index = pd.DatetimeIndex([], name="utc_time")
+        gaps = gap_index.GapIndex.from_empty(bins_index, np.zeros(0, dtype=bool), bin_nanos)
+    else:
+        bins = accumulator.first_bin + np.arange(len(accumulator.dirty), dtype=np.int64)
+        bins_index = pd.DatetimeIndex(bins * bin_nanos, name="utc_time")
+        resampled = pd.DataFrame(accumulator.means(), columns=value_columns)
+        resampled.insert(0, "utc_time", bins_index)
+        # A slot is empty when no raw row had a value in any column
+        empty = (accumulator.counts == 0).all(axis=1)
+        gaps = gap_index.GapIndex.from_empty(bins_index, empty, bin_nanos)
+
+    log_dataset_stats(
+        label,
+        original_rows,
+        len(resampled),
+        pd.Timestamp(first_time) if first_time is not None else None,
+        pd.Timestamp(last_time) if last_time is not None else None,
+        bins_index.min() if len(bins_index) else None,
+        bins_index.max() if len(bins_index) else None,
+        gaps,
     )
+    return resampled, gaps
+
 
-    process_dataset(
-        data_dir / "DATA_GEO_Train.csv",
-        output_dir / "GEO_15min_raw.csv",
-        "GEO",
+@instrumentation.instrumented("resample_chunked")
+def process_dataset_chunked(
+    dataset_path: Path, output_path: Path, label: str, chunk_rows: int = CHUNK_ROWS
+) -> None:
+    save_resampled(*resample_chunked(dataset_path, label, chunk_rows), output_path)
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description="Resample the raw data to 15-minute bins.")
+    parser.add_argument(
+        "--chunk-rows",
+        type=int,
+        help="read the raw file this many rows at a time (for files too large to load)",
     )
+    args = parser.parse_args()
+
+    OUTPUT_DIR.mkdir(exist_ok=True)
+    for label, (input_path, output_path) in DATASETS.items():
+        if args.chunk_rows:
+            process_dataset_chunked(input_path, output_path, label, args.chunk_rows)
+        else:
+            process_dataset(input_path, output_path, label)
+    instrumentation.print_summary()
 
 
 if __name__ == "__main__":
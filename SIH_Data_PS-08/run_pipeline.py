@@ -0,0 +1,376 @@
+from __future__ import annotations
+
+import argparse
+import contextlib
+import os
+import re
+import time
+import traceback
+from concurrent.futures import ProcessPoolExecutor, as_completed
+from pathlib import Path
+from typing import Callable
+
+import add_ewm_features
+import add_interaction_features
+import add_lag_features
+import add_rolling_features
+import add_time_features
+import feature_kernel
+import feature_store
+import gap_index
+import ingestion
+import instrumentation
+import interpolate_timeseries
+import merge_meo
+import resample_satellites
+import smooth_timeseries
+import storage
+import zscore_outliers
+from lazy_imports import lazy_module
+
+pd = lazy_module("pandas")
+
+BASE_DIR = Path(__file__).resolve().parent
+MERGED_OUTPUT_NAME = "{label}_merged.csv"
+# Raw files are named DATA_<satellite>_<anything>.csv; every file of a satellite is merged.
+SOURCE_PATTERN = re.compile(r"^DATA_(?P<label>[A-Za-z0-9-]+)_.*\.csv$")
+FLEET_REPORT_NAME = "fleet_report.csv"
+
+# Stage name, frame transform and the (input, output) path table of the stage's script.
+# The output path is only used when intermediates are written for debugging.
+STAGES: list[tuple[str, Callable[[str, pd.DataFrame], pd.DataFrame], dict]] = [
+    ("resample", resample_satellites.process_frame, resample_satellites.DATASETS),
+    ("zscore", zscore_outliers.process_frame, zscore_outliers.DATASETS),
+    ("interpolate", interpolate_timeseries.process_frame, interpolate_timeseries.DATASETS),
+    ("smooth", smooth_timeseries.process_frame, smooth_timeseries.DATASETS),
+    ("time_features", add_time_features.process_frame, add_time_features.DATASETS),
+    ("lag_features", add_lag_features.process_frame, add_lag_features.DATASETS),
+    ("rolling_features", add_rolling_features.process_frame, add_rolling_features.DATASETS),
+    ("ewm_features", add_ewm_features.process_frame, add_ewm_features.DATASETS),
+    (
+        "interaction_features",
+        add_interaction_features.process_frame,
+        add_interaction_features.DATASETS,
+    ),
+]
+WINDOW_STAGES = {"lag_features", "rolling_features", "ewm_features"}
+# Stages that take the resampler's gap index as a third argument
+GAP_STAGES = {"interpolate", "smooth", "lag_features", "rolling_features", "window_features"}
+
+
+def window_features_frame(
+    label: str, df: pd.DataFrame, gaps: gap_index.GapIndex | None = None
+) -> pd.DataFrame:
+    """Lag, rolling and EWM stages fused into one kernel pass over the error matrix.
+
+    Produces the same columns, in the same order and with the same values, as
+    running the three stages one after the other.
+    """
+    utc = ingestion.parse_times(df["utc_time"])
+    df = df.assign(utc_time=utc).sort_values("utc_time").set_index("utc_time")
+
+    resolved = feature_kernel.resolve_error_columns(df.columns)
+    columns = [col for col, _ in resolved]
+    block, names = feature_kernel.window_feature_block(
+        feature_kernel.error_matrix(df, columns),
+        [short_name for _, short_name in resolved],
+        add_lag_features.LAG_STEPS,
+        add_rolling_features.ROLLING_WINDOWS,
+        add_ewm_features.EWM_SPANS,
+        gap_index.long_gap_rows(gaps, df.index),
+    )
+    df_with_features = feature_kernel.join_block(df, block, names)
+
+    print(f"--- {label} ---")
+    print(f"Window features created: {len(names)}")
+    print(f"Shape before: {df.shape}, Shape after: {df_with_features.shape}")
+    print()
+    return df_with_features.reset_index()
+
+
+# Without intermediate files the three window stages run as one fused stage.
+FUSED_STAGES = [stage for stage in STAGES if stage[0] not in WINDOW_STAGES]
+FUSED_STAGES.insert(
+    [stage[0] for stage in FUSED_STAGES].index("time_features") + 1,
+    ("window_features", window_features_frame, {}),
+)
+
+
+def _stage_output_path(datasets: dict, label: str, intermediate_dir: Path | None) -> Path:
+    if label in datasets:
+        path = datasets[label][1]
+    else:
+        # Derive the file name from a known dataset, e.g. MEO_smoothed.csv -> G07_smoothed.csv
+        reference_label, (_, reference_path) = next(iter(datasets.items()))
+        path = reference_path.with_name(label + reference_path.name[len(reference_label):])
+    return intermediate_dir / path.name if intermediate_dir is not None else path
+
+
+def discover_satellites(input_dir: Path) -> dict[str, list[Path]]:
+    """Group the raw ``DATA_<satellite>_*.csv`` files of a directory by satellite."""
+    satellites: dict[str, list[Path]] = {}
+    for path in sorted(input_dir.glob("DATA_*.csv")):
+        match = SOURCE_PATTERN.match(path.name)
+        if match:
+            satellites.setdefault(match.group("label"), []).append(path)
+    return satellites
+
+
+def load_manifest(manifest_path: Path) -> dict[str, list[Path]]:
+    """Read a CSV manifest with ``satellite`` and ``path`` columns (paths relative to it)."""
+    manifest = pd.read_csv(manifest_path, dtype=str)
+    missing = [column for column in ("satellite", "path") if column not in manifest.columns]
+    if missing:
+        raise ValueError(f"Manifest is missing columns: {', '.join(missing)}")
+
+    satellites: dict[str, list[Path]] = {}
+    for satellite, path in manifest[["satellite", "path"]].itertuples(index=False):
+        source = Path(path)
+        if not source.is_absolute():
+            source = manifest_path.parent / source
+        satellites.setdefault(satellite.strip(), []).append(source)
+    return satellites
+
+
+def _store_path(label: str, output_path: Path) -> Path:
+    # The feature store sits next to the final feature file, as <label>_feature_store/
+    return output_path.parent / add_interaction_features.FEATURE_STORE_NAME.format(label=label)
+
+
+def run_pipeline(
+    label: str,
+    sources: list[Path],
+    output_path: Path | None = None,
+    write_intermediates: bool = False,
+    storage_format: str | None = None,
+    intermediate_dir: Path | None = None,
+    store_path: Path | None = None,
+) -> pd.DataFrame:
+    """Run every stage on one dataset, passing the frame between stages in memory.
+
+    The final frame is saved to ``output_path`` and, with ``store_path``,
+    rewritten into that feature store, so the store never lags the file.
+    """
+    first_record = len(instrumentation.RECORDS)
+
+    with instrumentation.stage("load", label) as record:
+        frames = merge_meo.read_sources(sources)
+        if len(frames) > 1:
+            df = merge_meo.merge_frames(frames)
+            if write_intermediates:
+                merged_dir = intermediate_dir if intermediate_dir is not None else BASE_DIR
+                merged_dir.mkdir(parents=True, exist_ok=True)
+                merged_path = merged_dir / MERGED_OUTPUT_NAME.format(label=label)
+                df.to_csv(merged_path, index=False)
+                record.wrote(df, merged_path)
+        else:
+            df = frames[0]
+        record.wrote(df)
+
+    gaps = None
+    for name, stage, datasets in STAGES if write_intermediates else FUSED_STAGES:
+        with instrumentation.stage(name, label) as record:
+            record.read(df)
+            if name == "resample":
+                df, gaps = resample_satellites.resample_frame(label, df)
+            elif name in GAP_STAGES:
+                df = stage(label, df, gaps)
+            else:
+                df = stage(label, df)
+            record.wrote(df)
+            if write_intermediates:
+                stage_path = _stage_output_path(datasets, label, intermediate_dir)
+                storage.save(df, stage_path, storage_format)
+                if name == "resample":
+                    gaps.save(gap_index.sidecar_path(stage_path))
+
+    if output_path is not None:
+        with instrumentation.stage("write", label):
+            output_path = storage.save(df, output_path, storage_format)
+            if store_path is not None:
+                feature_store.write_store(df, store_path, source=output_path)
+
+    instrumentation.print_summary(instrumentation.RECORDS[first_record:], f"{label} pipeline")
+    print(f"Final shape: {df.shape}")
+    if output_path is not None:
+        print(f"Output saved to: {output_path}")
+    if store_path is not None and output_path is not None:
+        print(f"Feature store saved to: {store_path}")
+    print()
+    return df
+
+
+def run_satellite(
+    label: str,
+    sources: list[Path],
+    output_dir: Path,
+    write_intermediates: bool = False,
+    storage_format: str | None = None,
+) -> dict[str, object]:
+    """Run one satellite's pipeline with its console output sent to a log file.
+
+    Errors are caught and reported so one bad satellite does not stop the others.
+    """
+    log_path = output_dir / "logs" / f"{label}.log"
+    log_path.parent.mkdir(parents=True, exist_ok=True)
+    output_path = _stage_output_path(add_interaction_features.DATASETS, label, output_dir)
+    intermediate_dir = output_dir / label if write_intermediates else None
+
+    start = time.perf_counter()
+    report: dict[str, object] = {"satellite": label, "files": len(sources)}
+    with open(log_path, "w") as log, contextlib.redirect_stdout(log):
+        try:
+            df = run_pipeline(
+                label,
+                sources,
+                output_path,
+                write_intermediates,
+                storage_format,
+                intermediate_dir,
+                _store_path(label, output_path),
+            )
+            report.update(status="ok", rows=len(df), error="")
+        except Exception as exc:
+            traceback.print_exc(file=log)
+            report.update(status="failed", rows=0, error=f"{type(exc).__name__}: {exc}")
+    report["seconds"] = round(time.perf_counter() - start, 3)
+    report["log"] = str(log_path)
+    return report
+
+
+def run_fleet(
+    satellites: dict[str, list[Path]],
+    output_dir: Path,
+    workers: int,
+    write_intermediates: bool = False,
+    storage_format: str | None = None,
+) -> pd.DataFrame:
+    """Run every satellite's pipeline in a process pool and return the per-satellite report."""
+    reports = []
+    with ProcessPoolExecutor(max_workers=workers) as executor:
+        futures = {
+            executor.submit(
+                run_satellite, label, sources, output_dir, write_intermediates, storage_format
+            ): label
+            for label, sources in satellites.items()
+        }
+        for future in as_completed(futures):
+            label = futures[future]
+            try:
+                report = future.result()
+            except Exception as exc:
+                # The worker itself died (e.g. killed for memory); record it like any failure
+                report = {
+                    "satellite": label,
+                    "files": len(satellites[label]),
+                    "status": "failed",
+                    "rows": 0,
+                    "error": f"{type(exc).__name__}: {exc}",
+                    "seconds": float("nan"),
+                    "log": "",
+                }
+            print(f"{label}: {report['status']} ({report['seconds']} s)")
+            reports.append(report)
+
+    report_df = pd.DataFrame(reports).sort_values("satellite").reset_index(drop=True)
+    report_df.to_csv(output_dir / FLEET_REPORT_NAME, index=False)
+
+    failed = report_df[report_df["status"] != "ok"]
+    print(f"\nSatellites processed: {len(report_df)}, failed: {len(failed)}")
+    if not failed.empty:
+        print(failed[["satellite", "error", "log"]].to_string(index=False))
+    print(f"Report saved to: {output_dir / FLEET_REPORT_NAME}\n")
+    return report_df
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description="Run the full pipeline in memory.")
+    parser.add_argument(
+        "--write-intermediates",
+        action="store_true",
+        help="also write every stage's output file (debugging only)",
+    )
+    parser.add_argument(
+        "--storage-format",
+        choices=sorted(storage.FORMAT_SUFFIXES),
+        help=f"format of the written stage files (default: ${storage.STORAGE_FORMAT_ENV} or csv)",
+    )
+    parser.add_argument(
+        "--feature-dtype",
+        choices=feature_kernel.FEATURE_DTYPES,
+        help=(
+            "precision of the stored feature columns "
+            f"(default: ${feature_kernel.FEATURE_DTYPE_ENV} or float64)"
+        ),
+    )
+    parser.add_argument(
+        "--max-gap-rows",
+        type=int,
+        help=(
+            "leave longer runs of empty slots unfilled and mask the lags and windows over them "
+            f"(default: ${gap_index.MAX_GAP_ENV} or fill every gap)"
+        ),
+    )
+    parser.add_argument(
+        "--input-dir",
+        type=Path,
+        default=BASE_DIR,
+        help="directory searched for DATA_<satellite>_*.csv raw files",
+    )
+    parser.add_argument(
+        "--manifest",
+        type=Path,
+        help="CSV with satellite,path columns listing the raw files (overrides --input-dir)",
+    )
+    parser.add_argument(
+        "--output-dir",
+        type=Path,
+        help="run every satellite in a process pool and write outputs, logs and a report here",
+    )
+    parser.add_argument(
+        "--workers",
+        type=int,
+        default=os.cpu_count(),
+        help="worker processes for --output-dir runs (default: CPU count)",
+    )
+    args = parser.parse_args()
+    if args.feature_dtype is not None:
+        # Read by the feature stages, here and in the fleet's worker processes
+        os.environ[feature_kernel.FEATURE_DTYPE_ENV] = args.feature_dtype
+    if args.max_gap_rows is not None:
+        os.environ[gap_index.MAX_GAP_ENV] = str(args.max_gap_rows)
+
+    if args.manifest is not None:
+        satellites = load_manifest(args.manifest)
+    else:
+        satellites = discover_satellites(args.input_dir)
+    if not satellites:
+        raise SystemExit("No satellites found")
+
+    if args.output_dir is not None:
+        args.output_dir.mkdir(parents=True, exist_ok=True)
+        report = run_fleet(
+            satellites,
+            args.output_dir,
+            args.workers,
+            args.write_intermediates,
+            args.storage_format,
+        )
+        if (report["status"] != "ok").any():
+            raise SystemExit(1)
+        return
+
+    for label, sources in satellites.items():
+        output_path = _stage_output_path(add_interaction_features.DATASETS, label, None)
+        run_pipeline(
+            label,
+            sources,
+            output_path,
+            args.write_intermediates,
+            args.storage_format,
+            store_path=_store_path(label, output_path),
+        )
+
+
+if __name__ == "__main__":
+    main()
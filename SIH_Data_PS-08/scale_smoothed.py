@@ -1,10 +1,17 @@
 from __future__ import annotations
 
+import argparse
 from pathlib import Path
 
-import joblib
-import pandas as pd
-from sklearn.preprocessing import StandardScaler
+import numpy as np
+
+import ingestion
+import instrumentation
+import storage
+from lazy_imports import lazy_module
+from standard_scaler import ScalerParams, StreamingScaler
+
+pd = lazy_module("pandas")
 
 INPUT_DIR = Path(__file__).resolve().parent / "15min_resampled"
 SCALER_DIR = Path(__file__).resolve().parent / "models" / "scalers"
@@ -12,74 +19,181 @@ DATASETS = {
     "MEO": (
         INPUT_DIR / "MEO_smoothed.csv",
         INPUT_DIR / "MEO_scaled.csv",
-        SCALER_DIR / "MEO_scaler.pkl",
+        SCALER_DIR / "MEO_scaler.json",
     ),
     "GEO": (
         INPUT_DIR / "GEO_smoothed.csv",
         INPUT_DIR / "GEO_scaled.csv",
-        SCALER_DIR / "GEO_scaler.pkl",
+        SCALER_DIR / "GEO_scaler.json",
     ),
 }
-NUMERIC_COLUMNS = ["x_error", "y_error", "z_error", "satclockerror"]
-NORMALIZED_TARGETS = {"".join(col.lower().split("_")): col for col in NUMERIC_COLUMNS}
-
-
-def _normalize_column_name(name: str) -> str:
-    base = name.split("(")[0]
-    return base.strip().lower().replace(" ", "").replace("_", "")
-
-
-def _resolve_columns(df: pd.DataFrame) -> dict[str, str]:
-    mapping: dict[str, str] = {}
-    for column in df.columns:
-        if column.lower() == "utc_time":
-            continue
-        normalized = _normalize_column_name(column)
-        for normalized_target, target in NORMALIZED_TARGETS.items():
-            if normalized.startswith(normalized_target) and target not in mapping:
-                mapping[target] = column
-                break
-    missing = [target for target in NUMERIC_COLUMNS if target not in mapping]
-    if missing:
-        raise ValueError(f"Missing expected columns: {', '.join(missing)}")
-    return mapping
-
-
-def process_dataset(label: str, input_path: Path, output_path: Path, scaler_path: Path) -> None:
-    df = pd.read_csv(input_path)
-    df["utc_time"] = pd.to_datetime(df["utc_time"], errors="coerce")
-
-    column_map = _resolve_columns(df)
-    numeric_columns = [column_map[target] for target in NUMERIC_COLUMNS]
-
-    print(f"--- {label} ---")
-    for target, column in zip(NUMERIC_COLUMNS, numeric_columns):
-        mean = df[column].mean()
-        std = df[column].std()
-        print(f"Before scaling {column}: mean={mean:.6f}, std={std:.6f}")
+# The fitted sklearn StandardScaler, still written for the consumers that unpickle it
+PICKLE_PATHS = {label: SCALER_DIR / f"{label}_scaler.pkl" for label in DATASETS}
+# One scaler fitted on every satellite's rows, for models shared across the fleet
+POOLED_SCALER_PATH = SCALER_DIR / "pooled_scaler.json"
+# Rows read at a time, in the fitting pass and again in the scaling pass
+CHUNK_ROWS = 65_536
+
+
+def _numeric_columns(input_path: Path) -> list[str]:
+    column_map = ingestion.resolve_columns(ingestion.read_header(input_path))
+    return [column_map[target] for target in ingestion.NUMERIC_COLUMNS]
+
+
+def fit_scaler(input_path: Path, chunk_rows: int = CHUNK_ROWS) -> StreamingScaler:
+    """Fit the error columns of a stage file, ``chunk_rows`` rows at a time."""
+    columns = _numeric_columns(input_path)
+    scaler = StreamingScaler(columns)
+    for chunk in ingestion.iter_chunks(input_path, chunk_rows):
+        scaler.partial_fit(chunk[columns].to_numpy(dtype="float64"))
+    return scaler
+
+
+def scale_file(
+    input_path: Path,
+    output_path: Path,
+    params: ScalerParams,
+    record: instrumentation.StageRecord | None = None,
+    chunk_rows: int = CHUNK_ROWS,
+) -> StreamingScaler:
+    """Write the scaled stage file chunk by chunk; returns the statistics of the scaled columns.
+
+    The scaled frame is never whole in memory, so its row and NaN totals are
+    added to ``record`` here.
+    """
+    columns = _numeric_columns(input_path)
+    scaled_stats = StreamingScaler(columns)
+    rows = nans = 0
+    for index, chunk in enumerate(ingestion.iter_chunks(input_path, chunk_rows)):
+        scaled = params.transform(chunk[columns].to_numpy(dtype="float64"))
+        chunk[columns] = scaled
+        scaled_stats.partial_fit(scaled)
+        if index == 0:
+            storage.save(chunk, output_path)
+        else:
+            storage.append(chunk, output_path)
+        rows += len(chunk)
+        nans += int(chunk.isna().sum().sum())
+    if record is not None:
+        record.rows_out, record.nans_out = rows, nans
+    return scaled_stats
+
+
+def save_pickle(params: ScalerParams, path: Path, var: np.ndarray | None = None) -> Path:
+    """Write the parameters as a fitted sklearn ``StandardScaler`` with joblib.
+
+    ``var`` is the fitted variance; ``scale**2`` stands in for it otherwise,
+    which differs from sklearn's ``var_`` only for constant columns.
+    """
+    import joblib
+    from sklearn.preprocessing import StandardScaler
 
     scaler = StandardScaler()
-    scaled_values = scaler.fit_transform(df[numeric_columns])
-
-    scaled_df = df.copy()
-    scaled_df[numeric_columns] = scaled_values
-    scaled_df.to_csv(output_path, index=False)
-
-    joblib.dump(scaler, scaler_path)
-
-    after_means = scaled_df[numeric_columns].mean()
-    after_stds = scaled_df[numeric_columns].std()
-    for column in numeric_columns:
-        print(
-            f"After scaling {column}: mean={after_means[column]:.4f}, std={after_stds[column]:.4f}"
-        )
-    print()
+    scaler.mean_ = params.mean.copy()
+    scaler.scale_ = params.scale.copy()
+    scaler.var_ = np.square(params.scale) if var is None else np.asarray(var, dtype=np.float64)
+    scaler.n_features_in_ = len(params.columns)
+    scaler.feature_names_in_ = np.array(params.columns, dtype=object)
+    if params.count is not None:
+        counts = params.count.copy()
+        # sklearn keeps one count when no column has NaNs
+        scaler.n_samples_seen_ = counts[0] if (counts == counts[0]).all() else counts
+    path = Path(path)
+    path.parent.mkdir(parents=True, exist_ok=True)
+    joblib.dump(scaler, path)
+    return path
+
+
+def process_dataset(
+    label: str,
+    input_path: Path,
+    output_path: Path,
+    scaler_path: Path,
+    params: ScalerParams | None = None,
+    chunk_rows: int = CHUNK_ROWS,
+    pickle_path: Path | None = None,
+) -> None:
+    """Fit (unless ``params`` are given), save the parameters and scale the file, out of core.
+
+    The parameters also go to ``pickle_path`` as a joblib ``StandardScaler``
+    (``<label>_scaler.pkl`` when not given).
+    """
+    with instrumentation.stage("scale", label) as record:
+        print(f"--- {label} ---")
+        fitted = fit_scaler(input_path, chunk_rows)
+        before_stds = fitted.std(ddof=1)
+        for column, mean, std in zip(fitted.columns, fitted.mean, before_stds):
+            print(f"Before scaling {column}: mean={mean:.6f}, std={std:.6f}")
+
+        var = None
+        if params is None:
+            params = fitted.params()
+            var = fitted.var
+        params.save(scaler_path)
+        pickle_path = pickle_path or PICKLE_PATHS.get(label, Path(scaler_path).with_suffix(".pkl"))
+        save_pickle(params, pickle_path, var)
+        scaled_stats = scale_file(input_path, output_path, params, record, chunk_rows)
+        record.bytes_written += instrumentation.path_bytes(scaler_path)
+        record.bytes_written += instrumentation.path_bytes(pickle_path)
+
+        after_stds = scaled_stats.std(ddof=1)
+        for column, mean, std in zip(scaled_stats.columns, scaled_stats.mean, after_stds):
+            print(f"After scaling {column}: mean={mean:.4f}, std={std:.4f}")
+        print()
+
+
+def fit_pooled(input_paths: list[Path], chunk_rows: int = CHUNK_ROWS) -> ScalerParams:
+    """One scaler over several satellites' files, merged from per-file fits."""
+    pooled: StreamingScaler | None = None
+    for input_path in input_paths:
+        scaler = fit_scaler(input_path, chunk_rows)
+        # Files may spell the columns differently; the pooled scaler uses the canonical names
+        scaler.columns = list(ingestion.NUMERIC_COLUMNS)
+        pooled = scaler if pooled is None else pooled.merge(scaler)
+    if pooled is None:
+        raise ValueError("No input files to fit a pooled scaler on")
+    return pooled.params()
+
+
+def load_params(scaler_path: Path, columns: list[str] | None = None) -> ScalerParams:
+    """Read saved parameters, optionally relabelled to the columns of the frame they will scale."""
+    params = ScalerParams.load(scaler_path)
+    if columns is not None:
+        if len(columns) != len(params.columns):
+            raise ValueError(f"{scaler_path} scales {len(params.columns)} columns, not {len(columns)}")
+        params.columns = list(columns)
+    return params
+
+
+def transform_frame(df: pd.DataFrame, params: ScalerParams) -> pd.DataFrame:
+    """Scale the error columns of a frame with saved parameters."""
+    column_map = ingestion.resolve_columns(df.columns)
+    columns = [column_map[target] for target in ingestion.NUMERIC_COLUMNS]
+    scaled = df.copy()
+    scaled[columns] = params.transform(df[columns].to_numpy(dtype=np.float64))
+    return scaled
 
 
 def main() -> None:
-    SCALER_DIR.mkdir(parents=True, exist_ok=True)
+    parser = argparse.ArgumentParser(description="Standard-scale the smoothed error columns.")
+    parser.add_argument(
+        "--pooled",
+        action="store_true",
+        help=f"scale every satellite with one scaler fitted on all of them ({POOLED_SCALER_PATH.name})",
+    )
+    parser.add_argument("--chunk-rows", type=int, default=CHUNK_ROWS)
+    args = parser.parse_args()
+
+    if args.pooled:
+        pooled = fit_pooled([input_path for input_path, _, _ in DATASETS.values()], args.chunk_rows)
+        pooled.save(POOLED_SCALER_PATH)
+        print(f"Pooled scaler saved to: {POOLED_SCALER_PATH}\n")
     for label, (input_path, output_path, scaler_path) in DATASETS.items():
-        process_dataset(label, input_path, output_path, scaler_path)
+        params = None
+        if args.pooled:
+            params = load_params(POOLED_SCALER_PATH, _numeric_columns(input_path))
+        process_dataset(label, input_path, output_path, scaler_path, params, args.chunk_rows)
+    instrumentation.print_summary()
 
 
 if __name__ == "__main__":
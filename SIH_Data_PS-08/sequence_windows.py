@@ -0,0 +1,211 @@
+from __future__ import annotations
+
+import argparse
+import time
+import tracemalloc
+from pathlib import Path
+from typing import Iterator, Sequence
+
+import numpy as np
+from numpy.lib.stride_tricks import sliding_window_view
+
+import feature_store
+import ingestion
+from lazy_imports import lazy_module
+
+pd = lazy_module("pandas")
+
+WINDOW_ROWS = 96  # one day of 15-minute rows
+HORIZONS = (1, 4, 96)  # 15 minutes, one hour and one day ahead
+BATCH_SIZE = 64
+# Rows scanned at a time for NaNs, so the scan of a memory-mapped matrix stays small
+SCAN_CHUNK_ROWS = 65_536
+
+
+def _nan_rows(values: np.ndarray) -> np.ndarray:
+    bad = np.zeros(len(values), dtype=bool)
+    for start in range(0, len(values), SCAN_CHUNK_ROWS):
+        rows = slice(start, start + SCAN_CHUNK_ROWS)
+        bad[rows] = np.isnan(values[rows]).any(axis=1)
+    return bad
+
+
+class SequenceWindows:
+    """``(window, horizons)`` training samples of a feature matrix, as strided views.
+
+    Sample ``i`` is ``features[s : s + window]`` as input and the ``targets``
+    rows ``s + window - 1 + h`` for every ``h`` in ``horizons``, with ``s =
+    starts[i]``. Both are views of the matrices given (memory-mapped ones
+    included), so the data is never duplicated per window: the dataset itself
+    holds one start index per sample whatever the window length, and only the
+    batches handed out are copies.
+
+    Windows whose inputs or targets touch a row with a NaN are skipped: the
+    warm-up rows of the lag, rolling and EWM features, and any gap left
+    in the series.
+    """
+
+    def __init__(
+        self,
+        features: np.ndarray,
+        targets: np.ndarray,
+        window: int = WINDOW_ROWS,
+        horizons: int | Sequence[int] = HORIZONS,
+    ) -> None:
+        if isinstance(horizons, int):
+            horizons = range(1, horizons + 1)
+        self.horizons = np.asarray(sorted(set(horizons)), dtype=np.int64)
+        if window < 1 or len(self.horizons) == 0 or self.horizons[0] < 1:
+            raise ValueError("Need a window of at least one row and horizons of at least one step")
+        if len(features) != len(targets):
+            raise ValueError(f"{len(features)} feature rows but {len(targets)} target rows")
+        self.window = window
+        self.features = features
+        self.targets_matrix = targets
+
+        span = int(self.horizons[-1] - self.horizons[0]) + 1
+        candidates = max(len(features) - window - int(self.horizons[-1]) + 1, 0)
+        if candidates:
+            # (start, window, feature) and (start, horizon step, target): windows along the rows
+            self._inputs = sliding_window_view(features, window, axis=0).transpose(0, 2, 1)
+            first_target = window - 1 + int(self.horizons[0])
+            self._target_span = sliding_window_view(
+                targets[first_target:], span, axis=0
+            ).transpose(0, 2, 1)
+            self._inputs = self._inputs[:candidates]
+            self._target_span = self._target_span[:candidates]
+        else:
+            self._inputs = np.empty((0, window, features.shape[1]), dtype=features.dtype)
+            self._target_span = np.empty((0, span, targets.shape[1]), dtype=targets.dtype)
+        offsets = self.horizons - self.horizons[0]
+        steps = np.unique(np.diff(offsets))
+        # Evenly spaced horizons are a strided view too; others are picked per batch
+        self._offsets: slice | np.ndarray = (
+            slice(0, span, int(steps[0]) if len(steps) else 1) if len(steps) <= 1 else offsets
+        )
+        self.starts = self._valid_starts(candidates)
+
+    def _valid_starts(self, candidates: int) -> np.ndarray:
+        bad_inputs = np.concatenate([[0], np.cumsum(_nan_rows(self.features))])
+        starts = np.arange(candidates)
+        bad = bad_inputs[starts + self.window] != bad_inputs[starts]
+        bad_targets = _nan_rows(self.targets_matrix)
+        for horizon in self.horizons:
+            bad |= bad_targets[starts + self.window - 1 + horizon]
+        return starts[~bad]
+
+    def __len__(self) -> int:
+        return len(self.starts)
+
+    @property
+    def inputs(self) -> np.ndarray:
+        """``(candidate start, window, feature)`` view over every start, valid or not."""
+        return self._inputs
+
+    @property
+    def targets(self) -> np.ndarray:
+        """``(candidate start, horizon, target)``; a view unless the horizons are unevenly spaced."""
+        return self._target_span[:, self._offsets]
+
+    def sample(self, index: int) -> tuple[np.ndarray, np.ndarray]:
+        """Input window and targets of valid sample ``index``, both views."""
+        start = self.starts[index]
+        return self._inputs[start], self._target_span[start, self._offsets]
+
+    def batches(
+        self, batch_size: int = BATCH_SIZE, shuffle: bool = False, seed: int | None = None
+    ) -> Iterator[tuple[np.ndarray, np.ndarray]]:
+        """``(inputs, targets)`` batches of ``(batch, window, feature)`` and ``(batch, horizon, target)``.
+
+        Shuffled batches draw a new order of the valid samples from ``seed``.
+        In order, a batch of consecutive starts is handed out as a view;
+        otherwise the batch is gathered into one contiguous array.
+        """
+        order = self.starts
+        if shuffle:
+            order = np.random.default_rng(seed).permutation(order)
+        for first in range(0, len(order), batch_size):
+            starts = order[first : first + batch_size]
+            if not shuffle and starts[-1] - starts[0] == len(starts) - 1:
+                rows: slice | np.ndarray = slice(int(starts[0]), int(starts[-1]) + 1)
+            else:
+                rows = starts
+            yield self._inputs[rows], self._target_span[rows][:, self._offsets]
+
+
+def from_store(
+    store: feature_store.FeatureStore,
+    window: int = WINDOW_ROWS,
+    horizons: int | Sequence[int] = HORIZONS,
+    feature_columns: list[str] | None = None,
+    target_columns: list[str] | None = None,
+) -> SequenceWindows:
+    """Windows over a memory-mapped feature store; the error columns are the default targets."""
+    if target_columns is None:
+        column_map = ingestion.resolve_columns(store.columns)
+        target_columns = [column_map[target] for target in ingestion.NUMERIC_COLUMNS]
+    features = store.select(feature_columns)
+    targets = store.select(target_columns)
+    return SequenceWindows(features, targets, window, horizons)
+
+
+def from_frame(
+    df: pd.DataFrame,
+    window: int = WINDOW_ROWS,
+    horizons: int | Sequence[int] = HORIZONS,
+    feature_columns: list[str] | None = None,
+    target_columns: list[str] | None = None,
+) -> SequenceWindows:
+    """Windows over a feature frame, converted to one matrix once (not once per window)."""
+    if feature_columns is None:
+        feature_columns = [column for column in df.columns if column != ingestion.TIME_COLUMN]
+    if target_columns is None:
+        column_map = ingestion.resolve_columns(df.columns)
+        target_columns = [column_map[target] for target in ingestion.NUMERIC_COLUMNS]
+    features = df[feature_columns].to_numpy(dtype="float64")
+    positions = [feature_columns.index(column) for column in target_columns if column in feature_columns]
+    if len(positions) == len(target_columns):
+        targets = features[:, positions]
+    else:
+        targets = df[target_columns].to_numpy(dtype="float64")
+    return SequenceWindows(features, targets, window, horizons)
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(
+        description="Build sliding-window samples from a feature store and report their memory."
+    )
+    parser.add_argument("store", type=Path, help="feature store directory")
+    parser.add_argument(
+        "--windows", type=int, nargs="+", default=[24, WINDOW_ROWS, 4 * WINDOW_ROWS]
+    )
+    parser.add_argument("--horizons", type=int, nargs="+", default=list(HORIZONS))
+    parser.add_argument("--batch-size", type=int, default=BATCH_SIZE)
+    args = parser.parse_args()
+
+    store = feature_store.open_store(args.store)
+    print(f"Store: {args.store.name}, {len(store)} rows x {len(store.columns)} columns")
+    for window in args.windows:
+        tracemalloc.start()
+        start = time.perf_counter()
+        dataset = from_store(store, window, args.horizons)
+        _, build_peak = tracemalloc.get_traced_memory()
+        tracemalloc.reset_peak()
+        batches = 0
+        for inputs, targets in dataset.batches(args.batch_size, shuffle=True, seed=0):
+            batches += 1
+        _, batch_peak = tracemalloc.get_traced_memory()
+        tracemalloc.stop()
+        seconds = time.perf_counter() - start
+
+        naive = len(dataset) * window * len(store.columns) * store.dtype.itemsize
+        print(f"--- window {window} rows, horizons {args.horizons} ---")
+        print(f"Samples: {len(dataset)} of {len(dataset.inputs)} (NaN windows skipped)")
+        print(f"Dataset memory: {build_peak / 1e6:.2f} MB (materialised windows: {naive / 1e6:.1f} MB)")
+        print(f"Peak per batch: {batch_peak / 1e6:.2f} MB over {batches} shuffled batches")
+        print(f"Time: {seconds * 1000:.1f} ms")
+        print()
+
+
+if __name__ == "__main__":
+    main()
@@ -1,29 +1,43 @@
 from __future__ import annotations
 
+import argparse
+import time
 from pathlib import Path
 
-import pandas as pd
+import numpy as np
+
+import gap_index
+import ingestion
+import instrumentation
+import resample_satellites
+import smoothing_filters
+import storage
+from lazy_imports import lazy_module
+
+pd = lazy_module("pandas")
 
 INPUT_DIR = Path(__file__).resolve().parent / "15min_resampled"
 DATASETS = {
     "MEO": (INPUT_DIR / "MEO_interpolated.csv", INPUT_DIR / "MEO_smoothed.csv"),
     "GEO": (INPUT_DIR / "GEO_interpolated.csv", INPUT_DIR / "GEO_smoothed.csv"),
 }
-NUMERIC_COLUMNS = ["x_error", "y_error", "z_error", "satclockerror"]
-NORMALIZED_TARGETS = {"".join(col.lower().split("_")): col for col in NUMERIC_COLUMNS}
-
-
-def _normalize_column_name(name: str) -> str:
-    return name.split("(")[0].strip().lower().replace(" ", "").replace("_", "")
+# median: centred running median (the window-3 default is the original smoothing).
+# savgol: Savitzky-Golay local quadratic fit, which keeps peaks a median flattens.
+# hampel: only values more than HAMPEL_THRESHOLD scaled MADs off the median are replaced.
+SMOOTHING_METHODS = tuple(smoothing_filters.SMOOTHERS)
+SMOOTHING_METHOD = "median"
+SMOOTHING_WINDOW = 3
+# Windows timed by --compare (odd, so every method accepts them)
+COMPARE_WINDOWS = (3, 5, 9, 25, 97)
 
 
 def _coalesce_measurement_columns(df: pd.DataFrame) -> pd.DataFrame:
     df = df.copy()
-    for normalized_target, target in NORMALIZED_TARGETS.items():
+    for normalized_target in ingestion.NORMALIZED_TARGETS:
         matching_columns = [
             column
             for column in df.columns
-            if _normalize_column_name(column) == normalized_target
+            if ingestion.normalize_column_name(column) == normalized_target
         ]
         if not matching_columns:
             continue
@@ -34,51 +48,50 @@ def _coalesce_measurement_columns(df: pd.DataFrame) -> pd.DataFrame:
     return df
 
 
-def _resolve_columns(df: pd.DataFrame) -> dict[str, str]:
-    mapping: dict[str, str] = {}
-    for column in df.columns:
-        normalized = _normalize_column_name(column)
-        for normalized_target, target in NORMALIZED_TARGETS.items():
-            if normalized.startswith(normalized_target) and target not in mapping:
-                mapping[target] = column
-                break
-    missing = [target for target in NUMERIC_COLUMNS if target not in mapping]
-    if missing:
-        raise ValueError(f"Missing expected columns: {', '.join(missing)}")
-    return mapping
-
-
 def _count_nans(df: pd.DataFrame) -> int:
     return int(df.isna().sum().sum())
 
 
-def process_dataset(label: str, input_path: Path, output_path: Path) -> None:
-    df = pd.read_csv(input_path)
+def process_frame(
+    label: str,
+    df: pd.DataFrame,
+    gaps: gap_index.GapIndex | None = None,
+    method: str = SMOOTHING_METHOD,
+    window: int = SMOOTHING_WINDOW,
+    max_gap_rows: int | None = None,
+) -> pd.DataFrame:
+    """Smooth the error columns, keeping the gaps interpolation left open empty.
+
+    The filters fill a row from any value in its window, so the rows at the
+    edges of a long gap would get values again; they are blanked after
+    filtering, as in the interpolate stage.
+    """
     df = _coalesce_measurement_columns(df)
-    df["utc_time"] = pd.to_datetime(df["utc_time"], errors="coerce")
+    df["utc_time"] = ingestion.parse_times(df["utc_time"])
 
     df = df.set_index("utc_time")
     before_nans = _count_nans(df)
 
-    col_map = _resolve_columns(df.reset_index())
+    col_map = ingestion.resolve_columns(df.columns)
     columns_to_smooth = list(col_map.values())
 
     smoothed = df.copy()
-    smoothed[columns_to_smooth] = (
-        smoothed[columns_to_smooth]
-        .rolling(window=3, center=True, min_periods=1)
-        .median()
+    smoothed[columns_to_smooth] = smoothing_filters.smooth(
+        smoothed[columns_to_smooth].to_numpy(dtype="float64"), method, window
     )
+    long_rows = gap_index.long_gap_rows(gaps, smoothed.index, max_gap_rows)
+    if long_rows is not None:
+        smoothed.loc[long_rows, columns_to_smooth] = np.nan
 
     after_nans = _count_nans(smoothed)
 
     result = smoothed.reset_index()
-    result.to_csv(output_path, index=False)
 
     first_ts = smoothed.index.min()
     last_ts = smoothed.index.max()
 
     print(f"--- {label} ---")
+    print(f"Method: {method}, window {window}")
     print(f"NaNs before smoothing: {before_nans}")
     print(f"NaNs after smoothing: {after_nans}")
     if first_ts is not None and last_ts is not None:
@@ -89,11 +102,76 @@ def process_dataset(label: str, input_path: Path, output_path: Path) -> None:
     else:
         print("Timestamp range preserved: unavailable")
     print()
+    return result
+
+
+@instrumentation.instrumented("smooth")
+def process_dataset(
+    label: str,
+    input_path: Path,
+    output_path: Path,
+    gaps_path: Path | None = None,
+    method: str = SMOOTHING_METHOD,
+    window: int = SMOOTHING_WINDOW,
+) -> None:
+    df = ingestion.load(input_path)
+    gaps = gap_index.load(gaps_path)
+    storage.save(process_frame(label, df, gaps, method, window), output_path)
+
+
+def compare_methods(input_path: Path, windows: tuple[int, ...] = COMPARE_WINDOWS) -> pd.DataFrame:
+    """Throughput of every method and of the streaming median per window."""
+    df = _coalesce_measurement_columns(ingestion.load(input_path))
+    columns = list(ingestion.resolve_columns(df.columns).values())
+    values = df[columns].to_numpy(dtype="float64")
+    runs = {
+        **{
+            method: lambda window, method=method: smoothing_filters.smooth(values, method, window)
+            for method in SMOOTHING_METHODS
+        },
+        "median (streaming)": lambda window: smoothing_filters.streaming_median(values, window),
+    }
+    rows = []
+    for window in windows:
+        reference = smoothing_filters.running_median(values, window)
+        for name, run in runs.items():
+            start = time.perf_counter()
+            result = run(window)
+            seconds = time.perf_counter() - start
+            row = {"method": name, "window": window, "seconds": round(seconds, 4)}
+            row["rows_per_second"] = round(len(values) / seconds) if seconds > 0 else None
+            if "median" in name:
+                row["same_as_median"] = bool(np.array_equal(result, reference, equal_nan=True))
+            rows.append(row)
+    return pd.DataFrame(rows)
 
 
 def main() -> None:
+    parser = argparse.ArgumentParser(description="Smooth the interpolated error columns.")
+    parser.add_argument("--method", choices=SMOOTHING_METHODS, default=SMOOTHING_METHOD)
+    parser.add_argument("--window", type=int, default=SMOOTHING_WINDOW)
+    parser.add_argument(
+        "--compare",
+        action="store_true",
+        help="only report the throughput of every method across window sizes, without writing",
+    )
+    args = parser.parse_args()
+
     for label, (input_path, output_path) in DATASETS.items():
-        process_dataset(label, input_path, output_path)
+        if args.compare:
+            print(f"--- {label} ---")
+            print(compare_methods(input_path).to_string(index=False))
+            print()
+            continue
+        process_dataset(
+            label,
+            input_path,
+            output_path,
+            resample_satellites.GAP_INDEXES[label],
+            args.method,
+            args.window,
+        )
+    instrumentation.print_summary()
 
 
 if __name__ == "__main__":
@@ -0,0 +1,297 @@
+from __future__ import annotations
+
+import heapq
+from collections import deque
+
+import numpy as np
+from numpy.lib.stride_tricks import sliding_window_view
+
+from lazy_imports import lazy_module
+
+pd = lazy_module("pandas")
+
+# Every filter takes a ``(rows, columns)`` array on an evenly spaced grid and
+# smooths all columns at once, over centred windows of ``window`` rows:
+# ``window // 2`` before a row and ``(window - 1) // 2`` after it, as pandas
+# centres them. The running medians are pandas' skiplist kernel, O(log w) per
+# value in compiled code; :class:`StreamingMedian` is the same median in plain
+# Python, for a live process fed one row at a time. The Hampel MAD needs every
+# window's deviations from its own median, so it sorts each window.
+
+# Scales the MAD to the standard deviation of normal data
+MAD_SCALE = 1.4826
+HAMPEL_THRESHOLD = 3  # scaled MADs from the window median before a value is replaced
+SAVGOL_POLYORDER = 2
+# Window values the Hampel MAD pass sorts at a time, to bound its memory on long series
+MAD_BLOCK_VALUES = 1 << 22
+
+
+def sorted_median(ordered: np.ndarray, count: np.ndarray) -> np.ndarray:
+    # NaNs sort last, so the values of every window are its first ``count`` entries
+    low = np.maximum((count - 1) // 2, 0)[..., None]
+    high = (count // 2)[..., None]
+    middle = np.take_along_axis(ordered, low, axis=-1) + np.take_along_axis(ordered, high, axis=-1)
+    return np.where(count > 0, middle[..., 0] / 2, np.nan)
+
+
+def _check_window(window: int) -> None:
+    if window < 1:
+        raise ValueError(f"The smoothing window needs at least 1 row, got {window}")
+
+
+def running_median(values: np.ndarray, window: int) -> np.ndarray:
+    """Centred running median ignoring NaNs.
+
+    ``rolling(window, center=True, min_periods=1).median()`` on every column:
+    rows near the ends see fewer values, and NaNs are left out.
+    """
+    _check_window(window)
+    frame = pd.DataFrame(np.asarray(values, dtype=np.float64))
+    return frame.rolling(window, center=True, min_periods=1).median().to_numpy()
+
+
+def hampel(values: np.ndarray, window: int, threshold: float = HAMPEL_THRESHOLD) -> np.ndarray:
+    """Replace values more than ``threshold`` scaled MADs from their centred window median.
+
+    The MAD of a row is the median absolute deviation of its window from
+    that window's median, with NaNs left out. Everything else, NaNs
+    included, is kept as is, so unlike the median filter the Hampel filter
+    only touches the spikes.
+    """
+    out = np.array(values, dtype=np.float64)
+    median = running_median(out, window)
+    mad = window_mad(out, median, window)
+    with np.errstate(invalid="ignore"):
+        spikes = np.abs(out - median) > threshold * MAD_SCALE * mad
+    return np.where(spikes, median, out)
+
+
+def window_mad(values: np.ndarray, median: np.ndarray, window: int) -> np.ndarray:
+    """Median of ``|x_j - median_i|`` over the centred window of every row ``i``.
+
+    ``median`` is the window median of every row, as from
+    :func:`running_median`. Windows are sorted ``MAD_BLOCK_VALUES`` values at
+    a time, so this costs O(w log w) per value.
+    """
+    rows, columns = values.shape
+    if not rows:
+        return np.empty(values.shape)
+    padded = np.pad(values, ((window // 2, (window - 1) // 2), (0, 0)), constant_values=np.nan)
+    # (rows, columns, window): the window of every row, NaN past the ends
+    windows = sliding_window_view(padded, window, axis=0)
+    mad = np.empty(values.shape)
+    step = max(MAD_BLOCK_VALUES // (columns * window), 1)
+    for start in range(0, rows, step):
+        deviations = np.abs(windows[start : start + step] - median[start : start + step, :, None])
+        count = np.count_nonzero(~np.isnan(deviations), axis=-1)
+        mad[start : start + step] = sorted_median(np.sort(deviations, axis=-1), count)
+    return mad
+
+
+def savgol_hat_matrix(window: int, polyorder: int) -> np.ndarray:
+    """``(window, window)`` matrix mapping a window to its least-squares polynomial fit.
+
+    Row ``window // 2`` holds the Savitzky-Golay coefficients of the centre
+    row; the other rows evaluate the same fit at the other positions, which is
+    how the first and last rows are smoothed (scipy's ``mode="interp"``).
+    """
+    positions = np.arange(window) - window // 2
+    design = np.vander(positions, polyorder + 1, increasing=True).astype(np.float64)
+    return design @ np.linalg.pinv(design)
+
+
+def savitzky_golay(
+    values: np.ndarray, window: int, polyorder: int = SAVGOL_POLYORDER
+) -> np.ndarray:
+    """Savitzky-Golay filter: each row is the centre of a local polynomial fit.
+
+    Keeps peaks and slopes that a median of the same width flattens. A NaN
+    makes every window it falls in NaN. Series shorter than the window are
+    fitted with one polynomial over all their rows.
+    """
+    _check_window(window)
+    if window % 2 == 0:
+        raise ValueError(f"The Savitzky-Golay window must be odd, got {window}")
+    if polyorder >= window:
+        raise ValueError(f"The polynomial order {polyorder} needs a window longer than {window}")
+    rows = len(values)
+    if rows < window:
+        if not rows:
+            return np.empty(values.shape)
+        return savgol_hat_matrix(rows, min(polyorder, rows - 1)) @ values
+
+    hat = savgol_hat_matrix(window, polyorder)
+    half = window // 2
+    out = np.empty(values.shape)
+    # One pass per window position over contiguous slices, as in the rolling kernel
+    interior = out[half : rows - half]
+    interior[:] = 0.0
+    for offset, coefficient in enumerate(hat[half]):
+        interior += coefficient * values[offset : rows - window + 1 + offset]
+    out[:half] = hat[:half] @ values[:window]
+    out[rows - half :] = hat[half + 1 :] @ values[rows - window :]
+    return out
+
+
+class _WindowMedian:
+    """Median of one column's window, with values entering and leaving in row order.
+
+    Two heaps split the window: ``low`` holds the smaller half (negated, as a
+    max-heap) and ``high`` the larger, so the median is read off their tops.
+    Entries are ``(value, row)`` pairs, which gives equal values a fixed order.
+    A leaving row is only marked and is dropped once it reaches the top of its
+    heap; a heap with more marked entries than live ones is rebuilt, so both
+    stay O(w) long and every insert or delete costs O(log w) amortised.
+    """
+
+    def __init__(self) -> None:
+        self.low: list[tuple[float, int]] = []  # (-value, -row)
+        self.high: list[tuple[float, int]] = []  # (value, row)
+        self.in_low: dict[int, bool] = {}
+        self.removed: set[int] = set()
+        self.low_size = 0
+        self.high_size = 0
+
+    def _prune(self) -> None:
+        while self.low and -self.low[0][1] in self.removed:
+            self.removed.discard(-heapq.heappop(self.low)[1])
+        while self.high and self.high[0][1] in self.removed:
+            self.removed.discard(heapq.heappop(self.high)[1])
+
+    def _compact(self) -> None:
+        if len(self.low) > 2 * self.low_size + 16:
+            self.removed.difference_update(-row for _, row in self.low if -row in self.removed)
+            self.low = [entry for entry in self.low if -entry[1] in self.in_low]
+            heapq.heapify(self.low)
+        if len(self.high) > 2 * self.high_size + 16:
+            self.removed.difference_update(row for _, row in self.high if row in self.removed)
+            self.high = [entry for entry in self.high if entry[1] in self.in_low]
+            heapq.heapify(self.high)
+
+    def _rebalance(self) -> None:
+        # The tops are live here, so moving one moves a value still in the window
+        while self.low_size > self.high_size + 1:
+            value, row = heapq.heappop(self.low)
+            heapq.heappush(self.high, (-value, -row))
+            self.in_low[-row] = False
+            self.low_size -= 1
+            self.high_size += 1
+            self._prune()
+        while self.high_size > self.low_size:
+            value, row = heapq.heappop(self.high)
+            heapq.heappush(self.low, (-value, -row))
+            self.in_low[row] = True
+            self.high_size -= 1
+            self.low_size += 1
+            self._prune()
+
+    def add(self, value: float, row: int) -> None:
+        if self.low_size and (-value, -row) >= self.low[0]:
+            heapq.heappush(self.low, (-value, -row))
+            self.in_low[row] = True
+            self.low_size += 1
+        else:
+            heapq.heappush(self.high, (value, row))
+            self.in_low[row] = False
+            self.high_size += 1
+        self._rebalance()
+
+    def remove(self, row: int) -> None:
+        if self.in_low.pop(row):
+            self.low_size -= 1
+        else:
+            self.high_size -= 1
+        self.removed.add(row)
+        self._prune()
+        self._rebalance()
+        self._compact()
+
+    def median(self) -> float:
+        if not self.low_size:
+            return np.nan
+        if self.low_size > self.high_size:
+            return -self.low[0][0]
+        return (-self.low[0][0] + self.high[0][0]) / 2
+
+
+class StreamingMedian:
+    """The centred running median, fed rows as they arrive.
+
+    Every column keeps its window in a :class:`_WindowMedian`, so a new row
+    and the row leaving the window each cost O(log w) per column, amortised.
+    Each value still goes through Python, so a whole series is faster through
+    :func:`running_median`; this class is for a process fed rows as they
+    come, without pandas. A row's median is final once the ``(window - 1) // 2``
+    rows after it have arrived, so :meth:`update` returns the rows completed by
+    a batch and :meth:`flush` the last ones. Together they equal
+    :func:`running_median` over the whole series.
+    """
+
+    def __init__(self, columns: int, window: int) -> None:
+        _check_window(window)
+        self.window = window
+        self.behind = window // 2
+        self.ahead = (window - 1) // 2
+        self.raw: deque[np.ndarray] = deque()
+        self.windows = [_WindowMedian() for _ in range(columns)]
+        self.rows_in = 0
+        self.rows_out = 0
+
+    def _drop_before(self, row: int) -> None:
+        while self.raw and self.rows_in - len(self.raw) < row:
+            leaving = self.rows_in - len(self.raw)
+            for window, value in zip(self.windows, self.raw.popleft().tolist()):
+                if value == value:
+                    window.remove(leaving)
+
+    def _emit(self, row: int) -> list[float]:
+        self._drop_before(row - self.behind)
+        return [window.median() for window in self.windows]
+
+    def update(self, values: np.ndarray) -> np.ndarray:
+        """Medians of the rows completed by the next ``(rows, columns)`` batch."""
+        out = []
+        for row in np.asarray(values, dtype=np.float64):
+            self.raw.append(row)
+            for window, value in zip(self.windows, row.tolist()):
+                # NaN != NaN: missing values never enter a window
+                if value == value:
+                    window.add(value, self.rows_in)
+            self.rows_in += 1
+            if self.rows_in - 1 - self.ahead >= self.rows_out:
+                out.append(self._emit(self.rows_out))
+                self.rows_out += 1
+        return np.array(out, dtype=np.float64).reshape(len(out), len(self.windows))
+
+    def flush(self) -> np.ndarray:
+        """Medians of the rows still waiting for later rows, at the end of the series."""
+        out = []
+        while self.rows_out < self.rows_in:
+            out.append(self._emit(self.rows_out))
+            self.rows_out += 1
+        return np.array(out, dtype=np.float64).reshape(len(out), len(self.windows))
+
+
+def streaming_median(values: np.ndarray, window: int, batch_rows: int = 4_096) -> np.ndarray:
+    """:class:`StreamingMedian` over a whole array, ``batch_rows`` rows at a time."""
+    stream = StreamingMedian(values.shape[1], window)
+    parts = [
+        stream.update(values[start : start + batch_rows])
+        for start in range(0, len(values), batch_rows)
+    ]
+    return np.concatenate([*parts, stream.flush()])
+
+
+SMOOTHERS = {
+    "median": running_median,
+    "savgol": savitzky_golay,
+    "hampel": hampel,
+}
+
+
+def smooth(values: np.ndarray, method: str, window: int) -> np.ndarray:
+    if method not in SMOOTHERS:
+        raise ValueError(
+            f"Unknown smoothing method '{method}', expected one of: {', '.join(SMOOTHERS)}"
+        )
+    return SMOOTHERS[method](np.asarray(values, dtype=np.float64), window)
@@ -0,0 +1,418 @@
+from __future__ import annotations
+
+import argparse
+import contextlib
+import hashlib
+import importlib
+import io
+import json
+import os
+import time
+from concurrent.futures import FIRST_COMPLETED, ProcessPoolExecutor, wait
+from pathlib import Path
+from typing import NamedTuple
+
+import add_ewm_features
+import add_interaction_features
+import add_lag_features
+import add_rolling_features
+import add_time_features
+import adf_monitor
+import adf_tests
+import feature_kernel
+import gap_index
+import interpolate_timeseries
+import merge_meo
+import resample_satellites
+import scale_smoothed
+import smooth_timeseries
+import storage
+import zscore_outliers
+
+BASE_DIR = Path(__file__).resolve().parent
+CACHE_MANIFEST = BASE_DIR / ".stage_cache.json"
+HASH_CHUNK_BYTES = 1 << 20
+
+
+class Stage(NamedTuple):
+    """One node of the stage DAG.
+
+    ``module.function(*args)`` produces ``outputs`` from ``inputs``; the edges
+    of the graph follow from which stage writes each input. ``params`` are the
+    settings that change the output and ``code`` the modules whose source does.
+    """
+
+    name: str
+    module: str
+    function: str
+    args: tuple
+    inputs: tuple[Path, ...]
+    outputs: tuple[Path, ...]
+    params: dict
+    code: tuple[str, ...]
+
+
+def _two_path_stage(
+    name: str, module, label: str, params: dict, code: tuple[str, ...] = ()
+) -> Stage:
+    input_path, output_path = module.DATASETS[label]
+    return Stage(
+        f"{label}:{name}",
+        module.__name__,
+        "process_dataset",
+        (label, input_path, output_path),
+        (input_path,),
+        (output_path,),
+        params,
+        (module.__name__, "ingestion", *code),
+    )
+
+
+def _gap_stage(
+    name: str, module, label: str, params: dict, code: tuple[str, ...] = ()
+) -> Stage:
+    """A two-path stage that also reads the gap index of the resampled file."""
+    stage = _two_path_stage(name, module, label, params, ("gap_index", *code))
+    gaps_path = resample_satellites.GAP_INDEXES[label]
+    return stage._replace(
+        args=(*stage.args, gaps_path),
+        inputs=(*stage.inputs, gaps_path),
+        params={**params, "max_gap_rows": gap_index.max_gap_rows()},
+    )
+
+
+def build_stages(labels: list[str] | None = None) -> list[Stage]:
+    """Declare every stage of the MEO and GEO pipelines, with their parameters."""
+    feature_dtype = feature_kernel.feature_dtype().name
+    stages = [
+        Stage(
+            "MEO:merge",
+            "merge_meo",
+            "merge_files",
+            ("MEO", merge_meo.SOURCE_FILES, merge_meo.OUTPUT_PATH),
+            tuple(merge_meo.SOURCE_FILES),
+            (merge_meo.OUTPUT_PATH,),
+            {},
+            ("merge_meo", "ingestion"),
+        )
+    ]
+    for label in resample_satellites.DATASETS:
+        raw_path, resampled_path = resample_satellites.DATASETS[label]
+        _, scaled_path, scaler_path = scale_smoothed.DATASETS[label]
+        interaction_paths = add_interaction_features.DATASETS[label]
+        stages += [
+            Stage(
+                f"{label}:resample",
+                "resample_satellites",
+                "process_dataset",
+                (raw_path, resampled_path, label),
+                (raw_path,),
+                (resampled_path, resample_satellites.GAP_INDEXES[label]),
+                {"rule": resample_satellites.RESAMPLE_RULE},
+                ("resample_satellites", "ingestion", "gap_index"),
+            ),
+            _two_path_stage(
+                "zscore",
+                zscore_outliers,
+                label,
+                {
+                    "threshold": zscore_outliers.ZSCORE_THRESHOLD,
+                    "mode": zscore_outliers.OUTLIER_MODE,
+                    "window": zscore_outliers.ROBUST_WINDOW,
+                },
+                ("smoothing_filters",),
+            ),
+            _gap_stage("interpolate", interpolate_timeseries, label, {"method": "time"}),
+            _gap_stage(
+                "smooth",
+                smooth_timeseries,
+                label,
+                {
+                    "method": smooth_timeseries.SMOOTHING_METHOD,
+                    "window": smooth_timeseries.SMOOTHING_WINDOW,
+                },
+                ("smoothing_filters",),
+            ),
+            _two_path_stage(
+                "adf",
+                adf_tests,
+                label,
+                {
+                    "autolag": adf_tests.ADF_AUTOLAG,
+                    "significance": adf_tests.SIGNIFICANCE_LEVEL,
+                },
+            ),
+            _two_path_stage(
+                "adf_monitor",
+                adf_monitor,
+                label,
+                {"window": adf_monitor.WINDOW_ROWS, "stride": adf_monitor.STRIDE_ROWS},
+                ("adf_tests",),
+            ),
+            Stage(
+                f"{label}:scale",
+                "scale_smoothed",
+                "process_dataset",
+                (label, *scale_smoothed.DATASETS[label]),
+                (scale_smoothed.DATASETS[label][0],),
+                (scaled_path, scaler_path, scale_smoothed.PICKLE_PATHS[label]),
+                {
+                    "scaler": "standard",
+                    "format": scaler_path.suffix,
+                    "chunk_rows": scale_smoothed.CHUNK_ROWS,
+                },
+                ("scale_smoothed", "standard_scaler", "ingestion"),
+            ),
+            _two_path_stage(
+                "time_features",
+                add_time_features,
+                label,
+                {
+                    "features": add_time_features.NEW_FEATURES,
+                    "harmonics": add_time_features.harmonics_for(label),
+                    "dtype": feature_dtype,
+                },
+                ("feature_kernel",),
+            ),
+            _gap_stage(
+                "lag_features",
+                add_lag_features,
+                label,
+                {"steps": add_lag_features.LAG_STEPS, "dtype": feature_dtype},
+                ("feature_kernel",),
+            ),
+            _gap_stage(
+                "rolling_features",
+                add_rolling_features,
+                label,
+                {"windows": add_rolling_features.ROLLING_WINDOWS, "dtype": feature_dtype},
+                ("feature_kernel",),
+            ),
+            _two_path_stage(
+                "ewm_features",
+                add_ewm_features,
+                label,
+                {"spans": add_ewm_features.EWM_SPANS, "dtype": feature_dtype},
+                ("feature_kernel",),
+            ),
+            Stage(
+                f"{label}:interaction_features",
+                "add_interaction_features",
+                "process_dataset",
+                (label, *interaction_paths, add_interaction_features.FEATURE_STORES[label]),
+                interaction_paths[:1],
+                (interaction_paths[1], add_interaction_features.FEATURE_STORES[label]),
+                {"eps": add_interaction_features.EPS, "dtype": feature_dtype},
+                ("add_interaction_features", "ingestion", "feature_kernel", "feature_store"),
+            ),
+        ]
+    if labels is not None:
+        stages = [stage for stage in stages if stage.name.split(":")[0] in labels]
+    return stages
+
+
+def stage_dependencies(stages: list[Stage]) -> dict[str, set[str]]:
+    """Map every stage to the stages that write its inputs."""
+    producers = {output: stage.name for stage in stages for output in stage.outputs}
+    return {
+        stage.name: {producers[path] for path in stage.inputs if path in producers}
+        for stage in stages
+    }
+
+
+def _physical_path(path: Path) -> Path:
+    # Raw and merged CSVs live next to the scripts; stage files follow the storage format
+    if path.suffix == ".csv" and path.parent != BASE_DIR:
+        return storage.resolve_path(path)
+    return path
+
+
+def _hash_file(digest: "hashlib._Hash", path: Path) -> None:
+    with open(path, "rb") as handle:
+        while chunk := handle.read(HASH_CHUNK_BYTES):
+            digest.update(chunk)
+
+
+def _hash_path(digest: "hashlib._Hash", path: Path) -> None:
+    if path.is_dir():
+        for child in sorted(path.rglob("*")):
+            if child.is_file():
+                digest.update(str(child.relative_to(path)).encode())
+                _hash_file(digest, child)
+    else:
+        _hash_file(digest, path)
+
+
+def stage_key(stage: Stage) -> str:
+    """Hash the stage's input data, parameters and source code."""
+    digest = hashlib.sha256()
+    digest.update(stage.name.encode())
+    digest.update(json.dumps(stage.params, sort_keys=True).encode())
+    for module_name in stage.code:
+        _hash_file(digest, BASE_DIR / f"{module_name}.py")
+    for path in stage.inputs:
+        _hash_path(digest, _physical_path(path))
+    return digest.hexdigest()
+
+
+def load_cache(path: Path = CACHE_MANIFEST) -> dict[str, str]:
+    if not path.exists():
+        return {}
+    return json.loads(path.read_text())
+
+
+def save_cache(cache: dict[str, str], path: Path = CACHE_MANIFEST) -> None:
+    tmp_path = path.with_suffix(".tmp")
+    tmp_path.write_text(json.dumps(cache, indent=2, sort_keys=True) + "\n")
+    os.replace(tmp_path, path)
+
+
+def _cache_entry(stage: Stage) -> str:
+    # Keyed by the physical output so switching storage format does not reuse stale files
+    return str(_physical_path(stage.outputs[0]).relative_to(BASE_DIR))
+
+
+def is_fresh(stage: Stage, key: str, cache: dict[str, str]) -> bool:
+    outputs_exist = all(_physical_path(path).exists() for path in stage.outputs)
+    return outputs_exist and cache.get(_cache_entry(stage)) == key
+
+
+def _run_stage(module_name: str, function_name: str, args: tuple) -> tuple[str, float]:
+    module = importlib.import_module(module_name)
+    buffer = io.StringIO()
+    start = time.perf_counter()
+    with contextlib.redirect_stdout(buffer):
+        getattr(module, function_name)(*args)
+    return buffer.getvalue(), time.perf_counter() - start
+
+
+def run_dag(stages: list[Stage], workers: int, force: bool = False) -> dict[str, str]:
+    """Run the stale stages, each as soon as its inputs are ready.
+
+    A stage is fresh when its outputs exist and the manifest holds the key of
+    its current inputs and parameters. Independent branches (ADF tests, scaling
+    and the feature chain, and MEO next to GEO) run in parallel worker
+    processes. Returns the status of every stage.
+    """
+    for path in (scale_smoothed.SCALER_DIR, add_time_features.FEATURE_ENGINEERING_DIR):
+        path.mkdir(parents=True, exist_ok=True)
+    by_name = {stage.name: stage for stage in stages}
+    dependencies = stage_dependencies(stages)
+    cache = load_cache()
+    status: dict[str, str] = {}
+    keys: dict[str, str] = {}
+
+    with ProcessPoolExecutor(max_workers=workers) as executor:
+        running = {}
+        while len(status) < len(stages):
+            settled = len(status)
+            ready = [
+                name
+                for name in by_name
+                if name not in status
+                and name not in running.values()
+                and all(status.get(dep) in ("cached", "ran") for dep in dependencies[name])
+            ]
+            for name in list(by_name):
+                if name not in status and any(
+                    status.get(dep) in ("failed", "blocked") for dep in dependencies[name]
+                ):
+                    status[name] = "blocked"
+                    print(f"{name:<28} blocked (an upstream stage failed)")
+            for name in ready:
+                stage = by_name[name]
+                keys[name] = stage_key(stage)
+                if not force and is_fresh(stage, keys[name], cache):
+                    status[name] = "cached"
+                    print(f"{name:<28} up to date")
+                    continue
+                future = executor.submit(_run_stage, stage.module, stage.function, stage.args)
+                running[future] = name
+            if not running and len(status) == settled:
+                raise RuntimeError("Stage graph has a cycle")
+            if len(status) != settled:
+                # Skipped stages may have unblocked others; look again before waiting
+                continue
+
+            done, _ = wait(running, return_when=FIRST_COMPLETED)
+            for future in done:
+                name = running.pop(future)
+                try:
+                    output, elapsed = future.result()
+                except Exception as exc:
+                    status[name] = "failed"
+                    print(f"{name:<28} FAILED: {type(exc).__name__}: {exc}")
+                    continue
+                status[name] = "ran"
+                cache[_cache_entry(by_name[name])] = keys[name]
+                save_cache(cache)
+                print(f"{name:<28} ran in {elapsed:.2f} s")
+                if output.strip():
+                    print(output.rstrip())
+    return status
+
+
+def plan(stages: list[Stage], force: bool = False) -> dict[str, str]:
+    """Report which stages would run, without running anything."""
+    dependencies = stage_dependencies(stages)
+    cache = load_cache()
+    status: dict[str, str] = {}
+    for stage in stages:  # declared in dependency order
+        if force or any(status[dep] != "fresh" for dep in dependencies[stage.name]):
+            status[stage.name] = "stale"
+        elif not all(_physical_path(path).exists() for path in stage.inputs):
+            status[stage.name] = "missing input"
+        else:
+            status[stage.name] = "fresh" if is_fresh(stage, stage_key(stage), cache) else "stale"
+        print(f"{stage.name:<28} {status[stage.name]}")
+    return status
+
+
+def run_and_report(stages: list[Stage], workers: int, force: bool = False) -> None:
+    """Run the DAG, print the totals and exit with status 1 if a stage failed or was blocked."""
+    start = time.perf_counter()
+    status = run_dag(stages, workers, force)
+    counts = {
+        state: list(status.values()).count(state)
+        for state in ("ran", "cached", "failed", "blocked")
+    }
+    print(
+        f"\nStages ran: {counts['ran']}, up to date: {counts['cached']}, "
+        f"failed: {counts['failed']}, blocked: {counts['blocked']} "
+        f"({time.perf_counter() - start:.1f} s)"
+    )
+    if counts["failed"] or counts["blocked"]:
+        raise SystemExit(1)
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(
+        description="Rerun only the pipeline stages whose inputs or parameters changed."
+    )
+    parser.add_argument(
+        "--dataset",
+        action="append",
+        choices=sorted(resample_satellites.DATASETS),
+        help="limit to one dataset (repeatable; default: all)",
+    )
+    parser.add_argument(
+        "--workers",
+        type=int,
+        default=os.cpu_count(),
+        help="worker processes for independent stages (default: CPU count)",
+    )
+    parser.add_argument("--force", action="store_true", help="rerun every stage")
+    parser.add_argument(
+        "--dry-run", action="store_true", help="only list which stages are stale"
+    )
+    args = parser.parse_args()
+
+    stages = build_stages(args.dataset)
+    if args.dry_run:
+        plan(stages, args.force)
+        return
+    run_and_report(stages, args.workers, args.force)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,148 @@
+from __future__ import annotations
+
+import json
+from pathlib import Path
+
+import numpy as np
+
+# Only numpy and the standard library: a serving process loads fitted parameters
+# and scales rows without importing pandas or sklearn.
+PARAMS_VERSION = 1
+
+
+def _is_constant(var: np.ndarray, mean: np.ndarray, count: np.ndarray) -> np.ndarray:
+    # sklearn's test for features whose variance is rounding noise (scale set to 1)
+    eps = np.finfo(np.float64).eps
+    return var <= count * eps * var + (count * mean * eps) ** 2
+
+
+class StreamingScaler:
+    """``StandardScaler`` fitted chunk by chunk, ignoring NaNs.
+
+    Keeps the per-column count, mean and variance and updates them with the
+    same floating-point steps as ``StandardScaler.partial_fit``, so one chunk
+    gives exactly the parameters of ``fit`` and several give those of
+    ``partial_fit`` on the same chunks. Scalers fitted separately (one per
+    satellite, or per worker) combine with :meth:`merge`.
+    """
+
+    def __init__(self, columns: list[str]) -> None:
+        self.columns = list(columns)
+        self.count = np.zeros(len(self.columns))
+        self.mean = np.zeros(len(self.columns))
+        self.var = np.zeros(len(self.columns))
+
+    def _update(self, count: np.ndarray, total: np.ndarray, unnormalized_var: np.ndarray) -> None:
+        last_count = self.count
+        updated_count = last_count + count
+        last_sum = self.mean * last_count
+        with np.errstate(divide="ignore", invalid="ignore"):
+            mean = (last_sum + total) / updated_count
+            last_over_new = last_count / count
+            updated_var = (
+                self.var * last_count
+                + unnormalized_var
+                + last_over_new / updated_count * (last_sum / last_over_new - total) ** 2
+            )
+        first = last_count == 0
+        updated_var[first] = unnormalized_var[first]
+        with np.errstate(divide="ignore", invalid="ignore"):
+            var = updated_var / updated_count
+        # Columns with no values in this chunk keep their state
+        unchanged = count == 0
+        self.count = updated_count
+        self.mean = np.where(unchanged, self.mean, mean)
+        self.var = np.where(unchanged, self.var, var)
+
+    def partial_fit(self, values: np.ndarray) -> StreamingScaler:
+        """Add a ``(rows, columns)`` chunk to the fit."""
+        values = np.asarray(values, dtype=np.float64)
+        missing = np.isnan(values)
+        count = values.shape[0] - missing.sum(axis=0).astype(np.float64)
+        total = np.nansum(values, axis=0)
+        with np.errstate(divide="ignore", invalid="ignore"):
+            deviations = values - total / count
+        # Corrected two-pass variance (Chan, Golub and LeVeque), as sklearn computes it
+        correction = np.nansum(deviations, axis=0)
+        unnormalized_var = np.nansum(deviations**2, axis=0) - correction**2 / np.maximum(count, 1)
+        self._update(count, total, unnormalized_var)
+        return self
+
+    def merge(self, other: StreamingScaler) -> StreamingScaler:
+        """Fold in a scaler fitted on other rows of the same columns."""
+        if other.columns != self.columns:
+            raise ValueError(f"Cannot merge scalers of different columns: {other.columns}")
+        self._update(other.count, other.mean * other.count, other.var * other.count)
+        return self
+
+    def std(self, ddof: int = 0) -> np.ndarray:
+        with np.errstate(divide="ignore", invalid="ignore"):
+            return np.sqrt(self.var * self.count / (self.count - ddof))
+
+    def params(self) -> ScalerParams:
+        scale = np.sqrt(self.var)
+        scale[_is_constant(self.var, self.mean, self.count)] = 1.0
+        return ScalerParams(self.columns, self.mean.copy(), scale, self.count.copy())
+
+
+class ScalerParams:
+    """Fitted standard-scaler parameters: ``(x - mean) / scale`` per column."""
+
+    def __init__(
+        self,
+        columns: list[str],
+        mean: np.ndarray,
+        scale: np.ndarray,
+        count: np.ndarray | None = None,
+    ) -> None:
+        self.columns = list(columns)
+        self.mean = np.asarray(mean, dtype=np.float64)
+        self.scale = np.asarray(scale, dtype=np.float64)
+        self.count = None if count is None else np.asarray(count, dtype=np.float64)
+
+    def transform(self, values: np.ndarray) -> np.ndarray:
+        """Scale a ``(rows, columns)`` array (or one row) in the order of ``columns``."""
+        return (np.asarray(values, dtype=np.float64) - self.mean) / self.scale
+
+    def inverse_transform(self, values: np.ndarray) -> np.ndarray:
+        return np.asarray(values, dtype=np.float64) * self.scale + self.mean
+
+    def to_dict(self) -> dict[str, object]:
+        params: dict[str, object] = {
+            "version": PARAMS_VERSION,
+            "columns": self.columns,
+            "mean": self.mean.tolist(),
+            "scale": self.scale.tolist(),
+        }
+        if self.count is not None:
+            params["count"] = self.count.tolist()
+        return params
+
+    def save(self, path: Path) -> Path:
+        """Write the parameters as JSON, or as a NumPy ``.npz`` archive for that suffix.
+
+        JSON keeps every float exactly (``repr`` round-trips), so both formats
+        load back bit for bit.
+        """
+        path = Path(path)
+        path.parent.mkdir(parents=True, exist_ok=True)
+        if path.suffix == ".npz":
+            arrays = {"columns": np.array(self.columns), "mean": self.mean, "scale": self.scale}
+            if self.count is not None:
+                arrays["count"] = self.count
+            np.savez(path, **arrays)
+        else:
+            path.write_text(json.dumps(self.to_dict(), indent=2) + "\n")
+        return path
+
+    @classmethod
+    def load(cls, path: Path) -> ScalerParams:
+        path = Path(path)
+        if path.suffix == ".npz":
+            with np.load(path) as arrays:
+                count = arrays["count"] if "count" in arrays else None
+                return cls(arrays["columns"].tolist(), arrays["mean"], arrays["scale"], count)
+        params = json.loads(path.read_text())
+        if params.get("version", PARAMS_VERSION) > PARAMS_VERSION:
+            raise ValueError(f"{path} was written by a newer version (format {params['version']})")
+        return cls(params["columns"], params["mean"], params["scale"], params.get("count"))
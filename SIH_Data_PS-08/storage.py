@@ -0,0 +1,429 @@
+from __future__ import annotations
+
+import argparse
+import importlib.util
+import io
+import json
+import os
+import time
+from pathlib import Path
+from typing import Iterator
+
+import numpy as np
+
+import instrumentation
+from lazy_imports import lazy_module
+
+pd = lazy_module("pandas")
+
+# Storage format used for the files in 15min_resampled/ and feature_engineering_data/.
+# Stage scripts keep naming their files "*.csv"; the suffix is swapped for the chosen format.
+STORAGE_FORMAT_ENV = "SIH_STORAGE_FORMAT"
+DEFAULT_FORMAT = "csv"
+FORMAT_SUFFIXES = {
+    "csv": ".csv",
+    "parquet": ".parquet",
+    "feather": ".feather",
+    "npy": ".npyframe",
+}
+SUFFIX_FORMATS = {suffix: fmt for fmt, suffix in FORMAT_SUFFIXES.items()}
+TIME_COLUMN = "utc_time"
+MANIFEST_NAME = "manifest.json"
+
+
+def storage_format(fmt: str | None = None) -> str:
+    fmt = fmt or os.environ.get(STORAGE_FORMAT_ENV, DEFAULT_FORMAT)
+    fmt = fmt.lower()
+    if fmt not in FORMAT_SUFFIXES:
+        raise ValueError(
+            f"Unknown storage format '{fmt}', expected one of: {', '.join(FORMAT_SUFFIXES)}"
+        )
+    return fmt
+
+
+def resolve_path(path: Path, fmt: str | None = None) -> Path:
+    """Return ``path`` with the suffix of the selected storage format."""
+    return path.with_suffix(FORMAT_SUFFIXES[storage_format(fmt)])
+
+
+def _format_of(path: Path) -> str:
+    try:
+        return SUFFIX_FORMATS[path.suffix]
+    except KeyError:
+        raise ValueError(f"Cannot infer storage format from '{path.name}'") from None
+
+
+def _require_pyarrow(fmt: str) -> None:
+    if importlib.util.find_spec("pyarrow") is None:
+        raise ImportError(f"The '{fmt}' storage format requires pyarrow")
+
+
+def _with_parsed_time(df: pd.DataFrame) -> pd.DataFrame:
+    if TIME_COLUMN in df.columns and not pd.api.types.is_datetime64_any_dtype(df[TIME_COLUMN]):
+        df = df.assign(**{TIME_COLUMN: pd.to_datetime(df[TIME_COLUMN], errors="coerce")})
+    return df
+
+
+def _write_npy(df: pd.DataFrame, path: Path) -> None:
+    # Columns are grouped into one 2D block per dtype so a wide feature frame is a
+    # handful of np.load calls; the manifest records where every column lives.
+    path.mkdir(parents=True, exist_ok=True)
+    for stale in path.glob("*.npy"):
+        stale.unlink()
+
+    blocks: dict[str, list[str]] = {}
+    columns = []
+    for column in df.columns:
+        series = df[column]
+        if pd.api.types.is_datetime64_any_dtype(series):
+            kind = "datetime64[ns]"
+        elif pd.api.types.is_numeric_dtype(series) or pd.api.types.is_bool_dtype(series):
+            kind = str(series.dtype)
+        else:
+            kind = "str"
+        members = blocks.setdefault(kind, [])
+        columns.append({"name": column, "dtype": kind, "block": kind, "index": len(members)})
+        members.append(column)
+
+    for kind, members in blocks.items():
+        if kind == "datetime64[ns]":
+            # Stored as int64 epoch nanoseconds; NaT keeps pandas' int64 minimum sentinel.
+            values = np.column_stack(
+                [df[column].to_numpy(dtype="datetime64[ns]").view("int64") for column in members]
+            )
+        elif kind == "str":
+            values = np.column_stack([df[column].astype(str).to_numpy(dtype=str) for column in members])
+        else:
+            values = df[members].to_numpy(dtype=kind)
+        np.save(path / f"{kind}.npy", values, allow_pickle=False)
+
+    manifest = {"rows": len(df), "columns": columns}
+    (path / MANIFEST_NAME).write_text(json.dumps(manifest, indent=2))
+
+
+def _read_npy(path: Path, columns: list[str] | None = None) -> pd.DataFrame:
+    manifest = json.loads((path / MANIFEST_NAME).read_text())
+    entries = manifest["columns"]
+    if columns is not None:
+        wanted = set(columns)
+        entries = [entry for entry in entries if entry["name"] in wanted]
+
+    blocks: dict[str, np.ndarray] = {}
+    for entry in entries:
+        if entry["block"] not in blocks:
+            blocks[entry["block"]] = np.load(path / f"{entry['block']}.npy", allow_pickle=False)
+
+    frames = []
+    for kind, values in blocks.items():
+        members = [entry for entry in entries if entry["block"] == kind]
+        block = values[:, [entry["index"] for entry in members]]
+        if kind == "datetime64[ns]":
+            block = block.view("datetime64[ns]")
+        frames.append(pd.DataFrame(block, columns=[entry["name"] for entry in members]))
+    if not frames:
+        return pd.DataFrame(index=range(manifest["rows"]))
+    return pd.concat(frames, axis=1)[[entry["name"] for entry in entries]]
+
+
+def read_frame(
+    path: Path, columns: list[str] | None = None, dtype: dict[str, str] | None = None
+) -> pd.DataFrame:
+    """Read a stage file written by :func:`write_frame` (or a plain CSV).
+
+    ``dtype`` only applies to CSV; the binary formats store their column types.
+    """
+    fmt = _format_of(path)
+    if fmt == "csv":
+        return pd.read_csv(path, usecols=columns, dtype=dtype)
+    if fmt == "npy":
+        return _read_npy(path, columns)
+    _require_pyarrow(fmt)
+    if fmt == "parquet":
+        return pd.read_parquet(path, columns=columns)
+    return pd.read_feather(path, columns=columns)
+
+
+def write_frame(df: pd.DataFrame, path: Path) -> None:
+    fmt = _format_of(path)
+    path.parent.mkdir(parents=True, exist_ok=True)
+    if fmt == "csv":
+        df.to_csv(path, index=False)
+        return
+
+    df = _with_parsed_time(df)
+    if fmt == "npy":
+        _write_npy(df, path)
+    else:
+        _require_pyarrow(fmt)
+        if fmt == "parquet":
+            df.to_parquet(path, index=False)
+        else:
+            df.reset_index(drop=True).to_feather(path)
+
+
+def load(
+    path: Path,
+    fmt: str | None = None,
+    columns: list[str] | None = None,
+    dtype: dict[str, str] | None = None,
+) -> pd.DataFrame:
+    """Read the stage file behind the logical ``*.csv`` path in the selected format."""
+    resolved = resolve_path(path, fmt)
+    df = read_frame(resolved, columns, dtype)
+    instrumentation.record_read(df, resolved)
+    return df
+
+
+def save(df: pd.DataFrame, path: Path, fmt: str | None = None) -> Path:
+    """Write ``df`` to the logical ``*.csv`` path in the selected format."""
+    resolved = resolve_path(path, fmt)
+    write_frame(df, resolved)
+    instrumentation.record_write(df, resolved)
+    return resolved
+
+
+def convert(path: Path, fmt: str) -> Path:
+    """Rewrite an existing stage file in another storage format."""
+    return save(read_frame(path), path, fmt)
+
+
+def _read_csv_tail(path: Path, rows: int, columns: list[str] | None) -> pd.DataFrame:
+    # Scan backwards from the end of the file so only the last ``rows`` lines are parsed.
+    with open(path, "rb") as fp:
+        header = fp.readline()
+        body_start = fp.tell()
+        end = fp.seek(0, io.SEEK_END)
+        position = end
+        chunk = b""
+        while position > body_start and chunk.count(b"\n") <= rows:
+            step = min(1 << 16, position - body_start)
+            position -= step
+            fp.seek(position)
+            chunk = fp.read(step) + chunk
+    lines = chunk.splitlines(keepends=True)
+    if position > body_start:
+        lines = lines[1:]
+    lines = lines[-rows:] if rows else []
+    return pd.read_csv(io.BytesIO(header + b"".join(lines)), usecols=columns)
+
+
+def _read_npy_rows(
+    path: Path, rows: slice | None, columns: list[str] | None, time_after: int | None = None
+) -> pd.DataFrame:
+    manifest = json.loads((path / MANIFEST_NAME).read_text())
+    entries = manifest["columns"]
+    if columns is not None:
+        wanted = set(columns)
+        entries = [entry for entry in entries if entry["name"] in wanted]
+
+    blocks = {
+        kind: np.load(path / f"{kind}.npy", mmap_mode="r", allow_pickle=False)
+        for kind in {entry["block"] for entry in manifest["columns"]}
+    }
+    if time_after is not None:
+        time_entry = next(entry for entry in manifest["columns"] if entry["name"] == TIME_COLUMN)
+        times = blocks[time_entry["block"]][:, time_entry["index"]]
+        rows = slice(int(np.searchsorted(times, time_after, side="right")), None)
+
+    frames = []
+    for kind in dict.fromkeys(entry["block"] for entry in entries):
+        members = [entry for entry in entries if entry["block"] == kind]
+        block = np.asarray(blocks[kind][rows])[:, [entry["index"] for entry in members]]
+        if kind == "datetime64[ns]":
+            block = block.view("datetime64[ns]")
+        frames.append(pd.DataFrame(block, columns=[entry["name"] for entry in members]))
+    if not frames:
+        return pd.DataFrame()
+    return pd.concat(frames, axis=1)[[entry["name"] for entry in entries]]
+
+
+def tail(
+    path: Path, rows: int, fmt: str | None = None, columns: list[str] | None = None
+) -> pd.DataFrame:
+    """Read only the last ``rows`` rows of a stage file."""
+    resolved = resolve_path(path, fmt)
+    fmt = _format_of(resolved)
+    if fmt == "csv":
+        return _read_csv_tail(resolved, rows, columns)
+    if fmt == "npy":
+        return _read_npy_rows(resolved, slice(-rows, None) if rows else slice(0, 0), columns)
+    return read_frame(resolved, columns).tail(rows).reset_index(drop=True)
+
+
+def read_after(
+    path: Path, timestamp: pd.Timestamp, fmt: str | None = None, columns: list[str] | None = None
+) -> pd.DataFrame:
+    """Read the rows of a time-sorted stage file whose ``utc_time`` is after ``timestamp``."""
+    resolved = resolve_path(path, fmt)
+    fmt = _format_of(resolved)
+    if fmt == "npy":
+        frame = _read_npy_rows(resolved, None, columns, time_after=timestamp.value)
+        instrumentation.record_read(frame)
+        return frame
+    if fmt == "csv":
+        # Widen the tail until it reaches back to ``timestamp`` (or covers the file).
+        rows = 1024
+        while True:
+            frame = _read_csv_tail(resolved, rows, columns)
+            times = pd.to_datetime(frame[TIME_COLUMN], errors="coerce")
+            if len(frame) < rows or (times <= timestamp).any():
+                break
+            rows *= 4
+    else:
+        frame = read_frame(resolved, columns)
+        times = pd.to_datetime(frame[TIME_COLUMN], errors="coerce")
+    frame = frame[(times > timestamp).to_numpy()].reset_index(drop=True)
+    instrumentation.record_read(frame)
+    return frame
+
+
+def iter_chunks(
+    path: Path, chunk_rows: int, fmt: str | None = None, dtype: dict[str, str] | None = None
+) -> Iterator[pd.DataFrame]:
+    """Read a stage file ``chunk_rows`` rows at a time.
+
+    CSV is parsed incrementally and npy frames are memory-mapped, so only one
+    chunk is in memory at a time; Parquet and Feather are read whole and sliced.
+    """
+    resolved = resolve_path(path, fmt)
+    fmt = _format_of(resolved)
+    if fmt == "csv":
+        chunks = pd.read_csv(resolved, chunksize=chunk_rows, dtype=dtype)
+    elif fmt == "npy":
+        rows = json.loads((resolved / MANIFEST_NAME).read_text())["rows"]
+        chunks = (
+            _read_npy_rows(resolved, slice(start, start + chunk_rows), None)
+            for start in range(0, rows, chunk_rows)
+        )
+    else:
+        frame = read_frame(resolved)
+        chunks = (
+            frame.iloc[start : start + chunk_rows].reset_index(drop=True)
+            for start in range(0, len(frame), chunk_rows)
+        )
+    for index, chunk in enumerate(chunks):
+        instrumentation.record_read(chunk, resolved if index == 0 else None)
+        yield chunk
+
+
+def last_timestamp(path: Path, fmt: str | None = None) -> pd.Timestamp | None:
+    last_row = tail(path, 1, fmt, columns=[TIME_COLUMN])
+    if last_row.empty:
+        return None
+    return pd.to_datetime(last_row[TIME_COLUMN], errors="coerce").iloc[0]
+
+
+def _append_npy_block(block_path: Path, values: np.ndarray) -> bool:
+    # Grow the array in place: rewrite the header with the new row count and add the
+    # bytes at the end. numpy pads .npy headers so the shape can grow without moving data.
+    with open(block_path, "r+b") as fp:
+        version = np.lib.format.read_magic(fp)
+        if version == (1, 0):
+            shape, fortran_order, dtype = np.lib.format.read_array_header_1_0(fp)
+        else:
+            shape, fortran_order, dtype = np.lib.format.read_array_header_2_0(fp)
+        data_offset = fp.tell()
+        if fortran_order or values.shape[1:] != shape[1:] or values.dtype.itemsize > dtype.itemsize:
+            return False
+
+        header = io.BytesIO()
+        header_data = {
+            "descr": np.lib.format.dtype_to_descr(dtype),
+            "fortran_order": False,
+            "shape": (shape[0] + len(values),) + shape[1:],
+        }
+        if version == (1, 0):
+            np.lib.format.write_array_header_1_0(header, header_data)
+        else:
+            np.lib.format.write_array_header_2_0(header, header_data)
+        if header.tell() != data_offset:
+            return False
+
+        fp.seek(0)
+        fp.write(header.getvalue())
+        fp.seek(0, io.SEEK_END)
+        fp.write(np.ascontiguousarray(values, dtype=dtype).tobytes())
+    return True
+
+
+def _append_npy(df: pd.DataFrame, path: Path) -> None:
+    manifest = json.loads((path / MANIFEST_NAME).read_text())
+    names = [entry["name"] for entry in manifest["columns"]]
+    if list(df.columns) != names:
+        raise ValueError(f"Cannot append to {path.name}: column layout differs")
+
+    df = _with_parsed_time(df)
+    for kind in dict.fromkeys(entry["block"] for entry in manifest["columns"]):
+        members = [entry["name"] for entry in manifest["columns"] if entry["block"] == kind]
+        if kind == "datetime64[ns]":
+            values = np.column_stack(
+                [df[column].to_numpy(dtype="datetime64[ns]").view("int64") for column in members]
+            )
+        elif kind == "str":
+            values = np.column_stack([df[column].astype(str).to_numpy(dtype=str) for column in members])
+        else:
+            values = df[members].to_numpy(dtype=kind)
+        if not _append_npy_block(path / f"{kind}.npy", values):
+            existing = np.load(path / f"{kind}.npy", allow_pickle=False)
+            np.save(path / f"{kind}.npy", np.concatenate([existing, values]), allow_pickle=False)
+
+    manifest["rows"] += len(df)
+    (path / MANIFEST_NAME).write_text(json.dumps(manifest, indent=2))
+
+
+def append(df: pd.DataFrame, path: Path, fmt: str | None = None) -> Path:
+    """Append rows to an existing stage file (creating it if it does not exist)."""
+    resolved = resolve_path(path, fmt)
+    if not resolved.exists():
+        write_frame(df, resolved)
+        instrumentation.record_write(df, resolved)
+        return resolved
+
+    size_before = instrumentation.path_bytes(resolved)
+    fmt = _format_of(resolved)
+    if fmt == "csv":
+        header = list(pd.read_csv(resolved, nrows=0).columns)
+        if list(df.columns) != header:
+            raise ValueError(f"Cannot append to {resolved.name}: column layout differs")
+        df.to_csv(resolved, mode="a", header=False, index=False)
+    elif fmt == "npy":
+        _append_npy(df, resolved)
+    else:
+        # Parquet/Feather files cannot grow in place; rewrite them whole.
+        write_frame(pd.concat([read_frame(resolved), df], ignore_index=True), resolved)
+    instrumentation.record_write(df, size=instrumentation.path_bytes(resolved) - size_before)
+    return resolved
+
+
+def _storage_size(path: Path) -> int:
+    if path.is_dir():
+        return sum(child.stat().st_size for child in path.iterdir())
+    return path.stat().st_size
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(
+        description="Convert stage files to another storage format and compare load times."
+    )
+    parser.add_argument("format", choices=sorted(FORMAT_SUFFIXES))
+    parser.add_argument("files", nargs="+", type=Path)
+    args = parser.parse_args()
+
+    for source in args.files:
+        target = convert(source, args.format)
+
+        start = time.perf_counter()
+        read_frame(source)
+        source_seconds = time.perf_counter() - start
+        start = time.perf_counter()
+        read_frame(target)
+        target_seconds = time.perf_counter() - start
+
+        print(f"--- {source.name} -> {target.name} ---")
+        print(f"Size: {_storage_size(source)} -> {_storage_size(target)} bytes")
+        print(f"Load time: {source_seconds * 1000:.1f} ms -> {target_seconds * 1000:.1f} ms")
+        print()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,167 @@
+from __future__ import annotations
+
+import argparse
+from pathlib import Path
+
+import numpy as np
+
+from lazy_imports import lazy_module
+
+pd = lazy_module("pandas")
+
+BASE_DIR = Path(__file__).resolve().parent
+RAW_COLUMNS = ["utc_time", "x_error (m)", "y_error (m)", "z_error (m)", "satclockerror (m)"]
+START_TIME = "2025-09-01 00:00:00"
+# Orbital periods the periodic part of the errors follows
+ORBIT_PERIOD_HOURS = {"MEO": 12.88, "GEO": 23.93}
+# Per-channel noise level (m), roughly that of the sample files
+CHANNEL_SCALE = np.array([0.5, 0.6, 0.6, 0.3])
+OUTLIER_SIGMAS = (8.0, 15.0)
+MEAN_GAP_ROWS = 50
+
+
+def _timestamps(start: pd.Timestamp, rows: int, cadence_seconds: float) -> pd.DatetimeIndex:
+    offsets = (np.arange(rows) * cadence_seconds * 1e9).astype("int64")
+    return pd.DatetimeIndex(start.value + offsets)
+
+
+def _format_timestamps(times: pd.DatetimeIndex, with_seconds: bool) -> np.ndarray:
+    # Same layout as the raw files ("9/1/2025 6:00"). strftime is the slowest part
+    # of generating 10^7 rows, so format each distinct day and each second of the
+    # day once and index into those tables.
+    days = times.normalize()
+    day_codes, unique_days = pd.factorize(days)
+    day_text = np.array([f"{day.month}/{day.day}/{day.year}" for day in unique_days], dtype=object)
+    second_of_day = ((times - days).total_seconds().to_numpy()).astype("int64")
+    clock_format = "{}:{:02d}:{:02d}" if with_seconds else "{}:{:02d}"
+    clock_text = np.array(
+        [
+            clock_format.format(second // 3600, second // 60 % 60, second % 60)
+            for second in range(86400)
+        ],
+        dtype=object,
+    )
+    return (pd.Series(day_text[day_codes]) + " " + clock_text[second_of_day]).to_numpy()
+
+
+def _gap_mask(rows: int, gap_fraction: float, rng: np.random.Generator) -> np.ndarray:
+    """Mark whole runs of rows as missing until about ``gap_fraction`` of them are."""
+    keep = np.ones(rows, dtype=bool)
+    target = int(rows * gap_fraction)
+    if target == 0:
+        return keep
+    lengths = rng.geometric(1 / MEAN_GAP_ROWS, size=max(1, 2 * target // MEAN_GAP_ROWS + 1))
+    lengths = lengths[: np.searchsorted(np.cumsum(lengths), target) + 1]
+    starts = rng.integers(0, rows, size=len(lengths))
+    for start, length in zip(starts, lengths):
+        keep[start : start + length] = False
+    return keep
+
+
+def generate_satellite(
+    label: str,
+    rows: int,
+    cadence_seconds: float = 60.0,
+    orbit: str = "MEO",
+    gap_fraction: float = 0.05,
+    outlier_fraction: float = 0.001,
+    start: str = START_TIME,
+    seed: int = 0,
+) -> pd.DataFrame:
+    """Raw error samples shaped like ``DATA_<label>_Train.csv``.
+
+    Each channel is a periodic orbit term plus a slow random-walk drift plus
+    white noise. ``gap_fraction`` of the samples are removed in runs, and
+    ``outlier_fraction`` of the values become spikes of 8-15 standard deviations.
+    """
+    rng = np.random.default_rng(seed)
+    times = _timestamps(pd.Timestamp(start), rows, cadence_seconds)
+
+    hours = np.arange(rows) * (cadence_seconds / 3600)
+    phase = 2 * np.pi * hours[:, None] / ORBIT_PERIOD_HOURS[orbit]
+    offsets = rng.uniform(0, 2 * np.pi, size=4)
+    periodic = np.sin(phase + offsets) * CHANNEL_SCALE
+    drift = np.cumsum(rng.normal(0, 1, size=(rows, 4)), axis=0)
+    drift *= CHANNEL_SCALE / np.sqrt(max(rows, 1))
+    values = periodic + drift + rng.normal(0, 1, size=(rows, 4)) * CHANNEL_SCALE * 0.3
+
+    outliers = rng.random(size=values.shape) < outlier_fraction
+    sigmas = rng.uniform(*OUTLIER_SIGMAS, size=int(outliers.sum()))
+    signs = rng.choice([-1.0, 1.0], size=len(sigmas))
+    values[outliers] += signs * sigmas * np.broadcast_to(CHANNEL_SCALE, values.shape)[outliers]
+
+    keep = _gap_mask(rows, gap_fraction, rng)
+    df = pd.DataFrame(values[keep], columns=RAW_COLUMNS[1:])
+    df.insert(0, "utc_time", _format_timestamps(times[keep], cadence_seconds % 60 != 0))
+
+    print(f"--- {label} ---")
+    print(f"Rows generated: {len(df)} ({rows - len(df)} removed as gaps)")
+    print(f"Outlier values injected: {int(outliers[keep].sum())}")
+    print(f"Time range: {times[0]} to {times[-1]}")
+    print()
+    return df
+
+
+def rows_for_years(years: float, cadence_seconds: float) -> int:
+    return int(years * 365.25 * 86400 / cadence_seconds)
+
+
+def write_fleet(
+    output_dir: Path,
+    satellites: int,
+    rows: int,
+    cadence_seconds: float = 60.0,
+    gap_fraction: float = 0.05,
+    outlier_fraction: float = 0.001,
+    seed: int = 0,
+) -> list[Path]:
+    """Write ``DATA_SYN<nnn>_Train.csv`` files, alternating MEO-like and GEO-like orbits."""
+    output_dir.mkdir(parents=True, exist_ok=True)
+    paths = []
+    for index in range(satellites):
+        label = f"SYN{index + 1:03d}"
+        df = generate_satellite(
+            label,
+            rows,
+            cadence_seconds,
+            "MEO" if index % 2 == 0 else "GEO",
+            gap_fraction,
+            outlier_fraction,
+            seed=seed + index,
+        )
+        path = output_dir / f"DATA_{label}_Train.csv"
+        df.to_csv(path, index=False)
+        print(f"Output saved to: {path}")
+        paths.append(path)
+    return paths
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description="Generate synthetic raw satellite error data.")
+    parser.add_argument("--output-dir", type=Path, default=BASE_DIR / "synthetic_data")
+    parser.add_argument("--satellites", type=int, default=1)
+    size = parser.add_mutually_exclusive_group()
+    size.add_argument("--rows", type=int, help="samples per satellite before gaps")
+    size.add_argument("--years", type=float, default=1.0, help="years of history per satellite")
+    parser.add_argument(
+        "--cadence", type=float, default=60.0, help="seconds between samples (may be < 60)"
+    )
+    parser.add_argument("--gap-fraction", type=float, default=0.05)
+    parser.add_argument("--outlier-fraction", type=float, default=0.001)
+    parser.add_argument("--seed", type=int, default=0)
+    args = parser.parse_args()
+
+    rows = args.rows if args.rows is not None else rows_for_years(args.years, args.cadence)
+    write_fleet(
+        args.output_dir,
+        args.satellites,
+        rows,
+        args.cadence,
+        args.gap_fraction,
+        args.outlier_fraction,
+        args.seed,
+    )
+
+
+if __name__ == "__main__":
+    main()
@@ -1,51 +1,122 @@
 from __future__ import annotations
 
+import argparse
+import contextlib
+import io
+import time
 from pathlib import Path
 
-import pandas as pd
+import numpy as np
+from numpy.lib.stride_tricks import sliding_window_view
 
-TARGET_COLUMNS = ["x_error", "y_error", "z_error", "satclockerror"]
-NORMALIZED_TARGETS = {"".join(col.lower().split("_")): col for col in TARGET_COLUMNS}
+import ingestion
+import instrumentation
+import smoothing_filters
+import storage
+from lazy_imports import lazy_module
+
+pd = lazy_module("pandas")
+
+ZSCORE_THRESHOLD = 3
 INPUT_DIR = Path(__file__).resolve().parent / "15min_resampled"
 DATASETS = {
     "MEO": (INPUT_DIR / "MEO_15min_raw.csv", INPUT_DIR / "MEO_Zscore_outliers_removed.csv"),
     "GEO": (INPUT_DIR / "GEO_15min_raw.csv", INPUT_DIR / "GEO_Zscore_outliers_removed.csv"),
 }
+# global: one mean/std per column over the whole history (two passes).
+# rolling: median/MAD of the previous ROBUST_WINDOW rows, vectorised over all columns.
+# online: the rolling filter fed batch by batch with bounded memory, as for live data.
+OUTLIER_MODES = ("global", "rolling", "online")
+OUTLIER_MODE = "global"
+ROBUST_WINDOW = 96  # one day of 15-minute rows
+ROBUST_MIN_PERIODS = 24
+# Scales the MAD to the standard deviation of normal data, so ZSCORE_THRESHOLD
+# means the same number of sigmas in every mode
+MAD_SCALE = smoothing_filters.MAD_SCALE
+# Rows per block of window statistics (memory is rows x columns x window floats)
+ROBUST_BLOCK_ROWS = 16_384
+ONLINE_BATCH_ROWS = 4_096
 
 
-def _normalize_column_name(name: str) -> str:
-    base = name.split("(")[0]
-    base = base.strip().lower().replace(" ", "").replace("_", "")
-    return base
+def rolling_robust_mask(
+    values: np.ndarray,
+    history: np.ndarray | None = None,
+    window: int = ROBUST_WINDOW,
+    threshold: float = ZSCORE_THRESHOLD,
+) -> np.ndarray:
+    """Flag values more than ``threshold`` scaled MADs from the median of the previous ``window`` rows.
 
+    ``values`` is ``(rows, columns)`` on an evenly spaced grid, and ``history``
+    holds the rows that came before it. Windows only look back, so a value never
+    shifts its own median and a row's verdict does not change when later rows
+    arrive. Windows with fewer than ``ROBUST_MIN_PERIODS`` values, or a MAD of
+    zero, flag nothing.
+    """
+    if window < 2:
+        raise ValueError(f"The robust window needs at least 2 rows, got {window}")
+    rows, columns = values.shape
+    history = np.empty((0, columns)) if history is None else history[-window:]
+    padding = np.full((window - len(history), columns), np.nan)
+    padded = np.concatenate([padding, history, values])
 
-def _select_numeric_columns(df: pd.DataFrame) -> dict[str, str]:
-    mapping: dict[str, str] = {}
-    for column in df.columns:
-        if column.lower() == "utc_time":
-            continue
-        normalized = _normalize_column_name(column)
-        for normalized_target, target in NORMALIZED_TARGETS.items():
-            if normalized.startswith(normalized_target) and target not in mapping:
-                mapping[target] = column
-                break
-    missing = [target for target in TARGET_COLUMNS if target not in mapping]
-    if missing:
-        raise ValueError(f"Missing expected columns: {', '.join(missing)}")
-    return mapping
-
-
-def process_dataset(label: str, input_path: Path, output_path: Path) -> None:
-    df = pd.read_csv(input_path)
-    df["utc_time"] = pd.to_datetime(df["utc_time"], errors="coerce")
-
-    column_map = _select_numeric_columns(df)
-    total_outliers = 0
+    mask = np.zeros((rows, columns), dtype=bool)
+    for start in range(0, rows, ROBUST_BLOCK_ROWS):
+        stop = min(start + ROBUST_BLOCK_ROWS, rows)
+        # (rows, columns, window): row i of the block sees the ``window`` rows before it
+        windows = sliding_window_view(padded[start : stop + window - 1], window, axis=0)
+        count = window - np.isnan(windows).sum(axis=-1)
+        median = smoothing_filters.sorted_median(np.sort(windows, axis=-1), count)
+        mad = smoothing_filters.sorted_median(np.sort(np.abs(windows - median[..., None]), axis=-1), count)
+        deviation = np.abs(values[start:stop] - median)
+        mask[start:stop] = (
+            (count >= ROBUST_MIN_PERIODS) & (mad > 0) & (deviation > threshold * MAD_SCALE * mad)
+        )
+    return mask
 
-    print(f"--- {label} ---")
-    print(f"Total rows: {len(df)}")
 
-    for target in TARGET_COLUMNS:
+class StreamingOutlierFilter:
+    """The rolling median/MAD filter, fed rows as they arrive.
+
+    Only the last ``window`` raw rows are kept between batches, so memory is
+    bounded however long the stream runs, and the masks equal those of
+    :func:`rolling_robust_mask` over the whole series whatever the batch sizes.
+    """
+
+    def __init__(
+        self, columns: int, window: int = ROBUST_WINDOW, threshold: float = ZSCORE_THRESHOLD
+    ) -> None:
+        self.window = window
+        self.threshold = threshold
+        self.history = np.empty((0, columns))
+        self.rows = 0
+        self.outliers = np.zeros(columns, dtype=np.int64)
+
+    def update(self, values: np.ndarray) -> np.ndarray:
+        """Outlier mask of the next ``(rows, columns)`` batch."""
+        mask = rolling_robust_mask(values, self.history, self.window, self.threshold)
+        self.history = np.concatenate([self.history, values])[-self.window :]
+        self.rows += len(values)
+        self.outliers += mask.sum(axis=0)
+        return mask
+
+
+def _online_mask(values: np.ndarray) -> np.ndarray:
+    stream = StreamingOutlierFilter(values.shape[1])
+    masks = [
+        stream.update(values[start : start + ONLINE_BATCH_ROWS])
+        for start in range(0, len(values), ONLINE_BATCH_ROWS)
+    ]
+    return np.concatenate(masks) if masks else np.zeros(values.shape, dtype=bool)
+
+
+def _print_throughput(mode: str, rows: int, seconds: float) -> None:
+    rate = rows / seconds if seconds > 0 else float("inf")
+    print(f"Mode: {mode} | {rows} rows in {seconds:.3f} s ({rate:,.0f} rows/s)")
+
+
+def _replace_global(df: pd.DataFrame, column_map: dict[str, str]) -> int:
+    total_outliers = 0
+    for target in ingestion.NUMERIC_COLUMNS:
         column = column_map[target]
         series = pd.to_numeric(df[column], errors="coerce")
         mean = series.mean()
@@ -55,21 +126,133 @@ def process_dataset(label: str, input_path: Path, output_path: Path) -> None:
             outliers = 0
         else:
             z_scores = (series - mean) / std
-            mask = z_scores.abs() > 3
+            mask = z_scores.abs() > ZSCORE_THRESHOLD
             outliers = int(mask.sum())
             df.loc[mask, column] = pd.NA
 
         total_outliers += outliers
         print(f"{column}: mean={mean:.6f} std={std:.6f} | outliers replaced: {outliers}")
+    return total_outliers
+
 
-    print(f"Total outlier values replaced: {total_outliers}\n")
+def _replace_robust(df: pd.DataFrame, column_map: dict[str, str], mode: str) -> int:
+    columns = [column_map[target] for target in ingestion.NUMERIC_COLUMNS]
+    values = df[columns].apply(pd.to_numeric, errors="coerce").to_numpy(dtype="float64")
+    mask = rolling_robust_mask(values) if mode == "rolling" else _online_mask(values)
+    values[mask] = np.nan
+    df[columns] = values
+    for column, outliers in zip(columns, mask.sum(axis=0)):
+        print(f"{column}: outliers replaced: {outliers}")
+    return int(mask.sum())
 
-    df.to_csv(output_path, index=False)
+
+def process_frame(label: str, df: pd.DataFrame, mode: str = OUTLIER_MODE) -> pd.DataFrame:
+    if mode not in OUTLIER_MODES:
+        raise ValueError(f"Unknown outlier mode '{mode}', expected one of: {', '.join(OUTLIER_MODES)}")
+    df = df.copy()
+    df["utc_time"] = ingestion.parse_times(df["utc_time"])
+
+    column_map = ingestion.resolve_columns(df.columns)
+
+    print(f"--- {label} ---")
+    print(f"Total rows: {len(df)}")
+
+    start = time.perf_counter()
+    if mode == "global":
+        total_outliers = _replace_global(df, column_map)
+    else:
+        total_outliers = _replace_robust(df, column_map, mode)
+    elapsed = time.perf_counter() - start
+
+    print(f"Total outlier values replaced: {total_outliers}")
+    _print_throughput(mode, len(df), elapsed)
+    print()
+    return df
+
+
+def stream_dataset(
+    label: str, input_path: Path, output_path: Path, batch_rows: int = ONLINE_BATCH_ROWS
+) -> None:
+    """Online mode on a stage file: read, clean and write one batch at a time."""
+    start = time.perf_counter()
+    stream = None
+    columns: list[str] = []
+    for batch in ingestion.iter_chunks(input_path, batch_rows):
+        if stream is None:
+            column_map = ingestion.resolve_columns(batch.columns)
+            columns = [column_map[target] for target in ingestion.NUMERIC_COLUMNS]
+            stream = StreamingOutlierFilter(len(columns))
+            # The first batch replaces any earlier output; the rest are appended to it
+            storage.save(batch.iloc[:0], output_path)
+        values = batch[columns].to_numpy(dtype="float64")
+        values[stream.update(values)] = np.nan
+        batch[columns] = values
+        storage.append(batch, output_path)
+
+    print(f"--- {label} ---")
+    if stream is None:
+        print("Total rows: 0\n")
+        return
+    print(f"Total rows: {stream.rows}")
+    for column, outliers in zip(columns, stream.outliers):
+        print(f"{column}: outliers replaced: {outliers}")
+    print(f"Total outlier values replaced: {int(stream.outliers.sum())}")
+    _print_throughput("online", stream.rows, time.perf_counter() - start)
+    print()
+
+
+@instrumentation.instrumented("zscore")
+def process_dataset(
+    label: str, input_path: Path, output_path: Path, mode: str = OUTLIER_MODE
+) -> None:
+    if mode == "online":
+        stream_dataset(label, input_path, output_path)
+        return
+    df = ingestion.load(input_path)
+    storage.save(process_frame(label, df, mode), output_path)
+
+
+def compare_modes(label: str, input_path: Path) -> pd.DataFrame:
+    """Outliers found per column and throughput of every mode on one dataset."""
+    df = ingestion.load(input_path)
+    nans_before = df.isna().sum()
+    column_map = ingestion.resolve_columns(df.columns)
+    rows = []
+    for mode in OUTLIER_MODES:
+        start = time.perf_counter()
+        with contextlib.redirect_stdout(io.StringIO()):
+            cleaned = process_frame(label, df, mode)
+        seconds = time.perf_counter() - start
+        replaced = cleaned.isna().sum() - nans_before
+        row = {"mode": mode}
+        row.update({target: int(replaced[column_map[target]]) for target in ingestion.NUMERIC_COLUMNS})
+        row.update(
+            total=int(replaced.sum()),
+            seconds=round(seconds, 4),
+            rows_per_second=round(len(df) / seconds) if seconds > 0 else None,
+        )
+        rows.append(row)
+    return pd.DataFrame(rows)
 
 
 def main() -> None:
+    parser = argparse.ArgumentParser(description="Replace outliers with NaN.")
+    parser.add_argument("--mode", choices=OUTLIER_MODES, default=OUTLIER_MODE)
+    parser.add_argument(
+        "--compare",
+        action="store_true",
+        help="only report the outliers and throughput of every mode, without writing",
+    )
+    args = parser.parse_args()
+
     for label, (input_path, output_path) in DATASETS.items():
-        process_dataset(label, input_path, output_path)
+        if args.compare:
+            print(f"--- {label} ---")
+            print(compare_modes(label, input_path).to_string(index=False))
+            print()
+            continue
+        process_dataset(label, input_path, output_path, args.mode)
+    instrumentation.print_summary()
 
 
 if __name__ == "__main__":